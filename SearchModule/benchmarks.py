@@ -0,0 +1,412 @@
+import argparse
+import glob
+import itertools
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+try:
+    from .impact_index import ImpactIndex, ImpactRetrieval, write_impact_index
+    from .indexer import MergedFieldsView, open_index
+    from .lsa_index import HybridRetrieval, LSARetrieval, build_lsa_index
+    from .models import TFIDFRetrieval
+    from .preprocessor import TextPreprocessor
+    from .search import QueryProcessor
+    from .sparse_scoring import SparseTFIDFRetrieval
+except ImportError:
+    from impact_index import ImpactIndex, ImpactRetrieval, write_impact_index
+    from indexer import MergedFieldsView, open_index
+    from lsa_index import HybridRetrieval, LSARetrieval, build_lsa_index
+    from models import TFIDFRetrieval
+    from preprocessor import TextPreprocessor
+    from search import QueryProcessor
+    from sparse_scoring import SparseTFIDFRetrieval
+
+# 性能基准
+#
+# 用法：python benchmarks.py tokenizer [sample/*.json] --repeat 50
+#       python benchmarks.py phrase [index.bin] --terms 12
+#       python benchmarks.py boolean [index.bin] --terms 8
+#       python benchmarks.py topk [index.bin] --k 10
+#       python benchmarks.py sparse [index.bin] --matrix index.tfidf.npz --batch 64
+#       python benchmarks.py impact [index.bin] --impact index.impact --k 10
+#       python benchmarks.py lsa [index.bin] --model index.lsa.npz --k 10
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample')
+DEFAULT_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.txt')
+
+
+def default_inputs():
+    """默认使用仓库 sample/ 目录下的数据"""
+    return sorted(glob.glob(os.path.join(SAMPLE_DIR, '*.json')) + glob.glob(os.path.join(SAMPLE_DIR, '*.jsonl')))
+
+
+def timed(func, repeat):
+    """运行 repeat 次，返回最快一次的耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def legacy_process_text(preprocessor, text, stem=None):
+    """
+    原先的 process_text 实现：多次扫描、生成多个中间列表
+    :param stem: 词干提取函数，默认逐词调用词干提取器（不使用缓存）
+    """
+    if text is None:
+        return "未读取到文本"
+    text = re.sub(r'-', ' ', text)
+    tokens = re.findall(r'\b\w+\b', text.lower())
+    if preprocessor.remove_stop_words:
+        tokens = [token for token in tokens if token not in preprocessor.stop_words]
+    if preprocessor.apply_stemming:
+        stem = stem or preprocessor.stem_cache.stemmer.stem
+        tokens = [stem(token) for token in tokens]
+    return tokens
+
+
+def iter_texts(preprocessor, file_paths):
+    """与 process_document 相同的字段文本"""
+    for file_path in file_paths:
+        for document in preprocessor.iter_documents(file_path):
+            yield document['title']
+            yield document['director']
+            yield ', '.join(document['cast_character'].keys())
+            yield document['plot']
+
+
+def bench_tokenizer(args):
+    file_paths = args.inputs or default_inputs()
+    texts = list(iter_texts(TextPreprocessor(), file_paths))
+    print(f"{len(texts)} 段文本，来自 {len(file_paths)} 个文件")
+
+    for remove_stop_words in (True, False):
+        for apply_stemming in (True, False):
+            preprocessor = TextPreprocessor(remove_stop_words=remove_stop_words, apply_stemming=apply_stemming)
+            legacy = [legacy_process_text(preprocessor, text) for text in texts]
+            fused = [preprocessor.process_text(text) for text in texts]
+            offsets = [[term for term, _, _ in preprocessor.tokenize_with_offsets(text)] for text in texts]
+            assert fused == legacy, "fused tokenizer output differs from the legacy implementation"
+            assert all(a == b for a, b in zip(offsets, legacy) if b != "未读取到文本")
+
+            # 分别给出不带 / 带词干缓存的原实现，区分缓存与单次扫描各自的收益
+            stem = preprocessor.stem_cache.__getitem__ if apply_stemming else None
+            legacy_time = timed(lambda: [legacy_process_text(preprocessor, text) for text in texts], args.repeat)
+            cached_time = timed(lambda: [legacy_process_text(preprocessor, text, stem) for text in texts], args.repeat)
+            fused_time = timed(lambda: [preprocessor.process_text(text) for text in texts], args.repeat)
+            offsets_time = timed(lambda: [preprocessor.tokenize_with_offsets(text) for text in texts], args.repeat)
+            print(f"stop_words={remove_stop_words!s:5} stemming={apply_stemming!s:5}  "
+                  f"legacy {legacy_time * 1000:8.2f} ms  legacy+cache {cached_time * 1000:8.2f} ms  "
+                  f"fused {fused_time * 1000:8.2f} ms ({cached_time / fused_time:4.2f}x)  "
+                  f"with offsets {offsets_time * 1000:8.2f} ms")
+
+
+def legacy_phrase_doc_ids(index, field, terms):
+    """原先的短语匹配：对第一个词的每个文档逐个查找其余词，再用位移后的位置集合判断是否相邻"""
+    if field not in index or terms[0] not in index[field]:
+        return set()
+    candidates = defaultdict(list)
+    for doc_id, positions in index[field][terms[0]].items():
+        all_positions = [positions]
+        for term in terms[1:]:
+            if term not in index[field] or doc_id not in index[field][term]:
+                break
+            all_positions.append(index[field][term][doc_id])
+        else:
+            candidates[doc_id] = all_positions
+    found = set()
+    for doc_id, positions_list in candidates.items():
+        position_set = set()
+        for i, positions in enumerate(positions_list):
+            for pos in positions:
+                position_set.add(pos + (len(positions_list) - 1 - i))
+        if len(position_set) < sum(len(pos) for pos in positions_list):
+            found.add(doc_id)
+    return found
+
+
+def bench_phrase(args):
+    index = open_index(args.index)
+    query_processor = QueryProcessor(index, TextPreprocessor())
+    plot = index.index[args.field]
+    df = plot.df if hasattr(plot, 'df') else (lambda term: len(plot[term]))
+    common = sorted(plot, key=df, reverse=True)[:args.terms]
+    print(f"{args.field} 中 df 最高的 {len(common)} 个词：" + ', '.join(f'{term}({df(term)})' for term in common))
+    # 预先解码，排除二进制索引首次解码的开销
+    for term in common:
+        plot[term]
+
+    for length in (2, 3):
+        phrases = list(itertools.permutations(common, length))[:args.max_phrases]
+        legacy = [legacy_phrase_doc_ids(query_processor.index, args.field, list(terms)) for terms in phrases]
+        linear = [set(query_processor.phrase_doc_ids(args.field, list(terms))) for terms in phrases]
+        # 两个词的短语原实现是正确的，结果必须一致；三个及以上的词原实现可能误匹配
+        mismatched = sum(a != b for a, b in zip(legacy, linear))
+        if length == 2:
+            assert mismatched == 0, "linear phrase matching differs from the legacy implementation"
+        legacy_time = timed(
+            lambda: [legacy_phrase_doc_ids(query_processor.index, args.field, list(terms)) for terms in phrases],
+            args.repeat)
+        linear_time = timed(
+            lambda: [set(query_processor.phrase_doc_ids(args.field, list(terms))) for terms in phrases], args.repeat)
+        print(f"{length} 词短语 x{len(phrases)}：legacy {legacy_time * 1000:8.1f} ms  "
+              f"linear {linear_time * 1000:8.1f} ms ({legacy_time / linear_time:4.1f}x)  "
+              f"匹配文档 {sum(map(len, legacy))} -> {sum(map(len, linear))}，结果不同的短语 {mismatched} 个")
+
+
+def bench_boolean(args):
+    index = open_index(args.index)
+    preprocessor = TextPreprocessor()
+    with_sets = QueryProcessor(index, preprocessor, use_bitmaps=False)
+    with_bitmaps = QueryProcessor(index, preprocessor)
+    plot = index.index[args.field]
+    df = plot.df if hasattr(plot, 'df') else (lambda term: len(plot[term]))
+    common = sorted(plot, key=df, reverse=True)[:args.terms]
+    print(f"{args.field} 中 df 最高的 {len(common)} 个词，文档总数 {len(with_sets.all_doc_ids())}")
+    for term in common:
+        plot[term]
+
+    pairs = list(itertools.combinations(common, 2))
+    templates = {
+        'a OR b': '{f}:{a} OR {f}:{b}',
+        'a AND b': '{f}:{a} AND {f}:{b}',
+        'a AND NOT b': '{f}:{a} AND NOT {f}:{b}',
+        'NOT a': 'NOT {f}:{a}',
+    }
+    for name, template in templates.items():
+        queries = [template.format(f=args.field, a=a, b=b) for a, b in pairs]
+        expected = [with_sets.query(query) for query in queries]
+        assert all(set(with_bitmaps.query(query)) == result for query, result in zip(queries, expected)), \
+            "bitmap evaluation differs from set evaluation"
+        set_time = timed(lambda: [with_sets.query(query) for query in queries], args.repeat)
+        bitmap_time = timed(lambda: [with_bitmaps.query(query) for query in queries], args.repeat)
+        print(f"{name:12} x{len(queries)}：sets {set_time * 1000:8.1f} ms  "
+              f"bitmaps {bitmap_time * 1000:8.1f} ms ({set_time / bitmap_time:5.1f}x)  "
+              f"平均结果 {sum(map(len, expected)) // len(expected)} 篇")
+
+
+class IndexTerms:
+    """查询直接由索引中的词项组成，按空白切分即可，不再做词干提取"""
+
+    def process_text(self, text):
+        return text.split()
+
+
+def bench_topk(args):
+    index = open_index(args.index)
+    retrieval = TFIDFRetrieval(MergedFieldsView(index.index), IndexTerms(), stats=index.stats)
+    plot = index.index[args.field]
+    df = plot.df if hasattr(plot, 'df') else (lambda term: len(plot[term]))
+    terms = sorted(plot, key=df, reverse=True)
+    common = terms[:args.terms]
+    print(f"{args.field} 中 df 最高的 {len(common)} 个词（df {df(common[-1])}-{df(common[0])}），文档总数 {index.num_docs}")
+
+    rng = random.Random(0)
+    for length in (2, 5, 10, 20):
+        # 长的自由文本查询：大部分是常见的剧情词，再加一个较少见的词
+        queries = [' '.join(rng.sample(common, min(length - 1, len(common))) + [rng.choice(terms)])
+                   for _ in range(args.queries)]
+        expected = [retrieval.compute_tfidf_scores(query)[:args.k] for query in queries]
+        assert all(retrieval.top_k(query, args.k) == result for query, result in zip(queries, expected)), \
+            "top-k results differ from the exhaustive ranking"
+        full_time = timed(lambda: [retrieval.compute_tfidf_scores(query)[:args.k] for query in queries], args.repeat)
+        top_k_time = timed(lambda: [retrieval.top_k(query, args.k) for query in queries], args.repeat)
+        print(f"{length:2} 个词 x{len(queries)}：exhaustive {full_time * 1000:8.1f} ms  "
+              f"top-{args.k} {top_k_time * 1000:8.1f} ms ({full_time / top_k_time:5.1f}x)")
+
+
+def bench_sparse(args):
+    index = open_index(args.index)
+    retrieval = TFIDFRetrieval(MergedFieldsView(index.index), IndexTerms(), stats=index.stats)
+    start = time.perf_counter()
+    if args.matrix:
+        sparse_retrieval = SparseTFIDFRetrieval.load(args.matrix, IndexTerms())
+    else:
+        sparse_retrieval = SparseTFIDFRetrieval.from_index(index, IndexTerms())
+    print(f"矩阵 {sparse_retrieval.matrix.shape[0]} x {sparse_retrieval.matrix.shape[1]}，"
+          f"{sparse_retrieval.matrix.nnz} 个非零项，{'载入' if args.matrix else '编译'}用时 {time.perf_counter() - start:.2f}s")
+
+    plot = index.index[args.field]
+    terms = list(plot)
+    rng = random.Random(0)
+    queries = [' '.join(rng.sample(terms, rng.randint(1, args.max_terms))) for _ in range(args.queries)]
+    for query in queries:
+        expected = dict(retrieval.compute_tfidf_scores(query))
+        scores = dict(sparse_retrieval.compute_tfidf_scores(query))
+        assert expected.keys() == scores.keys() and all(
+            abs(expected[doc_id] - score) <= 1e-9 * max(1.0, score) for doc_id, score in scores.items()
+        ), "sparse scores differ from TFIDFRetrieval"
+
+    k = args.k
+    batches = [queries[i:i + args.batch] for i in range(0, len(queries), args.batch)]
+    engines = {
+        'TFIDFRetrieval': lambda: [retrieval.compute_tfidf_scores(query)[:k] for query in queries],
+        'TFIDFRetrieval.top_k': lambda: [retrieval.top_k(query, k) for query in queries],
+        'sparse top_k': lambda: [sparse_retrieval.top_k(query, k) for query in queries],
+        f'sparse batch {args.batch}': lambda: [sparse_retrieval.score_batch(batch, k) for batch in batches],
+    }
+    for name, run in engines.items():
+        elapsed = timed(run, args.repeat)
+        print(f"{name:24} {len(queries) / elapsed:9.1f} queries/s")
+
+
+def bench_impact(args):
+    index = open_index(args.index)
+    retrieval = TFIDFRetrieval(MergedFieldsView(index.index), IndexTerms(), stats=index.stats)
+    # 未指定 --impact 时生成到临时目录：app.py 会自动载入索引旁的 <index>.impact，不能在那里留下文件
+    tmp_dir = tempfile.mkdtemp(prefix='bench_impact_') if args.impact is None else None
+    try:
+        impact_path = args.impact
+        if impact_path is None:
+            impact_path = os.path.join(tmp_dir, 'index.impact')
+            start = time.perf_counter()
+            write_impact_index(index, impact_path)
+            print(f"已生成临时的影响值索引，用时 {time.perf_counter() - start:.1f}s")
+        impact_retrieval = ImpactRetrieval(ImpactIndex(impact_path), IndexTerms())
+
+        plot = index.index[args.field]
+        df = plot.df if hasattr(plot, 'df') else (lambda term: len(plot[term]))
+        terms = sorted(plot, key=df, reverse=True)
+        common = terms[:args.terms]
+        rng = random.Random(0)
+        k = args.k
+        for length in (2, 5, 10, 20):
+            queries = [' '.join(rng.sample(common, min(length - 1, len(common))) + [rng.choice(terms)])
+                       for _ in range(args.queries)]
+            expected = [impact_retrieval.compute_scores(query)[:k] for query in queries]
+            assert all(impact_retrieval.top_k(query, k) == result for query, result in zip(queries, expected)), \
+                "early-terminated results differ from the full impact ranking"
+            exact = [{doc_id for doc_id, _ in retrieval.top_k(query, k)} for query in queries]
+            overlap = sum(len(found & {doc_id for doc_id, _ in result}) for found, result in zip(exact, expected))
+            full_time = timed(lambda: [retrieval.compute_tfidf_scores(query)[:k] for query in queries], args.repeat)
+            top_k_time = timed(lambda: [retrieval.top_k(query, k) for query in queries], args.repeat)
+            impact_time = timed(lambda: [impact_retrieval.top_k(query, k) for query in queries], args.repeat)
+            print(f"{length:2} 个词 x{len(queries)}：exhaustive {full_time * 1000:8.1f} ms  "
+                  f"MaxScore {top_k_time * 1000:8.1f} ms  impact {impact_time * 1000:8.1f} ms "
+                  f"({full_time / impact_time:5.1f}x)  与精确 TF-IDF 前 {k} 的重合率 {overlap / (k * len(queries)):.3f}")
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def bench_lsa(args):
+    index = open_index(args.index)
+    # 未指定 --model 时生成到临时目录：app.py 会自动载入索引旁的 <index>.lsa.npz，不能在那里留下文件
+    tmp_dir = tempfile.mkdtemp(prefix='bench_lsa_') if args.model is None else None
+    try:
+        model_path = args.model
+        if model_path is None:
+            model_path = os.path.join(tmp_dir, 'index.lsa.npz')
+            start = time.perf_counter()
+            num_docs, dims, num_lists = build_lsa_index(index, model_path, dims=args.dims)
+            print(f"已生成临时的 LSA 模型（{dims} 维，{num_lists} 个列表），用时 {time.perf_counter() - start:.1f}s")
+        lsa = LSARetrieval(model_path, IndexTerms())
+        retrieval = TFIDFRetrieval(MergedFieldsView(index.index), IndexTerms(), stats=index.stats)
+        hybrid = HybridRetrieval(retrieval, lsa, index.stats.doc_table)
+        print(f"{len(lsa.doc_ids)} 篇文档，{lsa.embeddings.shape[1]} 维，{lsa.num_lists} 个 IVF 列表")
+
+        # 自由文本查询：从随机文档的剧情中取几个词
+        field_index = index.index[args.field]
+        doc_terms = defaultdict(list)
+        for term in field_index:
+            if term in lsa.vocabulary:
+                for doc_id in field_index[term]:
+                    doc_terms[doc_id].append(term)
+        rng = random.Random(0)
+        candidates = sorted(doc_id for doc_id, terms in doc_terms.items() if len(terms) >= 3)
+        queries = [' '.join(rng.sample(doc_terms[doc_id], min(args.terms, len(doc_terms[doc_id]))))
+                   for doc_id in rng.sample(candidates, min(args.queries, len(candidates)))]
+
+        k = args.k
+        exact = [{doc_id for doc_id, _ in lsa.search_exact(query, k)} for query in queries]
+        brute_time = timed(lambda: [lsa.search_exact(query, k) for query in queries], args.repeat)
+        print(f"brute force       {brute_time * 1000 / len(queries):8.3f} ms/query")
+        nprobe = 1
+        while True:
+            found = [{doc_id for doc_id, _ in lsa.search(query, k, nprobe)} for query in queries]
+            recall = sum(len(a & b) for a, b in zip(found, exact)) / max(1, sum(map(len, exact)))
+            elapsed = timed(lambda: [lsa.search(query, k, nprobe) for query in queries], args.repeat)
+            print(f"IVF nprobe {nprobe:4}  {elapsed * 1000 / len(queries):8.3f} ms/query  recall@{k} {recall:.3f}  "
+                  f"({brute_time / elapsed:5.1f}x)")
+            if nprobe >= lsa.num_lists:
+                break
+            nprobe = min(nprobe * 2, lsa.num_lists)
+        lexical_time = timed(lambda: [retrieval.top_k(query, k) for query in queries], args.repeat)
+        hybrid_time = timed(lambda: [hybrid.top_k(query, k) for query in queries], args.repeat)
+        print(f"TF-IDF top_k      {lexical_time * 1000 / len(queries):8.3f} ms/query")
+        print(f"hybrid (RRF)      {hybrid_time * 1000 / len(queries):8.3f} ms/query")
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the search module.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    tokenizer_parser = subparsers.add_parser('tokenizer', help='fused tokenizer vs the original process_text')
+    tokenizer_parser.add_argument('inputs', nargs='*', help='.json / .jsonl files (default: sample/)')
+    tokenizer_parser.add_argument('--repeat', type=int, default=20, help='runs per measurement (best is reported)')
+    tokenizer_parser.set_defaults(func=bench_tokenizer)
+    phrase_parser = subparsers.add_parser('phrase', help='linear-merge phrase matching vs the original set check')
+    phrase_parser.add_argument('index', nargs='?', default=DEFAULT_INDEX, help='text or binary index')
+    phrase_parser.add_argument('--field', default='plot')
+    phrase_parser.add_argument('--terms', type=int, default=8, help='number of most frequent terms to combine')
+    phrase_parser.add_argument('--max-phrases', type=int, default=50)
+    phrase_parser.add_argument('--repeat', type=int, default=3)
+    phrase_parser.set_defaults(func=bench_phrase)
+    boolean_parser = subparsers.add_parser('boolean', help='bitmap vs set evaluation of broad boolean queries')
+    boolean_parser.add_argument('index', nargs='?', default=DEFAULT_INDEX, help='text or binary index')
+    boolean_parser.add_argument('--field', default='plot')
+    boolean_parser.add_argument('--terms', type=int, default=8, help='number of most frequent terms to combine')
+    boolean_parser.add_argument('--repeat', type=int, default=3)
+    boolean_parser.set_defaults(func=bench_boolean)
+    topk_parser = subparsers.add_parser('topk', help='MaxScore top-k vs exhaustive TF-IDF ranking')
+    topk_parser.add_argument('index', nargs='?', default=DEFAULT_INDEX, help='text or binary index')
+    topk_parser.add_argument('--field', default='plot')
+    topk_parser.add_argument('--terms', type=int, default=200, help='size of the common-term pool queries draw from')
+    topk_parser.add_argument('--queries', type=int, default=20)
+    topk_parser.add_argument('--k', type=int, default=10)
+    topk_parser.add_argument('--repeat', type=int, default=3)
+    topk_parser.set_defaults(func=bench_topk)
+    sparse_parser = subparsers.add_parser('sparse', help='query throughput of sparse matrix TF-IDF scoring')
+    sparse_parser.add_argument('index', nargs='?', default=DEFAULT_INDEX, help='text or binary index')
+    sparse_parser.add_argument('--matrix', default=None, help='.npz from sparse_scoring.py (default: compile now)')
+    sparse_parser.add_argument('--field', default='plot', help='field whose terms queries are drawn from')
+    sparse_parser.add_argument('--queries', type=int, default=200)
+    sparse_parser.add_argument('--max-terms', type=int, default=8, help='maximum terms per query')
+    sparse_parser.add_argument('--batch', type=int, default=64, help='queries per batched multiplication')
+    sparse_parser.add_argument('--k', type=int, default=10)
+    sparse_parser.add_argument('--repeat', type=int, default=3)
+    sparse_parser.set_defaults(func=bench_sparse)
+    impact_parser = subparsers.add_parser('impact', help='score-at-a-time impact-ordered ranking vs TF-IDF')
+    impact_parser.add_argument('index', nargs='?', default=DEFAULT_INDEX, help='text or binary index')
+    impact_parser.add_argument('--impact', default=None, help='impact index (default: built in a temporary directory)')
+    impact_parser.add_argument('--field', default='plot')
+    impact_parser.add_argument('--terms', type=int, default=200, help='size of the common-term pool queries draw from')
+    impact_parser.add_argument('--queries', type=int, default=20)
+    impact_parser.add_argument('--k', type=int, default=10)
+    impact_parser.add_argument('--repeat', type=int, default=3)
+    impact_parser.set_defaults(func=bench_impact)
+    lsa_parser = subparsers.add_parser('lsa', help='IVF recall@k and latency vs brute-force LSA search')
+    lsa_parser.add_argument('index', nargs='?', default=DEFAULT_INDEX, help='text or binary index')
+    lsa_parser.add_argument('--model', default=None, help='.npz from lsa_index.py (default: built in a temporary directory)')
+    lsa_parser.add_argument('--dims', type=int, default=128, help='dimensions when the model is built')
+    lsa_parser.add_argument('--field', default='plot', help='field whose terms queries are drawn from')
+    lsa_parser.add_argument('--terms', type=int, default=6, help='terms per query')
+    lsa_parser.add_argument('--queries', type=int, default=200)
+    lsa_parser.add_argument('--k', type=int, default=10)
+    lsa_parser.add_argument('--repeat', type=int, default=3)
+    lsa_parser.set_defaults(func=bench_lsa)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import Pool
+
+try:
+    from .impact_index import write_impact_index
+    from .index_format import merge_indexes
+    from .lsa_index import build_lsa_index
+    from .indexer import PositionalInvertedIndex
+    from .mmap_index import MmapInvertedIndex
+    from .preprocessor import STEMS_SECTION, StemCache, TextPreprocessor
+    from .similar_movies import build_similar_movies
+    from .sparse_scoring import SparseTFIDFRetrieval
+    from .static_prior import read_ratings, write_prior
+except ImportError:
+    from impact_index import write_impact_index
+    from index_format import merge_indexes
+    from lsa_index import build_lsa_index
+    from indexer import PositionalInvertedIndex
+    from mmap_index import MmapInvertedIndex
+    from preprocessor import STEMS_SECTION, StemCache, TextPreprocessor
+    from similar_movies import build_similar_movies
+    from sparse_scoring import SparseTFIDFRetrieval
+    from static_prior import read_ratings, write_prior
+
+# 并行分片构建索引（SPIMI）：
+#   1. 将输入文件（如 sample/{year}_sample.jsonl）切分为若干任务，分发到进程池；
+#   2. 每个工作进程流式读取文档，每累积 block_size 个文档就在内存中倒排并写出一个有序的部分索引；
+#   3. 主进程对所有部分索引做 k 路归并，生成最终的二进制索引。
+# 各工作进程的词干缓存一并写入最终索引（stems 段），查询时载入后已知词的词干提取只需一次字典查找。
+# 峰值内存由 block_size 决定，与语料规模无关。
+# 指定 --tfidf-matrix 时再把最终索引编译为稀疏 TF-IDF 矩阵（见 sparse_scoring.py），
+# 指定 --impact-index 时再生成按影响值排序、不含位置的排序检索索引（见 impact_index.py），
+# 指定 --prior 时再由输入文件中的 score / num_votes 计算与文档表对齐的静态先验（见 static_prior.py），
+# 指定 --similar 时再由输入文件计算相似电影的近邻表（见 similar_movies.py），
+# 指定 --lsa 时再生成 LSA 向量与 IVF 列表（见 lsa_index.py）。
+#
+# 用法：python build_index.py sample/*_sample.jsonl -o index.bin --workers 8 --block-size 20000
+
+DEFAULT_BLOCK_SIZE = 10000
+
+
+def split_tasks(file_paths, num_chunks):
+    """
+    将输入文件划分为任务
+    JSONL 文件按字节范围切分为 num_chunks 段（在工作进程中对齐到行首），JSON 数组文件整体作为一个任务
+    :return: [(file_path, start, end)]，end 为 None 表示读到文件末尾
+    """
+    tasks = []
+    for file_path in file_paths:
+        if not file_path.endswith('.jsonl') or num_chunks <= 1:
+            tasks.append((file_path, 0, None))
+            continue
+        size = os.path.getsize(file_path)
+        chunk = max(size // num_chunks, 1)
+        for start in range(0, size, chunk):
+            tasks.append((file_path, start, min(start + chunk, size)))
+    return tasks
+
+
+def iter_jsonl_range(file_path, start, end):
+    """
+    读取 JSONL 文件中起始位置落在 [start, end) 内的所有行
+    :return: 生成原始文档
+    """
+    with open(file_path, 'rb') as infile:
+        if start > 0:
+            infile.seek(start - 1)
+            infile.readline()  # 跳过上一个分片负责的不完整行
+        while end is None or infile.tell() < end:
+            line = infile.readline()
+            if not line:
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_task_documents(preprocessor, task):
+    """按任务读取并预处理文档，生成 (doc_id, {field: [tokens]})"""
+    file_path, start, end = task
+    if file_path.endswith('.jsonl'):
+        for document in iter_jsonl_range(file_path, start, end):
+            yield preprocessor.process_document(document)
+    else:
+        yield from preprocessor.iter_processed(file_path)
+
+
+def write_block(documents, file_path):
+    """
+    在内存中倒排一个文档块并写出有序的部分索引
+    :param documents: {doc_id: {field: [tokens]}}
+    :param file_path: 部分索引路径
+    """
+    block = PositionalInvertedIndex()
+    block.build_index(documents)
+    block.save_index(file_path, fmt='binary')
+
+
+def index_task(args):
+    """
+    工作进程入口：处理一个任务，按块写出部分索引
+    :return: (按顺序写出的部分索引路径列表, 词干缓存的内容)
+    """
+    task_id, task, run_dir, block_size, remove_stop_words, apply_stemming = args
+    preprocessor = TextPreprocessor(remove_stop_words=remove_stop_words, apply_stemming=apply_stemming)
+    runs = []
+    documents = {}
+
+    def flush():
+        run_path = os.path.join(run_dir, f'run_{task_id:05d}_{len(runs):05d}.bin')
+        write_block(documents, run_path)
+        runs.append(run_path)
+        documents.clear()
+
+    for doc_id, fields in iter_task_documents(preprocessor, task):
+        documents[doc_id] = fields
+        if len(documents) >= block_size:
+            flush()
+    if documents:
+        flush()
+    return runs, dict(preprocessor.stem_cache or {})
+
+
+def build_index(file_paths, output_path, workers=None, block_size=DEFAULT_BLOCK_SIZE,
+                remove_stop_words=True, apply_stemming=True, tmp_dir=None, save_stems=True, tfidf_matrix=None,
+                impact_index=None, prior=None, similar=None, lsa=None):
+    """
+    并行构建索引
+    :param file_paths: 输入的 JSON / JSONL 文件
+    :param output_path: 最终二进制索引路径
+    :param workers: 进程数，默认为 CPU 核数
+    :param block_size: 每个部分索引包含的文档数，决定每个工作进程的峰值内存
+    :param tmp_dir: 存放部分索引的目录，默认在输出文件旁创建临时目录
+    :param save_stems: 是否将建索引时的 词 -> 词干 映射写入索引
+    :param tfidf_matrix: 稀疏 TF-IDF 矩阵（.npz）的输出路径，None 表示不生成
+    :param impact_index: 按影响值排序的索引的输出路径，None 表示不生成
+    :param prior: 静态先验的输出路径，None 表示不生成
+    :param similar: 相似电影近邻表的输出路径，None 表示不生成
+    :param lsa: LSA 模型（.npz，向量写在同名 .npy）的输出路径，None 表示不生成
+    """
+    workers = workers or os.cpu_count() or 1
+    run_dir = tempfile.mkdtemp(prefix='runs_', dir=tmp_dir or os.path.dirname(os.path.abspath(output_path)))
+    try:
+        tasks = split_tasks(file_paths, workers)
+        args = [
+            (task_id, task, run_dir, block_size, remove_stop_words, apply_stemming)
+            for task_id, task in enumerate(tasks)
+        ]
+        if workers == 1:
+            results = [index_task(arg) for arg in args]
+        else:
+            with Pool(processes=workers) as pool:
+                results = pool.map(index_task, args, chunksize=1)
+        runs = [run for task_runs, _ in results for run in task_runs]
+        sections = {}
+        if save_stems and apply_stemming:
+            stems = StemCache(None)
+            for _, task_stems in results:
+                stems.preload(task_stems)
+            sections[STEMS_SECTION] = stems.to_bytes()
+        merge_indexes(runs, output_path, sections=sections)
+        if tfidf_matrix is not None or impact_index is not None or prior is not None or lsa is not None:
+            index = MmapInvertedIndex(output_path)
+            if tfidf_matrix is not None:
+                SparseTFIDFRetrieval.from_index(index, preprocessor=None).save(tfidf_matrix)
+            if impact_index is not None:
+                write_impact_index(index, impact_index)
+            if prior is not None:
+                write_prior(index.doc_table.doc_ids, read_ratings(file_paths), prior)
+            if lsa is not None:
+                build_lsa_index(index, lsa)
+            index.close()
+        if similar is not None:
+            build_similar_movies(file_paths, similar)
+        return runs
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a binary positional inverted index in parallel.')
+    parser.add_argument('inputs', nargs='+', help='input .json / .jsonl files, e.g. sample/*_sample.jsonl')
+    parser.add_argument('-o', '--output', default='index.bin', help='output index path (default: index.bin)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count)')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help=f'documents per partial index (default: {DEFAULT_BLOCK_SIZE})')
+    parser.add_argument('--tmp-dir', default=None, help='directory for partial indexes')
+    parser.add_argument('--no-stems', action='store_true', help='do not store the word -> stem table in the index')
+    parser.add_argument('--tfidf-matrix', default=None,
+                        help='also compile a sparse TF-IDF matrix (.npz) for sparse_scoring.py')
+    parser.add_argument('--impact-index', default=None,
+                        help='also write an impact-ordered ranked index for impact_index.py')
+    parser.add_argument('--prior', default=None,
+                        help='also compute a static popularity prior from score / num_votes (static_prior.py)')
+    parser.add_argument('--similar', default=None,
+                        help='also precompute similar-movie neighbor lists (similar_movies.py)')
+    parser.add_argument('--lsa', default=None,
+                        help='also build an LSA vector index with IVF lists (.npz, lsa_index.py)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    runs = build_index(args.inputs, args.output, workers=args.workers, block_size=args.block_size,
+                       tmp_dir=args.tmp_dir, save_stems=not args.no_stems, tfidf_matrix=args.tfidf_matrix,
+                       impact_index=args.impact_index, prior=args.prior, similar=args.similar,
+                       lsa=args.lsa)
+    print(f"已合并 {len(runs)} 个部分索引 -> {args.output}，用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from array import array
+
+# 文档集合统计
+#
+# 排序模型需要的集合级信息：文档数 N、各字段的文档频率 df、每个文档各字段的词数以及平均字段长度。
+# 它们在建索引时计算并随二进制索引一起保存（见 index_format.py 中的 stats / lengths 段），
+# 加载后直接使用，排序时不再扫描 postings。
+
+
+class CollectionStats:
+    """文档集合统计，各索引后端通过 stats 属性提供"""
+
+    def __init__(self, doc_table, index, field_lengths, total_lengths, num_docs=None):
+        """
+        :param doc_table: 文档表，field_lengths 按其中的序号排列
+        :param index: 多字段索引 {field: {term: postings}}，用于读取 df
+        :param field_lengths: {field: 按文档序号排列的字段词数}
+        :param total_lengths: {field: 存活文档的总词数}
+        :param num_docs: 存活文档数，默认为文档表的大小（分段索引中不含已删除的文档）
+        """
+        self.doc_table = doc_table
+        self.index = index
+        self.field_lengths = field_lengths
+        self.total_lengths = total_lengths
+        self.num_docs = len(doc_table) if num_docs is None else num_docs
+
+    @property
+    def fields(self):
+        return list(self.field_lengths)
+
+    def df(self, field, term):
+        """词项在某个字段中的文档频率"""
+        field_index = self.index[field]
+        if hasattr(field_index, 'df'):  # 二进制词典中已存有 df，无需解码 postings
+            return field_index.df(term)
+        postings = field_index.get(term)
+        return len(postings) if postings is not None else 0
+
+    def max_tf(self, field, term):
+        """词项在某个字段中的最大词频"""
+        return max_tf(self.index[field], term)
+
+    def field_length(self, field, doc_ord):
+        """文档（按序号）某个字段的词数"""
+        lengths = self.field_lengths.get(field)
+        if lengths is None or doc_ord >= len(lengths):
+            return 0
+        return lengths[doc_ord]
+
+    def doc_field_length(self, field, doc_id):
+        """文档（按文档ID）某个字段的词数"""
+        doc_ord = self.doc_table.get(doc_id)
+        return self.field_length(field, doc_ord) if doc_ord >= 0 else 0
+
+    def avg_field_length(self, field):
+        """某个字段的平均词数"""
+        if not self.num_docs:
+            return 0.0
+        return self.total_lengths.get(field, 0) / self.num_docs
+
+
+def max_tf(field_index, term):
+    """
+    词项在字段索引中的最大词频，用于计算得分上界
+    二进制索引建索引时已写入（见 index_format.py 中的 maxtf 段），内存索引由 postings 计算
+    """
+    if hasattr(field_index, 'max_tf'):
+        return field_index.max_tf(term)
+    postings = field_index.get(term)
+    if postings is None:
+        return 0
+    if hasattr(postings, 'max_tf'):
+        return postings.max_tf()
+    return max(map(len, postings.values()), default=0)
+
+
+def lengths_from_postings(index, num_docs):
+    """
+    由 postings 累加各文档的词频得到字段长度（用于不含统计信息的文本格式索引）
+    :param index: {field: {term: PostingsList}}
+    :param num_docs: 文档表大小
+    :return: {field: array('I')}
+    """
+    field_lengths = {}
+    for field, terms in index.items():
+        lengths = array('I', bytes(4 * num_docs))
+        for postings in terms.values():
+            offsets = postings.offsets
+            for i, doc_ord in enumerate(postings.doc_ords):
+                lengths[doc_ord] += offsets[i + 1] - offsets[i]
+        field_lengths[field] = lengths
+    return field_lengths
@@ -0,0 +1,28 @@
+import argparse
+import os
+import time
+from indexer import convert_index
+
+# 将文本格式的索引（index.txt）转换为二进制格式，例如：
+#   python convert_index.py index.txt index.bin
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a positional inverted index between text and binary formats.')
+    parser.add_argument('src', help='source index file (format is detected automatically)')
+    parser.add_argument('dst', help='destination index file')
+    parser.add_argument('--format', dest='fmt', choices=['binary', 'text'], default='binary',
+                        help='destination format (default: binary)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    convert_index(args.src, args.dst, fmt=args.fmt)
+    elapsed = time.perf_counter() - start
+    src_size = os.path.getsize(args.src)
+    dst_size = os.path.getsize(args.dst)
+    print(f"已转换 {args.src} ({src_size / 1e6:.1f} MB) -> {args.dst} ({dst_size / 1e6:.1f} MB), "
+          f"压缩比 {src_size / max(dst_size, 1):.1f}x, 用时 {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
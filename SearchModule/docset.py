@@ -0,0 +1,108 @@
+from collections.abc import Set
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时 QueryProcessor 继续使用集合
+    np = None
+
+# 基于稠密文档序号的位图文档集合
+#
+# 第 i 位表示序号为 i 的文档（DocTable 中的序号），按 little-endian 位序打包在 numpy uint8 数组中。
+# 与 / 或 / 差 都是对整个数组的向量化按位运算，代价与 文档总数 / 8 字节成正比，不再逐个哈希文档ID，
+# 适合 plot 中的高频词以及 NOT 的全集。
+# 与普通集合混合运算时：& 与 - 的结果为集合（对集合一侧逐个判断，集合通常较小），| 的结果为位图。
+
+BITMAPS_AVAILABLE = np is not None
+
+
+class DocBitmap(Set):
+    """以位图表示的文档集合，对外表现为文档ID的只读集合"""
+
+    __slots__ = ('doc_table', 'bits', '_count')
+
+    def __init__(self, doc_table, bits):
+        """
+        :param doc_table: 文档表，位的序号即文档序号
+        :param bits: np.packbits(..., bitorder='little') 得到的 uint8 数组，长度为 ceil(len(doc_table) / 8)
+        """
+        self.doc_table = doc_table
+        self.bits = bits
+        self._count = None
+
+    @classmethod
+    def from_ords(cls, doc_table, ord_lists):
+        """
+        由若干个文档序号序列构建，结果为它们的并集
+        :param ord_lists: 文档序号序列（array / list / ndarray）的列表
+        """
+        mask = np.zeros(len(doc_table), dtype=bool)
+        for doc_ords in ord_lists:
+            if len(doc_ords):
+                mask[np.asarray(doc_ords, dtype=np.intp)] = True
+        return cls(doc_table, np.packbits(mask, bitorder='little'))
+
+    @classmethod
+    def from_doc_ids(cls, doc_table, doc_ids):
+        """由文档ID构建，不在文档表中的ID被忽略"""
+        return cls.from_ords(doc_table, [[doc_ord for doc_ord in map(doc_table.get, doc_ids) if doc_ord >= 0]])
+
+    @classmethod
+    def full(cls, doc_table, excluded_ords=()):
+        """文档表中的全部文档，可排除部分序号（如已删除的文档）"""
+        mask = np.ones(len(doc_table), dtype=bool)
+        if excluded_ords:
+            mask[np.fromiter(excluded_ords, dtype=np.intp, count=len(excluded_ords))] = False
+        return cls(doc_table, np.packbits(mask, bitorder='little'))
+
+    def ords(self):
+        """按序号递增的文档序号（ndarray）"""
+        return np.flatnonzero(np.unpackbits(self.bits, bitorder='little'))
+
+    def has_ord(self, doc_ord):
+        return 0 <= doc_ord < len(self.doc_table) and bool(self.bits[doc_ord >> 3] >> (doc_ord & 7) & 1)
+
+    def _bitmap(self, other):
+        """将另一侧转换为同一文档表上的位图"""
+        if isinstance(other, DocBitmap) and other.doc_table is self.doc_table:
+            return other
+        return DocBitmap.from_doc_ids(self.doc_table, other)
+
+    def __and__(self, other):
+        if isinstance(other, DocBitmap):
+            return DocBitmap(self.doc_table, self.bits & self._bitmap(other).bits)
+        return {doc_id for doc_id in other if doc_id in self}
+
+    __rand__ = __and__
+
+    def __or__(self, other):
+        return DocBitmap(self.doc_table, self.bits | self._bitmap(other).bits)
+
+    __ror__ = __or__
+
+    def __sub__(self, other):
+        return DocBitmap(self.doc_table, self.bits & ~self._bitmap(other).bits)
+
+    def __rsub__(self, other):
+        return {doc_id for doc_id in other if doc_id not in self}
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        # Set 的其余运算（如 ^）结果为普通集合
+        return set(iterable)
+
+    def __contains__(self, doc_id):
+        return self.has_ord(self.doc_table.get(doc_id))
+
+    def __iter__(self):
+        return map(self.doc_table.doc_ids.__getitem__, self.ords().tolist())
+
+    def __len__(self):
+        if self._count is None:
+            self._count = int(np.count_nonzero(np.unpackbits(self.bits)))
+        return self._count
+
+    def __bool__(self):
+        return bool(self.bits.any())
+
+    def __repr__(self):
+        return f'DocBitmap({len(self)} of {len(self.doc_table)} docs)'
@@ -0,0 +1,353 @@
+import argparse
+import heapq
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+
+try:
+    from .index_format import IndexReader, IndexWriter, decode_varints, encode_varint
+    from .indexer import MergedFieldsView, open_index
+    from .models import DEFAULT_PRIOR_WEIGHT, TOP_K_TOLERANCE, matched_terms, resolve_after, select_page
+    from .postings import DocTable
+except ImportError:
+    from index_format import IndexReader, IndexWriter, decode_varints, encode_varint
+    from indexer import MergedFieldsView, open_index
+    from models import DEFAULT_PRIOR_WEIGHT, TOP_K_TOLERANCE, matched_terms, resolve_after, select_page
+    from postings import DocTable
+
+# 按影响值排序的排序检索索引（impact-ordered index）
+#
+# 建索引后把每个 (词项, 文档) 的 TF-IDF 权重 w = tf * idf（tf 为各字段词频之和，与 TFIDFRetrieval 相同）
+# 量化为 bits 位的影响值（impact），按对数刻度划分，各级之间的相对误差约为 ln(w_max / w_min) / 2^bits：
+#   impact = 1 + round(ln(w / w_min) / step)，step = ln(w_max / w_min) / (2^bits - 2)
+# 每个词项的 postings 按影响值分段，段按影响值从高到低存放，段内为递增的文档序号，不含位置。
+#
+# 文件沿用二进制索引的容器格式（见 index_format.py），没有字段，只有文档表与三个附加段：
+#   impact:meta      bits(u8) | w_min(f64) | w_max(f64)，小端
+#   impact:terms     以 '\n' 连接的 UTF-8 词项
+#   impact:segments  与词项一一对应：varint 段数 + 每段 varint (影响值, 文档数)
+#   impact:postings  所有段的文档序号依次相接，小端 u32，段内可直接二分查找
+#
+# 查询时按 score-at-a-time 处理：所有查询词的段按贡献（查询中出现次数 * 影响值对应的权重）从高到低依次累加，
+# 剩余段的贡献上界之和已不足以让前 k 之外的文档进入前 k 时提前结束，
+# 只为前 k 个文档在剩余的段中二分查找补齐得分；postings 很长的低影响值段通常完全不需要读取。
+#
+# 用法：python impact_index.py index.bin -o index.impact
+
+DEFAULT_IMPACT_BITS = 8
+MAX_IMPACT_BITS = 16  # 影响值载入后存放在 array('H') 中
+_META = struct.Struct('<Bdd')
+_CHECK_INTERVAL = 8  # 剩余上界尚未低于上次的第 k 高得分时，每处理这么多段检查一次能否提前结束
+
+
+def _u32_bytes(values):
+    if sys.byteorder == 'big':
+        values = array('I', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ImpactQuantizer:
+    """权重与影响值之间的对数量化"""
+
+    def __init__(self, bits, w_min, w_max):
+        if not 1 <= bits <= MAX_IMPACT_BITS:
+            raise ValueError(f"Impact bits must be between 1 and {MAX_IMPACT_BITS}, got {bits}.")
+        self.bits = bits
+        self.w_min = w_min
+        self.w_max = w_max
+        levels = (1 << bits) - 1
+        self.step = math.log(w_max / w_min) / (levels - 1) if w_max > w_min and levels > 1 else 0.0
+        self.levels = levels
+        # 每个影响值代表的权重（取该级区间的几何中心），下标为影响值，0 不使用
+        self.weights = [0.0] + [w_min * math.exp(self.step * level) for level in range(levels)]
+
+    def quantize(self, weight):
+        if not self.step:
+            return 1
+        return min(self.levels, max(1, 1 + round(math.log(weight / self.w_min) / self.step)))
+
+
+def write_impact_index(index, output_path, fields=None, bits=DEFAULT_IMPACT_BITS):
+    """
+    由多字段位置索引生成按影响值排序的索引文件
+    :param index: 具有 index 与 stats 属性的索引对象
+    :param output_path: 输出路径
+    :param fields: 参与合并的字段，默认使用全部字段
+    :param bits: 影响值的位数（1 到 MAX_IMPACT_BITS）
+    :return: 词项数
+    """
+    if not 1 <= bits <= MAX_IMPACT_BITS:  # 在读取索引之前检查
+        raise ValueError(f"Impact bits must be between 1 and {MAX_IMPACT_BITS}, got {bits}.")
+    stats = index.stats
+    fields = list(fields) if fields is not None else list(index.index)
+    num_docs = stats.num_docs
+    terms = []
+    term_postings = []  # 每个词项的 (idf, 文档序号, 合并后的词频)
+    w_min, w_max = math.inf, 0.0
+    for term in MergedFieldsView(index.index, fields):
+        tfs = Counter()
+        for field in fields:
+            field_index = index.index[field]
+            if term in field_index:
+                postings = field_index[term]
+                for doc_ord, tf in zip(postings.doc_ords, postings.tfs()):
+                    tfs[doc_ord] += tf
+        if not tfs:
+            continue
+        idf = math.log(num_docs / (len(tfs) + 1)) + 1
+        doc_ords = sorted(tfs)
+        term_tfs = [tfs[doc_ord] for doc_ord in doc_ords]
+        w_min = min(w_min, min(term_tfs) * idf)
+        w_max = max(w_max, max(term_tfs) * idf)
+        terms.append(term)
+        term_postings.append((idf, doc_ords, term_tfs))
+    if not terms:
+        w_min = w_max = 1.0
+    if w_min <= 0:
+        raise ValueError("TF-IDF weights must be positive to build an impact-ordered index.")
+
+    quantizer = ImpactQuantizer(bits, w_min, w_max)
+    table = bytearray()
+    ords = array('I')
+    for idf, doc_ords, term_tfs in term_postings:
+        segments = {}
+        for doc_ord, tf in zip(doc_ords, term_tfs):
+            segments.setdefault(quantizer.quantize(tf * idf), array('I')).append(doc_ord)
+        encode_varint(len(segments), table)
+        for impact in sorted(segments, reverse=True):
+            encode_varint(impact, table)
+            encode_varint(len(segments[impact]), table)
+            ords += segments[impact]
+
+    with IndexWriter(output_path) as writer:
+        writer.add_section('impact:meta', _META.pack(bits, w_min, w_max))
+        writer.add_section('impact:terms', '\n'.join(terms).encode('utf-8'))
+        writer.add_section('impact:segments', table)
+        writer.add_section('impact:postings', _u32_bytes(ords))
+        writer.close(stats.doc_table.doc_ids)
+    return len(terms)
+
+
+class ImpactIndex:
+    """以 mmap 方式读取的按影响值排序的索引，只在查询时复制需要的段"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(file.fileno())
+        self.version = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        reader = IndexReader(self.mmap)
+        if 'impact:meta' not in reader.sections:
+            raise ValueError(f"{file_path} is not an impact-ordered index.")
+        self.doc_table = DocTable(reader.doc_ids)
+        self.quantizer = ImpactQuantizer(*_META.unpack(reader.section('impact:meta')))
+        self._postings_offset = reader.sections['impact:postings'][0]
+
+        terms = bytes(reader.section('impact:terms')).decode('utf-8')
+        self.terms = terms.split('\n') if terms else []
+        entries = decode_varints(reader.section('impact:segments'))
+        # 所有段平铺存放：第 i 段的影响值、文档数与在 postings 段中的起始下标（以 u32 计）
+        self.term_segments = {}  # {词项: (第一段的下标, 段数)}
+        self.impacts = array('H')
+        self.counts = array('I')
+        pos = 0
+        for term in self.terms:
+            num_segments = entries[pos]
+            self.term_segments[term] = (len(self.impacts), num_segments)
+            self.impacts.extend(entries[pos + 1:pos + 1 + 2 * num_segments:2])
+            self.counts.extend(entries[pos + 2:pos + 2 + 2 * num_segments:2])
+            pos += 1 + 2 * num_segments
+        self.starts = array('Q', accumulate(self.counts, initial=0))
+
+    def __contains__(self, term):
+        return term in self.term_segments
+
+    def segments(self, term):
+        """词项各段的下标（影响值从高到低），词项不存在时为空"""
+        first, num_segments = self.term_segments.get(term, (0, 0))
+        return range(first, first + num_segments)
+
+    def segment_ords(self, i):
+        """第 i 段的文档序号（array('I')，递增）"""
+        start = self._postings_offset + 4 * self.starts[i]
+        ords = array('I')
+        ords.frombytes(self.mmap[start:start + 4 * self.counts[i]])
+        if sys.byteorder == 'big':
+            ords.byteswap()
+        return ords
+
+    def close(self):
+        self.mmap.close()
+
+
+class ImpactRetrieval:
+    """基于按影响值排序的索引的 TF-IDF 排序检索，得分为量化后的权重之和，不读取位置"""
+
+    def __init__(self, impact_index, preprocessor, fuzzy=None, fuzzy_budget=0.05, prior=None,
+                 prior_weight=DEFAULT_PRIOR_WEIGHT):
+        """
+        :param impact_index: ImpactIndex
+        :param preprocessor: 文本预处理器
+        :param fuzzy: 模糊查找函数，查询词不在索引中时用相近的词项代替
+        :param fuzzy_budget: 一次查询中模糊查找可用的时间（秒）
+        :param prior: 静态先验（StaticPrior），按影响值索引的文档表对齐，None 表示只按相关度排序
+        :param prior_weight: 先验的混合权重
+        """
+        self.index = impact_index
+        self.preprocessor = preprocessor
+        self.fuzzy = fuzzy
+        self.fuzzy_budget = fuzzy_budget
+        # 文档第一次出现时以 prior_weight * 先验 作为初始得分；prior_bound 为任何文档先验部分的上界
+        self.prior_boost = None
+        self.prior_bound = 0.0
+        if prior is not None:
+            prior = prior.aligned(impact_index.doc_table)
+            self.prior_boost = array('d', (prior_weight * value for value in prior.values))
+            self.prior_bound = prior_weight * prior.max
+
+    def normalize_query(self, query):
+        """预处理后的查询词（排序），用作结果缓存的键"""
+        return ' '.join(sorted(self.preprocessor.process_text(query)))
+
+    def _ordered_segments(self, query):
+        """
+        查询词的所有段，按贡献从高到低排列
+        :return: [(贡献, 词项序号, 段下标)] 与每个词项各段的贡献列表
+        """
+        deadline = time.perf_counter() + self.fuzzy_budget
+        counts = Counter()
+        for term in self.preprocessor.process_text(query):
+            counts.update(matched_terms(term, self.index.__contains__, self.fuzzy, deadline))
+        weights = self.index.quantizer.weights
+        impacts = self.index.impacts
+        ordered = []
+        term_contributions = []
+        for t, (term, count) in enumerate(counts.items()):
+            contributions = [(count * weights[impacts[i]], t, i) for i in self.index.segments(term)]
+            term_contributions.append([contribution for contribution, _, _ in contributions])
+            ordered.extend(contributions)
+        ordered.sort(key=lambda x: (-x[0], x[1], x[2]))
+        return ordered, term_contributions
+
+    def _ranked(self, scores, k=None):
+        if k is None:
+            best = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        else:
+            best = heapq.nsmallest(k, scores.items(), key=lambda x: (-x[1], x[0]))
+        doc_ids = self.index.doc_table.doc_ids
+        return [(doc_ids[doc_ord], score) for doc_ord, score in best]
+
+    def _accumulate(self, scores, ords, contribution):
+        """把一段的贡献累加到部分得分，有先验时文档第一次出现先计入它的先验"""
+        boost = self.prior_boost
+        if boost is None:
+            for doc_ord in ords:
+                scores[doc_ord] = scores.get(doc_ord, 0.0) + contribution
+        else:
+            for doc_ord in ords:
+                score = scores.get(doc_ord)
+                scores[doc_ord] = (boost[doc_ord] if score is None else score) + contribution
+
+    def _scores(self, ordered):
+        scores = {}
+        for contribution, _, i in ordered:
+            self._accumulate(scores, self.index.segment_ords(i), contribution)
+        return scores
+
+    def compute_scores(self, query):
+        """
+        处理全部段的完整排序
+        :return: [(doc_id, score)]，按得分从高到低排列，得分相同时按文档序号排列
+        """
+        return self._ranked(self._scores(self._ordered_segments(query)[0]))
+
+    def page(self, query, size, after=None):
+        """
+        排序结果中的一页：第一页用 top_k 提前结束，之后的页处理全部段后用大小为 size 的堆选出游标之后的结果
+        :param after: 上一页最后一个结果的 (得分, 文档ID)，None 表示从第一个结果开始
+        :return: ([(doc_id, score)], 完整结果的文档总数)
+        """
+        doc_table = self.index.doc_table
+        after = resolve_after(after, doc_table)
+        ordered, term_contributions = self._ordered_segments(query)
+        if after is None:
+            hits = self._top_k(ordered, term_contributions, size)
+            # 文档总数只需各段文档序号的并集，段直接从 mmap 复制，不累加得分
+            doc_ords = set()
+            for _, _, i in ordered:
+                doc_ords.update(self.index.segment_ords(i))
+            return hits, len(doc_ords)
+        scores = self._scores(ordered)
+        hits = select_page(scores, size, after)
+        return [(doc_table.doc_ids[doc_ord], score) for doc_ord, score in hits], len(scores)
+
+    def top_k(self, query, k=10):
+        """
+        score-at-a-time 提前结束的前 k 个结果，与 compute_scores(query)[:k] 相同
+        每处理一段后，各词项下一段的贡献之和 remaining 是任何文档还能增加的得分上界；
+        当 remaining（加上先验的上界）低于第 k 高的部分得分，且第 k+1 高的部分得分加上 remaining 也低于它时，
+        前 k 个文档已经确定，只需在剩余的段中查找这 k 个文档补齐得分（按相同的顺序累加，结果与完整计算一致）
+        """
+        return self._top_k(*self._ordered_segments(query), k)
+
+    def _top_k(self, ordered, term_contributions, k):
+        if k <= 0:
+            return []
+        next_segment = [0] * len(term_contributions)  # 每个词项下一个未处理段在其贡献列表中的位置
+        scores = {}
+        threshold = math.inf  # 上次检查时的第 k 高部分得分，只会增大
+        since_check = 0
+        prior_bound = self.prior_bound * (1.0 + TOP_K_TOLERANCE)
+        for n, (contribution, t, i) in enumerate(ordered):
+            self._accumulate(scores, self.index.segment_ords(i), contribution)
+            next_segment[t] += 1
+            if len(scores) < k or n + 1 == len(ordered):
+                continue
+            remaining = sum(contributions[j] for contributions, j in zip(term_contributions, next_segment)
+                            if j < len(contributions)) * (1.0 + TOP_K_TOLERANCE)
+            since_check += 1
+            if remaining + prior_bound >= threshold and since_check < _CHECK_INTERVAL:
+                continue
+            since_check = 0
+            best = heapq.nlargest(k + 1, scores.values())
+            threshold = best[k - 1] * (1.0 - TOP_K_TOLERANCE)
+            # 尚未出现的文档最多得到 remaining + 先验上界，已出现的文档部分得分中已含先验
+            if remaining + prior_bound < threshold and (len(best) <= k or best[k] + remaining < threshold):
+                top = heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+                top_scores = dict(top)
+                top_ords = sorted(top_scores)
+                for contribution, _, i in ordered[n + 1:]:
+                    ords = self.index.segment_ords(i)
+                    for doc_ord in top_ords:
+                        j = bisect_left(ords, doc_ord)
+                        if j < len(ords) and ords[j] == doc_ord:
+                            top_scores[doc_ord] += contribution
+                return self._ranked(top_scores, k)
+        return self._ranked(scores, k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an impact-ordered ranked index from a positional index.')
+    parser.add_argument('index', help='text / binary index file or segmented index directory')
+    parser.add_argument('-o', '--output', default='index.impact', help='output path')
+    parser.add_argument('--bits', type=int, default=DEFAULT_IMPACT_BITS, choices=range(1, MAX_IMPACT_BITS + 1),
+                        metavar=f'1-{MAX_IMPACT_BITS}', help=f'bits per quantized impact (default: {DEFAULT_IMPACT_BITS})')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    num_terms = write_impact_index(open_index(args.index), args.output, bits=args.bits)
+    print(f"已写入 {num_terms} 个词项的影响值索引 -> {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)，"
+          f"用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,549 @@
+import heapq
+import mmap
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+# 倒排索引的二进制存储格式
+#
+# 文件布局：
+#   [文件头]   MAGIC(4) | version(u16) | reserved(u16)
+#   [倒排记录] 按字段、按词项字典序连续存放的 postings 块
+#   [各个段]   文档表 / 字段目录 / 每个字段的词典 / 集合统计（可选）
+#   [段目录]   varint 段数 + 每段的 (名称, 偏移, 长度)
+#   [文件尾]   段目录偏移(u64) | 段目录长度(u64) | MAGIC(4)
+#
+# 一个 postings 块按文档序号递增排列，按列依次写入三段 varint：
+#   df 个文档序号差值 | df 个 tf | 各文档的位置差值（每个文档的第一个位置写绝对值）
+# 按列存放使解码可以整段用 accumulate 完成，不必逐个文档解析。
+#
+# 集合统计（旧文件中没有，读取时退化为扫描 postings）：
+#   stats            varint 字段数 + 每个字段的 (名称, 总词数)
+#   lengths:<field>  按文档序号排列的字段词数，小端 u32 数组，可直接整段读入
+#
+# 词项得分上界（旧文件中没有，读取时退化为解码 postings）：
+#   maxtf:<field>    与词典一一对应的词项最大词频（任一文档中的 tf 最大值），小端 u32 数组，
+#                    供 top-k 检索计算每个查询词的得分上界（见 models.TFIDFRetrieval.top_k）
+
+MAGIC = b'PIIX'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<4sHH')
+_TRAILER = struct.Struct('<QQ4s')
+
+# 匹配一个多字节 varint：若干个置位最高位的字节 + 一个结束字节
+_MULTIBYTE_VARINT = re.compile(rb'([\x80-\xff]+[\x00-\x7f])')
+
+
+def encode_varint(value, out):
+    """
+    将非负整数以 varint 编码追加到 bytearray
+    :param value: 非负整数
+    :param out: 输出缓冲区
+    """
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(buf):
+    """
+    解码一段连续的 varint
+    单字节的值（绝大多数位置差值）直接按字节批量展开，只有多字节的值才逐字节解码
+    :param buf: bytes 或 memoryview
+    :return: 整数列表
+    """
+    # split 的结果交替为：单字节值组成的片段、一个多字节 varint
+    pieces = _MULTIBYTE_VARINT.split(bytes(buf))
+    values = list(pieces[0])
+    extend = values.extend
+    append = values.append
+    for k in range(1, len(pieces), 2):
+        group = pieces[k]
+        if len(group) == 2:
+            append((group[0] & 0x7F) | (group[1] << 7))
+        else:
+            value = shift = 0
+            for byte in group:
+                value |= (byte & 0x7F) << shift
+                shift += 7
+            append(value)
+        extend(pieces[k + 1])
+    return values
+
+
+def encode_postings(postings, out):
+    """
+    编码一个词项的 postings 块
+    :param postings: 按文档序号递增的 [(doc_ord, [positions])]
+    :param out: 输出缓冲区
+    :return: 文档频率 df
+    """
+    prev_doc = 0
+    for doc_ord, _ in postings:
+        encode_varint(doc_ord - prev_doc, out)
+        prev_doc = doc_ord
+    for _, positions in postings:
+        encode_varint(len(positions), out)
+    for _, positions in postings:
+        prev_pos = 0
+        for pos in positions:
+            encode_varint(pos - prev_pos, out)
+            prev_pos = pos
+    return len(postings)
+
+
+def iter_postings_blocks(values, dfs):
+    """
+    从已解码的 varint 列表中依次还原连续存放的若干个 postings 块
+    :param values: decode_varints 的结果
+    :param dfs: 每个块的文档频率
+    :return: 每个块生成一个 (doc_ords, positions_lists) 二元组，两者一一对应
+    """
+    i = 0
+    getitem = values.__getitem__
+    for df in dfs:
+        doc_ords = list(accumulate(values[i:i + df]))
+        bounds = list(accumulate(values[i + df:i + 2 * df], initial=i + 2 * df))
+        positions_lists = list(map(list, map(accumulate, map(getitem, map(slice, bounds[:-1], bounds[1:])))))
+        i = bounds[-1]
+        yield doc_ords, positions_lists
+
+
+def _encode_text_list(items, out):
+    """以 '\n' 连接的 UTF-8 字符串块写入，前缀为数量与字节长度"""
+    blob = '\n'.join(items).encode('utf-8')
+    encode_varint(len(items), out)
+    encode_varint(len(blob), out)
+    out += blob
+
+
+def _decode_text_list(buf, pos):
+    """读取 _encode_text_list 写入的字符串块，返回 (列表, 新的偏移)"""
+    count, pos = _read_varint(buf, pos)
+    length, pos = _read_varint(buf, pos)
+    if count == 0:
+        return [], pos + length
+    items = bytes(buf[pos:pos + length]).decode('utf-8').split('\n')
+    return items, pos + length
+
+
+def _read_varint(buf, pos):
+    """读取单个 varint，返回 (值, 新的偏移)"""
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class IndexWriter:
+    """
+    流式写出二进制索引
+    调用顺序：begin_field -> add_term（词项按字典序递增）-> end_field，重复若干字段后 close
+    """
+
+    def __init__(self, file_path):
+        self.file = open(file_path, 'wb')
+        self.file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0))
+        self.offset = _HEADER.size
+        self.sections = {}  # {名称: bytes}
+        self.fields = []  # [(field, num_terms, postings_offset, postings_length)]
+        self._field = None
+
+    def begin_field(self, field):
+        """开始写入一个字段"""
+        if self._field is not None:
+            raise ValueError(f"Field '{self._field}' has not been ended.")
+        self._field = field
+        self._field_offset = self.offset
+        self._terms = []
+        self._entries = bytearray()  # 每个词项的 (df, 块长度)
+        self._max_tfs = array('I')  # 每个词项的最大词频
+
+    def add_term(self, term, postings):
+        """
+        写入一个词项的 postings
+        :param term: 词项，必须大于上一个写入的词项
+        :param postings: 按文档序号递增的 [(doc_ord, [positions])]
+        """
+        if self._terms and term <= self._terms[-1]:
+            raise ValueError(f"Terms must be added in sorted order: '{term}' after '{self._terms[-1]}'.")
+        if '\n' in term:
+            raise ValueError(f"Term {term!r} contains a newline.")
+        block = bytearray()
+        df = encode_postings(postings, block)
+        if df == 0:
+            return
+        self.file.write(block)
+        self.offset += len(block)
+        self._terms.append(term)
+        self._max_tfs.append(max(len(positions) for _, positions in postings))
+        encode_varint(df, self._entries)
+        encode_varint(len(block), self._entries)
+
+    def end_field(self):
+        """结束当前字段，记录其词典"""
+        field = self._field
+        self.sections[f'terms:{field}'] = self._encode_terms()
+        self.sections[f'maxtf:{field}'] = _array_bytes(self._max_tfs)
+        self.fields.append((field, len(self._terms), self._field_offset, self.offset - self._field_offset))
+        self._field = None
+
+    def _encode_terms(self):
+        out = bytearray()
+        _encode_text_list(self._terms, out)
+        encode_varint(len(self._entries), out)
+        out += self._entries
+        return out
+
+    def add_section(self, name, data):
+        """写入一个附加段（供格式扩展使用）"""
+        self.sections[name] = data
+
+    def close(self, doc_ids, field_lengths=None):
+        """
+        写入文档表、字段目录与段目录并关闭文件
+        :param doc_ids: 按文档序号排列的文档ID列表
+        :param field_lengths: {field: 按文档序号排列的字段词数}，用于写入集合统计
+        """
+        if self._field is not None:
+            self.end_field()
+        if field_lengths is not None:
+            self._add_stats(field_lengths, len(doc_ids))
+        docs = bytearray()
+        _encode_text_list(list(doc_ids), docs)
+        self.sections['docs'] = docs
+
+        field_dir = bytearray()
+        encode_varint(len(self.fields), field_dir)
+        for field, num_terms, postings_offset, postings_length in self.fields:
+            name = field.encode('utf-8')
+            encode_varint(len(name), field_dir)
+            field_dir += name
+            encode_varint(num_terms, field_dir)
+            encode_varint(postings_offset, field_dir)
+            encode_varint(postings_length, field_dir)
+        self.sections['fields'] = field_dir
+
+        directory = bytearray()
+        encode_varint(len(self.sections), directory)
+        for name, data in self.sections.items():
+            self.file.write(data)
+            encoded_name = name.encode('utf-8')
+            encode_varint(len(encoded_name), directory)
+            directory += encoded_name
+            encode_varint(self.offset, directory)
+            encode_varint(len(data), directory)
+            self.offset += len(data)
+        self.file.write(directory)
+        self.file.write(_TRAILER.pack(self.offset, len(directory), MAGIC))
+        self.file.close()
+
+    def _add_stats(self, field_lengths, num_docs):
+        stats = bytearray()
+        encode_varint(len(field_lengths), stats)
+        for field in sorted(field_lengths):
+            lengths = array('I', field_lengths[field])
+            if len(lengths) < num_docs:  # 没有该字段的文档长度为 0
+                lengths.extend([0] * (num_docs - len(lengths)))
+            _encode_text_list([field], stats)
+            encode_varint(sum(lengths), stats)
+            self.sections[f'lengths:{field}'] = _array_bytes(lengths)
+        self.sections['stats'] = stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.file.close()
+
+
+def _array_bytes(values):
+    """u32 数组的小端字节"""
+    if sys.byteorder == 'big':
+        values = array('I', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _array_from_bytes(data):
+    """由小端字节读出 u32 数组"""
+    values = array('I')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class FieldDictionary:
+    """单个字段的词典：按字典序排列的词项及其 df、最大词频和 postings 块位置"""
+
+    def __init__(self, field, terms, dfs, offsets, lengths, max_tfs=None):
+        self.field = field
+        self.terms = terms  # 有序词项列表，用二分查找定位
+        self.dfs = array('I', dfs)
+        self.offsets = array('Q', offsets)  # postings 块在文件中的绝对偏移
+        self.lengths = array('I', lengths)
+        self.max_tfs = max_tfs  # 各词项的最大词频，旧文件中没有时为 None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def find(self, term):
+        """二分查找词项，返回其下标，不存在时返回 -1"""
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return -1
+
+
+class IndexReader:
+    """
+    读取二进制索引的词典与文档表，并按需解码 postings
+    :param buf: 整个索引文件的内容（bytes 或 mmap）
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        magic, version, _ = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a binary index file.")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version: {version}")
+        self.version = version
+
+        directory_offset, directory_length, magic = _TRAILER.unpack_from(buf, len(buf) - _TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError("Truncated binary index file.")
+        self.sections = {}
+        count, pos = _read_varint(buf, directory_offset)
+        for _ in range(count):
+            length, pos = _read_varint(buf, pos)
+            name = bytes(buf[pos:pos + length]).decode('utf-8')
+            pos += length
+            offset, pos = _read_varint(buf, pos)
+            length, pos = _read_varint(buf, pos)
+            self.sections[name] = (offset, length)
+
+        self.doc_ids, _ = _decode_text_list(buf, self.sections['docs'][0])
+        self._computed_lengths = None
+        self.fields = {}
+        num_fields, pos = _read_varint(buf, self.sections['fields'][0])
+        for _ in range(num_fields):
+            length, pos = _read_varint(buf, pos)
+            field = bytes(buf[pos:pos + length]).decode('utf-8')
+            pos += length
+            num_terms, pos = _read_varint(buf, pos)
+            postings_offset, pos = _read_varint(buf, pos)
+            _postings_length, pos = _read_varint(buf, pos)
+            self.fields[field] = self._read_dictionary(field, postings_offset)
+
+    def _read_dictionary(self, field, postings_offset):
+        buf = self.buf
+        terms, pos = _decode_text_list(buf, self.sections[f'terms:{field}'][0])
+        length, pos = _read_varint(buf, pos)
+        entries = decode_varints(buf[pos:pos + length])
+        dfs = entries[0::2]
+        lengths = entries[1::2]
+        offsets = []
+        offset = postings_offset
+        for block_length in lengths:
+            offsets.append(offset)
+            offset += block_length
+        max_tfs = self.section(f'maxtf:{field}')
+        if max_tfs is not None:
+            max_tfs = _array_from_bytes(max_tfs)
+        return FieldDictionary(field, terms, dfs, offsets, lengths, max_tfs)
+
+    def section(self, name):
+        """返回附加段的原始字节，不存在时返回 None"""
+        if name not in self.sections:
+            return None
+        offset, length = self.sections[name]
+        return self.buf[offset:offset + length]
+
+    @property
+    def has_stats(self):
+        return 'stats' in self.sections
+
+    def total_lengths(self):
+        """
+        各字段的总词数
+        :return: {field: 总词数}
+        """
+        if not self.has_stats:
+            return {field: sum(lengths) for field, lengths in self.compute_field_lengths().items()}
+        totals = {}
+        num_fields, pos = _read_varint(self.buf, self.sections['stats'][0])
+        for _ in range(num_fields):
+            (field,), pos = _decode_text_list(self.buf, pos)
+            totals[field], pos = _read_varint(self.buf, pos)
+        return totals
+
+    def field_lengths(self, field):
+        """
+        读取一个字段按文档序号排列的词数
+        :return: array('I')，字段不存在时全为 0
+        """
+        if not self.has_stats:
+            return self.compute_field_lengths().get(field, array('I', bytes(4 * len(self.doc_ids))))
+        data = self.section(f'lengths:{field}')
+        if data is None:
+            return array('I', bytes(4 * len(self.doc_ids)))
+        return _array_from_bytes(data)
+
+    def compute_field_lengths(self):
+        """
+        由 postings 累加各文档的词频得到字段长度（用于没有统计段的旧文件，需要扫描全部 postings）
+        :return: {field: array('I')}
+        """
+        if self._computed_lengths is None:
+            self._computed_lengths = {}
+            for field in self.fields:
+                lengths = array('I', bytes(4 * len(self.doc_ids)))
+                for _term, (doc_ords, positions_lists) in self.iter_field(field):
+                    for doc_ord, positions in zip(doc_ords, positions_lists):
+                        lengths[doc_ord] += len(positions)
+                self._computed_lengths[field] = lengths
+        return self._computed_lengths
+
+    def postings(self, field, term):
+        """
+        解码单个词项的 postings
+        :return: [(doc_ord, [positions])]，词项不存在时返回空列表
+        """
+        dictionary = self.fields.get(field)
+        i = dictionary.find(term) if dictionary is not None else -1
+        if i < 0:
+            return []
+        return list(zip(*self.decode_block(dictionary, i)))
+
+    def decode_block(self, dictionary, i):
+        """
+        解码词典中第 i 个词项的 postings 块
+        :return: (doc_ords, positions_lists)
+        """
+        offset = dictionary.offsets[i]
+        values = decode_varints(self.buf[offset:offset + dictionary.lengths[i]])
+        return next(iter_postings_blocks(values, [dictionary.dfs[i]]))
+
+    def decode_doc_ords(self, dictionary, i):
+        """
+        只解码第 i 个词项的文档序号列（块的第一列），不读取词频与位置
+        :return: 按序号递增的文档序号列表
+        """
+        offset = dictionary.offsets[i]
+        df = dictionary.dfs[i]
+        # 每个 u32 差值最多占 5 字节；多截取的部分属于后面的列，解码后丢弃
+        length = min(dictionary.lengths[i], 5 * df)
+        return list(accumulate(decode_varints(self.buf[offset:offset + length])[:df]))
+
+    def iter_field(self, field):
+        """
+        按字典序遍历一个字段的所有词项并解码
+        :return: 生成 (term, (doc_ords, positions_lists))
+        """
+        dictionary = self.fields[field]
+        if not dictionary.terms:
+            return
+        start = dictionary.offsets[0]
+        end = dictionary.offsets[-1] + dictionary.lengths[-1]
+        values = decode_varints(self.buf[start:end])
+        yield from zip(dictionary.terms, iter_postings_blocks(values, dictionary.dfs))
+
+
+def _term_stream(terms, run):
+    """生成 (term, run, 词典下标)，供 heapq.merge 归并"""
+    for i, term in enumerate(terms):
+        yield term, run, i
+
+
+def merge_indexes(input_paths, output_path, deleted=None, sections=None):
+    """
+    k 路归并多个二进制部分索引
+    各输入的文档序号依次平移拼接，因此每个词项的 postings 拼接后仍按序号递增
+    同一文档ID出现在多个输入中时（输入文件中的重复电影、段中已更新的文档），只保留最后一个输入中的版本
+    :param input_paths: 部分索引路径，顺序决定最终的文档序号
+    :param output_path: 输出路径
+    :param deleted: 与 input_paths 一一对应的待删除文档ID集合（段合并时清除墓碑文档），None 表示不删除
+    :param sections: 额外写入输出文件的附加段 {名称: bytes}
+    """
+    files = [open(path, 'rb') for path in input_paths]
+    try:
+        maps = [mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) for file in files]
+        readers = [IndexReader(buf) for buf in maps]
+        doc_ids = []
+        remaps = []  # 每个输入的 局部序号 -> 全局序号，被删除的文档为 None
+        field_names = sorted({field for reader in readers for field in reader.fields})
+        field_lengths = {field: array('I') for field in field_names}
+        last_run = {}  # {文档ID: 包含它的最后一个输入}
+        for run, reader in enumerate(readers):
+            dropped = deleted[run] if deleted else ()
+            for doc_id in reader.doc_ids:
+                if doc_id not in dropped:
+                    last_run[doc_id] = run
+        for run, reader in enumerate(readers):
+            remap = []
+            for doc_id in reader.doc_ids:
+                if last_run.get(doc_id) != run:  # 已删除，或被之后的输入中的版本取代
+                    remap.append(None)
+                else:
+                    remap.append(len(doc_ids))
+                    doc_ids.append(doc_id)
+            remaps.append(remap)
+            for field, merged_lengths in field_lengths.items():
+                lengths = reader.field_lengths(field)
+                merged_lengths.extend(
+                    length for length, doc_ord in zip(lengths, remap) if doc_ord is not None
+                )
+
+        writer = IndexWriter(output_path)
+        for field in field_names:
+            writer.begin_field(field)
+            streams = [
+                _term_stream(reader.fields[field].terms, run)
+                for run, reader in enumerate(readers) if field in reader.fields
+            ]
+            current = None
+            postings = []
+            # 归并后相同词项相邻，且按输入顺序排列
+            for term, run, i in heapq.merge(*streams):
+                if term != current:
+                    if current is not None:
+                        writer.add_term(current, postings)
+                    current = term
+                    postings = []
+                reader = readers[run]
+                remap = remaps[run]
+                doc_ords, positions_lists = reader.decode_block(reader.fields[field], i)
+                postings.extend(
+                    (remap[doc_ord], positions)
+                    for doc_ord, positions in zip(doc_ords, positions_lists)
+                    if remap[doc_ord] is not None
+                )
+            if current is not None:
+                writer.add_term(current, postings)
+            writer.end_field()
+        for name, data in (sections or {}).items():
+            writer.add_section(name, data)
+        writer.close(doc_ids, field_lengths)
+        for buf in maps:
+            buf.close()
+    finally:
+        for file in files:
+            file.close()
+
+
+def is_binary_index(file_path):
+    """根据文件头判断是否为二进制索引"""
+    with open(file_path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
@@ -1,28 +1,107 @@
 from collections import defaultdict
+from collections.abc import Mapping
+import gc
+import heapq
 import json
+import os
+from array import array
+from operator import itemgetter
+
+try:
+    from .index_format import IndexWriter, IndexReader, is_binary_index
+    from .mmap_index import MmapInvertedIndex
+    from .postings import DocTable, PostingsList, merge_postings
+    from .collection_stats import CollectionStats, lengths_from_postings
+except ImportError:
+    from index_format import IndexWriter, IndexReader, is_binary_index
+    from mmap_index import MmapInvertedIndex
+    from postings import DocTable, PostingsList, merge_postings
+    from collection_stats import CollectionStats, lengths_from_postings
 
 class PositionalInvertedIndex:
     def __init__(self):
         # 初始化倒排索引，支持多字段
-        self.index = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        # {field: {term: PostingsList}}，PostingsList 以文档序号存储，对外表现为 {doc_id: [pos]}
+        self.doc_table = DocTable()
+        self.index = defaultdict(dict)
+        # 集合统计：{field: 按文档序号排列的字段词数} 与 {field: 总词数}
+        self.field_lengths = {}
+        self.total_lengths = {}
+        self.version = 0  # 内容每次变化后递增，查询结果缓存据此失效
+
+    @property
+    def num_docs(self):
+        """索引中的文档数"""
+        return len(self.doc_table)
+
+    @property
+    def doc_ids(self):
+        """按文档序号排列的文档ID"""
+        return self.doc_table.doc_ids
+
+    @property
+    def stats(self):
+        """集合统计（N、df、字段长度），见 collection_stats.py"""
+        return CollectionStats(self.doc_table, self.index, self.field_lengths, self.total_lengths)
+
+    def _update_stats(self):
+        """补齐各字段长度数组并重新计算总词数；每次建立或载入索引后调用，同时递增版本号"""
+        self.version += 1
+        num_docs = len(self.doc_table)
+        for lengths in self.field_lengths.values():
+            if len(lengths) < num_docs:
+                lengths.extend([0] * (num_docs - len(lengths)))
+        self.total_lengths = {field: sum(lengths) for field, lengths in self.field_lengths.items()}
+
+    def _postings(self, field, term):
+        """返回词项的 PostingsList，不存在时创建"""
+        postings = self.index[field].get(term)
+        if postings is None:
+            postings = self.index[field][term] = PostingsList(self.doc_table)
+        return postings
+
+    def _finish(self):
+        """确保所有 postings 按文档序号有序（重复加入已有文档时才需要排序）"""
+        for terms in self.index.values():
+            for postings in terms.values():
+                postings.finish()
 
     def build_index(self, documents):
         """
         构建多字段的倒排索引
-        :param documents: 预处理后的文档字典，格式为 {doc_id: {field: [tokens]}}
+        :param documents: 预处理后的文档字典 {doc_id: {field: [tokens]}}，
+                          或逐个生成 (doc_id, {field: [tokens]}) 的可迭代对象（如 TextPreprocessor.iter_processed）
         """
-        for doc_id, fields in documents.items():
+        if isinstance(documents, Mapping):
+            documents = documents.items()
+        for doc_id, fields in documents:
+            doc_ord = self.doc_table.add(doc_id)
             for field, tokens in fields.items():
+                lengths = self.field_lengths.setdefault(field, array('I'))
+                if len(lengths) <= doc_ord:
+                    lengths.extend([0] * (doc_ord + 1 - len(lengths)))
+                lengths[doc_ord] = max(lengths[doc_ord], len(tokens))
+                term_positions = defaultdict(list)
                 for pos, token in enumerate(tokens):
+                    term_positions[token].append(pos)
+                for token, positions in term_positions.items():
                     # {field: {token: {doc_id: [pos]}}}
-                    self.index[field][token][doc_id].append(pos)
+                    self._postings(field, token).add(doc_ord, positions)
+        self._finish()
+        self._update_stats()
 
-    def save_index(self, file_path):
+    def save_index(self, file_path, fmt='text'):
         """
         将倒排索引保存到文件
         :param file_path: 文件路径
+        :param fmt: 'text' 为原有的文本格式，'binary' 为紧凑的二进制格式（见 index_format.py）
         """
-        with open(file_path, 'a', encoding='utf-8') as file:  # 使用'a'模式追加内容
+        if fmt == 'binary':
+            self.save_binary_index(file_path)
+            return
+        if fmt != 'text':
+            raise ValueError("Unsupported index format. Use 'text' or 'binary'.")
+        with open(file_path, 'w', encoding='utf-8') as file:  # 覆盖写入；以追加方式写入会在重新加载时重复 postings
             # {field: {term: {doc_id: [pos]}}}
             for field, terms in self.index.items():
                 for term, doc_dict in terms.items():
@@ -31,20 +110,174 @@ class PositionalInvertedIndex:
                         positions_str = ','.join(map(str, positions))
                         file.write(f"\t{doc_id}: {positions_str}\n")
 
+    def save_binary_index(self, file_path):
+        """
+        以二进制格式保存倒排索引：文档ID映射为稠密序号，postings 以差值 + varint 编码
+        :param file_path: 文件路径
+        """
+        writer = IndexWriter(file_path)
+        for field in sorted(self.index):
+            writer.begin_field(field)
+            terms = self.index[field]
+            for term in sorted(terms):
+                postings = terms[term]
+                writer.add_term(term, list(zip(postings.doc_ords, map(postings.positions_at, range(len(postings))))))
+            writer.end_field()
+        writer.close(self.doc_table.doc_ids, self.field_lengths)
+
     def load_index(self, file_path):
         """
-        从文件加载倒排索引
+        从文件加载倒排索引，根据文件头自动识别文本或二进制格式
+        :param file_path: 文件路径
+        """
+        # 加载时会创建大量小对象，暂停分代垃圾回收可避免其被反复触发
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if is_binary_index(file_path):
+                self.load_binary_index(file_path)
+            else:
+                self.load_text_index(file_path)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def load_text_index(self, file_path):
+        """
+        从文本格式加载倒排索引
         :param file_path: 文件路径
         """
+        doc_ids = self.doc_table.doc_ids
+        ordinals = self.doc_table.ordinals
+        entries = None  # 当前词项的 [(doc_ord, positions)]，读完整个词项后一次性写入 postings
+
+        def flush():
+            if not entries:
+                return
+            field_index = self.index[current_field]
+            entries.sort(key=itemgetter(0))  # 文档序号按首次出现的顺序分配，同一词项内不一定递增
+            doc_ords = [doc_ord for doc_ord, _ in entries]
+            if current_term not in field_index and len(set(doc_ords)) == len(doc_ords):
+                field_index[current_term] = PostingsList.from_lists(
+                    self.doc_table, doc_ords, [positions for _, positions in entries])
+                return
+            postings = self._postings(current_field, current_term)
+            for doc_ord, positions in entries:
+                postings.add(doc_ord, positions)  # 同一文档重复出现时在 finish 中合并位置列表
+
         with open(file_path, 'r', encoding='utf-8') as file:
-            current_field = None
-            current_term = None
             for line in file:
                 if line and not line.startswith('\t'):  # 处理字段和术语行
+                    flush()
                     parts = line.split(':', 1)  # 只分割第一个冒号
                     current_field = parts[0].strip()
                     current_term = parts[1].strip()
+                    entries = []
                 elif line.startswith('\t'):  # 处理文档ID和位置行
                     doc_id, positions_str = line.split(':', 1)
-                    positions = list(map(int, positions_str.split(',')))
-                    self.index[current_field][current_term][doc_id.strip()].extend(positions)  # 合并位置列表 
\ No newline at end of file
+                    doc_id = doc_id.strip()
+                    doc_ord = ordinals.get(doc_id)
+                    if doc_ord is None:
+                        doc_ord = ordinals[doc_id] = len(doc_ids)
+                        doc_ids.append(doc_id)
+                    entries.append((doc_ord, list(map(int, positions_str.split(',')))))
+            flush()
+        self._finish()
+        # 文本格式不保存字段长度，由 postings 中的词频累加得到
+        self.field_lengths = lengths_from_postings(self.index, len(self.doc_table))
+        self._update_stats()
+
+    def load_binary_index(self, file_path):
+        """
+        从二进制格式加载倒排索引
+        :param file_path: 文件路径
+        """
+        with open(file_path, 'rb') as file:
+            reader = IndexReader(file.read())
+        if not self.doc_table.doc_ids:
+            self.doc_table = DocTable(reader.doc_ids)
+            remap = None
+        else:
+            remap = [self.doc_table.add(doc_id) for doc_id in reader.doc_ids]  # 与已有内容合并
+        for field in reader.fields:
+            field_index = self.index[field]
+            for term, (doc_ords, positions_lists) in reader.iter_field(field):
+                if remap is None and term not in field_index:
+                    field_index[term] = PostingsList.from_lists(self.doc_table, doc_ords, positions_lists)
+                    continue
+                postings = self._postings(field, term)
+                for doc_ord, positions in zip(doc_ords, positions_lists):
+                    postings.add(remap[doc_ord] if remap is not None else doc_ord, positions)
+        self._finish()
+        if remap is None and reader.has_stats:
+            self.field_lengths = {field: reader.field_lengths(field) for field in reader.total_lengths()}
+        else:
+            self.field_lengths = lengths_from_postings(self.index, len(self.doc_table))
+        self._update_stats()
+
+
+def convert_index(src_path, dst_path, fmt='binary'):
+    """
+    将已有的索引文件（如 index.txt）转换为另一种格式
+    :param src_path: 源索引文件，格式自动识别
+    :param dst_path: 目标文件
+    :param fmt: 目标格式，'binary' 或 'text'
+    """
+    index = PositionalInvertedIndex()
+    index.load_index(src_path)
+    index.save_index(dst_path, fmt=fmt)
+    return index
+
+
+class MergedFieldsView(Mapping):
+    """
+    将多字段索引按词项合并的只读视图：{term: PostingsList}
+    与逐项复制出一个 retrieval_index 的结果相同，但只在访问某个词项时才合并该词项的各字段 postings
+    """
+
+    def __init__(self, index, fields=None):
+        """
+        :param index: 多字段索引结构 {field: {term: {doc_id: [pos]}}}
+        :param fields: 参与合并的字段，默认使用全部字段
+        """
+        self.index = index
+        self.fields = list(fields) if fields is not None else list(index)
+
+    def __getitem__(self, term):
+        postings_lists = [self.index[field][term] for field in self.fields if term in self.index[field]]
+        if not postings_lists:
+            raise KeyError(term)
+        return merge_postings(postings_lists, postings_lists[0].doc_table)
+
+    def __contains__(self, term):
+        return any(term in self.index[field] for field in self.fields)
+
+    def __iter__(self):
+        # 各字段的词项分别排序后归并去重
+        last = None
+        for term in heapq.merge(*(sorted(self.index[field]) for field in self.fields)):
+            if term != last:
+                yield term
+                last = term
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def open_index(file_path):
+    """
+    打开索引文件用于查询：分段索引目录按段检索，二进制索引以 mmap 方式按需读取，文本索引完整加载到内存
+    :param file_path: 索引文件或分段索引目录路径
+    :return: 具有 index 属性的索引对象
+    """
+    if os.path.isdir(file_path):
+        try:
+            from .segments import SegmentedIndex
+        except ImportError:
+            from segments import SegmentedIndex
+        return SegmentedIndex(file_path)
+    if is_binary_index(file_path):
+        return MmapInvertedIndex(file_path)
+    index = PositionalInvertedIndex()
+    index.load_index(file_path)
+    return index
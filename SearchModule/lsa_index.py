@@ -0,0 +1,312 @@
+import argparse
+import math
+import os
+import time
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时不提供 LSA 检索
+    np = None
+
+try:
+    from .indexer import open_index
+    from .models import resolve_after, select_page
+    from .postings import DocTable
+    from .sparse_scoring import build_tfidf_matrix
+except ImportError:
+    from indexer import open_index
+    from models import resolve_after, select_page
+    from postings import DocTable
+    from sparse_scoring import build_tfidf_matrix
+
+# 潜在语义（LSA）向量索引
+#
+# 离线构建（需要 numpy / scipy，只用 CPU）：
+#   1. 词项 x 文档的 TF-IDF 矩阵 A（见 sparse_scoring.build_tfidf_matrix，默认只用 plot 字段），每列 L2 归一化；
+#   2. 随机化截断 SVD：A ≈ U S V^T，保留 dims 维。文档向量 d = U^T a = S V^T 的列，查询向量 q = U^T (count * idf)，
+#      都归一化为单位向量，相似度为余弦；
+#   3. IVF：对文档向量做球面 k-means，得到 num_lists 个质心，每篇文档归入最近的质心。
+# 文档向量按所属的列表重新排列后存为 float32 的 .npy（index.lsa.npy），以 mmap 方式载入，一个列表是一段连续的行；
+# 其余部分（词表、idf、投影矩阵 U、质心、列表边界、行 -> 文档序号、文档ID）存为 index.lsa.npz。
+#
+# 查询时先与全部质心比较，只扫描最近的 nprobe 个列表（约 nprobe / num_lists 的文档），选出余弦最高的 k 个；
+# nprobe = num_lists 时与暴力搜索相同。召回率见 benchmarks.py lsa。
+# 稠密检索的候选与词法检索（TFIDFRetrieval.top_k）的结果用倒数排名融合（RRF）合并，见 HybridRetrieval。
+#
+# 用法：python lsa_index.py index.bin -o index.lsa.npz --dims 128
+
+LSA_AVAILABLE = np is not None
+DEFAULT_LSA_DIMS = 128
+DEFAULT_LSA_FIELDS = ('plot',)
+DEFAULT_NPROBE = 16
+DEFAULT_FUSION_DEPTH = 100
+DEFAULT_RRF_K = 60
+
+
+def embeddings_path(model_path):
+    """模型文件（.npz）对应的文档向量文件（.npy）"""
+    return os.path.splitext(model_path)[0] + '.npy'
+
+
+def truncated_svd(matrix, dims, n_iter=4, oversample=10, seed=0):
+    """
+    随机化截断 SVD（Halko 等的 range finder + 幂迭代），只需要 matrix 与稠密矩阵的乘积
+    :param matrix: m x n 稀疏或稠密矩阵
+    :param dims: 保留的奇异值个数
+    :return: (U m x dims, s dims, Vt dims x n)，奇异值从大到小
+    """
+    rng = np.random.default_rng(seed)
+    m, n = matrix.shape
+    size = min(dims + oversample, m, n)
+    q, _ = np.linalg.qr(matrix @ rng.standard_normal((n, size)))
+    for _ in range(n_iter):
+        z, _ = np.linalg.qr(matrix.T @ q)
+        q, _ = np.linalg.qr(matrix @ z)
+    u_small, s, vt = np.linalg.svd(np.asarray((matrix.T @ q).T), full_matrices=False)
+    dims = min(dims, len(s))
+    return q @ u_small[:, :dims], s[:dims], vt[:dims]
+
+
+def _normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _nearest_centroids(vectors, centroids, chunk_size=65536):
+    """每个向量余弦最高的质心下标，分块计算以限制内存"""
+    return np.concatenate([
+        np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), chunk_size)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+
+def spherical_kmeans(vectors, num_lists, iterations=20, seed=0):
+    """
+    单位向量的 k-means（按余弦分配，质心归一化）
+    :return: (质心 num_lists x dims, 每个向量所属的质心)
+    """
+    rng = np.random.default_rng(seed)
+    num_lists = max(1, min(num_lists, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    assignments = _nearest_centroids(vectors, centroids)
+    for _ in range(iterations):
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = np.flatnonzero(np.linalg.norm(sums, axis=1) == 0)
+        if len(empty):  # 空的列表用随机的文档重新初始化
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = _normalize_rows(sums)
+        updated = _nearest_centroids(vectors, centroids)
+        if np.array_equal(updated, assignments):
+            break
+        assignments = updated
+    return centroids, assignments
+
+
+def build_lsa_index(index, output_path, dims=DEFAULT_LSA_DIMS, num_lists=None, fields=DEFAULT_LSA_FIELDS, seed=0):
+    """
+    由索引构建 LSA 向量与 IVF 列表
+    :param index: 具有 index 与 stats 属性的索引对象
+    :param output_path: 模型文件（.npz）路径，文档向量写在同名的 .npy 中
+    :param dims: 向量维数
+    :param num_lists: IVF 列表数，默认约为 sqrt(文档数)
+    :param fields: 参与的字段，索引中没有这些字段时使用全部字段
+    :return: (文档数, 维数, 列表数)
+    """
+    fields = [field for field in fields if field in index.index] or None
+    matrix, terms = build_tfidf_matrix(index, fields)
+    num_terms, num_docs = matrix.shape
+    dfs = np.diff(matrix.indptr)
+    idfs = np.log(index.stats.num_docs / (dfs + 1.0)) + 1.0
+    # 每篇文档的 TF-IDF 向量归一化，长剧情与短剧情对奇异向量的影响相同
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+    norms[norms == 0] = 1.0
+    matrix = matrix.multiply(1.0 / norms).tocsr()
+    projection, _, _ = truncated_svd(matrix, min(dims, max(1, min(num_terms, num_docs) - 1)), seed=seed)
+    vectors = _normalize_rows(np.asarray(matrix.T @ projection))
+
+    if num_lists is None:
+        num_lists = max(1, int(round(math.sqrt(num_docs))))
+    centroids, assignments = spherical_kmeans(vectors, num_lists, seed=seed)
+    order = np.argsort(assignments, kind='stable')
+    offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+    np.save(embeddings_path(output_path), vectors[order].astype(np.float32))
+    with open(output_path, 'wb') as file:  # 传入文件对象，numpy 不会自动追加 .npz 后缀
+        np.savez(
+            file, terms=np.array(terms, dtype=str), idfs=idfs, projection=projection.astype(np.float32),
+            centroids=centroids.astype(np.float32), offsets=offsets.astype(np.int64), ords=order.astype(np.uint32),
+            doc_ids=np.array(index.stats.doc_table.doc_ids, dtype=str),
+        )
+    return num_docs, projection.shape[1], len(centroids)
+
+
+class LSARetrieval:
+    """基于 LSA 向量与 IVF 列表的稠密检索"""
+
+    def __init__(self, model_path, preprocessor, nprobe=DEFAULT_NPROBE):
+        """
+        :param model_path: build_lsa_index 写出的 .npz
+        :param preprocessor: 文本预处理器（与建索引时相同）
+        :param nprobe: 每次查询扫描的列表数
+        """
+        with np.load(model_path) as arrays:
+            self.terms = arrays['terms'].tolist()
+            self.idfs = arrays['idfs']
+            self.projection = arrays['projection']
+            self.centroids = arrays['centroids']
+            self.offsets = arrays['offsets']
+            self.ords = arrays['ords']
+            doc_ids = arrays['doc_ids'].tolist()
+        self.embeddings = np.load(embeddings_path(model_path), mmap_mode='r')
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+        self.doc_table = DocTable(doc_ids)
+        self.doc_ids = self.doc_table.doc_ids
+        self.preprocessor = preprocessor
+        self.nprobe = nprobe
+
+    @property
+    def num_lists(self):
+        return len(self.centroids)
+
+    def normalize_query(self, query):
+        """预处理后的查询词（排序），用作结果缓存的键"""
+        return ' '.join(sorted(self.preprocessor.process_text(query)))
+
+    def embed(self, query):
+        """查询的单位向量，没有已知词项时返回 None"""
+        counts = Counter(self.vocabulary[term] for term in self.preprocessor.process_text(query)
+                         if term in self.vocabulary)
+        if not counts:
+            return None
+        rows = np.fromiter(counts, dtype=np.int64)
+        weights = np.fromiter(counts.values(), dtype=np.float64) * self.idfs[rows]
+        vector = weights @ self.projection[rows]
+        norm = np.linalg.norm(vector)
+        return (vector / norm).astype(np.float32) if norm > 0 else None
+
+    def candidate_scores(self, query, nprobe=None):
+        """
+        扫描最近的 nprobe 个列表
+        :param nprobe: 扫描的列表数，None 使用默认值，不小于列表数时即暴力搜索
+        :return: (文档序号数组, 余弦数组)，只包含余弦为正的文档
+        """
+        vector = self.embed(query)
+        if vector is None:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float32)
+        nprobe = self.nprobe if nprobe is None else nprobe
+        if nprobe >= self.num_lists:
+            scores = self.embeddings @ vector
+            ords = self.ords
+        else:
+            lists = np.argpartition(self.centroids @ vector, self.num_lists - nprobe)[self.num_lists - nprobe:]
+            # 每个列表是 .npy 中连续的一段行，只读取这几段
+            rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+            scores = np.concatenate([self.embeddings[self.offsets[i]:self.offsets[i + 1]] @ vector for i in lists])
+            ords = self.ords[rows]
+        keep = scores > 0
+        return ords[keep], scores[keep]
+
+    def _ranked(self, ords, scores, k=None):
+        if k is not None and len(scores) > k:
+            kth = scores[np.argpartition(scores, len(scores) - k)[len(scores) - k]]
+            keep = scores >= kth
+            ords, scores = ords[keep], scores[keep]
+        order = np.lexsort((ords, -scores))[:k]
+        doc_ids = self.doc_ids
+        return [(doc_ids[doc_ord], score) for doc_ord, score in zip(ords[order].tolist(), scores[order].tolist())]
+
+    def search(self, query, k=10, nprobe=None):
+        """
+        余弦最高的 k 个文档（IVF 近似）
+        :return: [(doc_id, 余弦)]，按余弦从高到低排列，相同时按文档序号排列
+        """
+        if k <= 0:
+            return []
+        return self._ranked(*self.candidate_scores(query, nprobe), k)
+
+    def search_exact(self, query, k=10):
+        """暴力搜索全部文档向量，用于评估召回率"""
+        return self.search(query, k, nprobe=self.num_lists)
+
+    def top_k(self, query, k=10):
+        return self.search(query, k)
+
+    def page(self, query, size, after=None):
+        """
+        排序结果中的一页（在扫描到的候选之内）
+        :param after: 上一页最后一个结果的 (得分, 文档ID)，None 表示从第一个结果开始
+        :return: ([(doc_id, 余弦)], 候选文档数)
+        """
+        after = resolve_after(after, self.doc_table)
+        ords, scores = self.candidate_scores(query)
+        total = len(scores)
+        if after is not None:
+            after_score, after_ord = after
+            keep = (scores < after_score) | ((scores == after_score) & (ords > after_ord))
+            ords, scores = ords[keep], scores[keep]
+        return self._ranked(ords, scores, size), total
+
+
+class HybridRetrieval:
+    """词法检索与 LSA 稠密检索的倒数排名融合：score(d) = sum 1 / (rrf_k + 名次)"""
+
+    def __init__(self, lexical, dense, doc_table, depth=DEFAULT_FUSION_DEPTH, rrf_k=DEFAULT_RRF_K):
+        """
+        :param lexical: 提供 top_k 的词法检索（如 TFIDFRetrieval）
+        :param dense: LSARetrieval
+        :param doc_table: 索引的文档表，得分相同时按其中的序号排列
+        :param depth: 每一路参与融合的结果数
+        :param rrf_k: RRF 的平滑常数
+        """
+        self.lexical = lexical
+        self.dense = dense
+        self.doc_table = doc_table
+        self.depth = depth
+        self.rrf_k = rrf_k
+
+    def normalize_query(self, query):
+        return self.lexical.normalize_query(query)
+
+    def fused_scores(self, query):
+        """:return: {文档序号: 融合得分}"""
+        scores = {}
+        for ranking in (self.lexical.top_k(query, self.depth), self.dense.search(query, self.depth)):
+            for rank, (doc_id, _) in enumerate(ranking, 1):
+                doc_ord = self.doc_table.get(doc_id)
+                if doc_ord >= 0:
+                    scores[doc_ord] = scores.get(doc_ord, 0.0) + 1.0 / (self.rrf_k + rank)
+        return scores
+
+    def page(self, query, size, after=None):
+        """
+        融合结果中的一页
+        :return: ([(doc_id, 融合得分)], 融合的候选文档数，不超过 2 * depth)
+        """
+        scores = self.fused_scores(query)
+        hits = select_page(scores, size, resolve_after(after, self.doc_table))
+        return [(self.doc_table.doc_ids[doc_ord], score) for doc_ord, score in hits], len(scores)
+
+    def top_k(self, query, k=10):
+        return self.page(query, k)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an LSA vector index with IVF lists for dense retrieval.')
+    parser.add_argument('index', help='text / binary index file or segmented index directory')
+    parser.add_argument('-o', '--output', default='index.lsa.npz', help='output .npz path (vectors go to .npy)')
+    parser.add_argument('--dims', type=int, default=DEFAULT_LSA_DIMS, help=f'dimensions (default: {DEFAULT_LSA_DIMS})')
+    parser.add_argument('--lists', type=int, default=None, help='IVF lists (default: sqrt of the document count)')
+    parser.add_argument('--fields', nargs='+', default=list(DEFAULT_LSA_FIELDS), help='fields to embed')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    num_docs, dims, num_lists = build_lsa_index(open_index(args.index), args.output, args.dims, args.lists,
+                                                args.fields)
+    print(f"已生成 {num_docs} 篇文档的 {dims} 维向量与 {num_lists} 个 IVF 列表 -> {args.output}，"
+          f"用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
-from collections import defaultdict
 from preprocessor import TextPreprocessor
-from indexer import PositionalInvertedIndex
+from indexer import PositionalInvertedIndex, MergedFieldsView
 from search import QueryProcessor
+from query_parser import is_boolean_query
 from models import TFIDFRetrieval
 
 #movie_search/
@@ -23,9 +23,7 @@ def search(query: str, query_processor: QueryProcessor) -> list:
     """
     
     # 判断查询类型
-    if any(field in query for field in ['title:', 'director:', 'plot:', 'cast:']) or \
-       any(op in query for op in ['AND', 'OR']) or \
-       '"' in query:
+    if is_boolean_query(query):
         # 执行复杂查询
         return query_processor.query(query)
     else:
@@ -57,25 +55,18 @@ if __name__ == "__main__":
     #         print(f"未找到 {year} 年的数据文件")
     #         continue
 
-    documents = preprocessor.process_file(f'sample/2024_sample.json')
+    documents = preprocessor.iter_processed(f'sample/2024_sample.json')  # 流式读取，构建索引时才逐个处理
     # index.build_index(documents)
     # # 保存完整的索引到文件
     # index.save_index('SearchModule\\index.txt')
     # 加载现有索引
     index.load_index('SearchModule\\index.txt')
 
-    # 创建统一的检索索引（合并所有字段）
-    retrieval_index = defaultdict(lambda: defaultdict(list))
-    
-    # 遍历多字段索引结构 {field: {term: {docID: [positions]}}}
-    for field, terms in index.index.items():
-        for term, doc_dict in terms.items():
-            for doc_id, positions in doc_dict.items():
-                # 将不同字段的相同term合并到统一索引
-                retrieval_index[term][doc_id].extend(positions)
+    # 创建统一的检索索引（按词项合并所有字段，访问时才合并）
+    retrieval_index = MergedFieldsView(index.index)
 
     # 创建TF-IDF检索对象
-    retrieval = TFIDFRetrieval(retrieval_index, preprocessor)
+    retrieval = TFIDFRetrieval(retrieval_index, preprocessor, stats=index.stats)
 
     # 创建查询处理对象
     query_processor = QueryProcessor(index, preprocessor)
@@ -0,0 +1,134 @@
+import mmap
+import os
+from array import array
+from collections.abc import Mapping
+from functools import cached_property, lru_cache
+
+try:
+    from .index_format import IndexReader
+    from .postings import DocTable, PostingsList
+    from .collection_stats import CollectionStats
+except ImportError:
+    from index_format import IndexReader
+    from postings import DocTable, PostingsList
+    from collection_stats import CollectionStats
+
+
+class MmapInvertedIndex:
+    """
+    只读的二进制索引后端
+    通过 mmap 映射索引文件，内存中只保留有序词典（词项 -> 字节偏移），
+    某个词项的 postings 只在被查询时才解码。多个工作进程映射同一文件时共享操作系统的页缓存。
+    提供与 PositionalInvertedIndex 相同的 index 属性：{field: {term: PostingsList}}
+    """
+
+    def __init__(self, file_path, cache_size=128):
+        """
+        :param file_path: 二进制索引文件路径
+        :param cache_size: 每个字段缓存的已解码 postings 数量
+        """
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(file.fileno())
+        # 索引文件只读，以路径与文件的修改时间、大小标识版本；重新生成的索引文件版本不同
+        self.version = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        self.reader = IndexReader(self.mmap)
+        self.doc_table = DocTable(self.reader.doc_ids)
+        self.doc_ids = self.doc_table.doc_ids
+        self.index = LazyIndex({
+            field: LazyFieldIndex(self.reader, dictionary, self.doc_table, cache_size)
+            for field, dictionary in self.reader.fields.items()
+        })
+
+    @property
+    def num_docs(self):
+        """索引中的文档数"""
+        return len(self.doc_ids)
+
+    @cached_property
+    def stats(self):
+        """集合统计，从索引文件的统计段读取（旧文件首次访问时扫描 postings）"""
+        total_lengths = self.reader.total_lengths()
+        field_lengths = {field: self.reader.field_lengths(field) for field in total_lengths}
+        return CollectionStats(self.doc_table, self.index, field_lengths, total_lengths)
+
+    def close(self):
+        """解除文件映射"""
+        self.mmap.close()
+
+
+class LazyIndex(Mapping):
+    """字段 -> LazyFieldIndex 的映射，访问不存在的字段时返回空字段（与 defaultdict 的行为一致，但不插入）"""
+
+    _EMPTY = {}
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __getitem__(self, field):
+        return self.fields.get(field, self._EMPTY)
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+
+class LazyFieldIndex(Mapping):
+    """单个字段的词项 -> postings 映射，postings 按需从 mmap 解码为 PostingsList"""
+
+    def __init__(self, reader, dictionary, doc_table, cache_size):
+        self.reader = reader
+        self.dictionary = dictionary
+        self.doc_table = doc_table
+        # 查询处理中同一词项常被反复访问（如短语匹配时逐文档探测），按词项缓存解码结果
+        self._postings = lru_cache(maxsize=cache_size)(self._decode_term)
+        self._doc_ords = lru_cache(maxsize=cache_size)(self._decode_doc_ords)
+
+    def _decode_term(self, term):
+        i = self.dictionary.find(term)
+        if i < 0:
+            raise KeyError(term)
+        doc_ords, positions_lists = self.reader.decode_block(self.dictionary, i)
+        return PostingsList.from_lists(self.doc_table, doc_ords, positions_lists)
+
+    def _decode_doc_ords(self, term):
+        i = self.dictionary.find(term)
+        if i < 0:
+            return array('I')
+        return array('I', self.reader.decode_doc_ords(self.dictionary, i))
+
+    def __getitem__(self, term):
+        return self._postings(term)
+
+    def doc_ords(self, term):
+        """只解码词项的文档序号（不含位置），用于与候选文档求交"""
+        return self._doc_ords(term)
+
+    def __contains__(self, term):
+        return self.dictionary.find(term) >= 0
+
+    def __iter__(self):
+        return iter(self.dictionary.terms)
+
+    def __len__(self):
+        return len(self.dictionary)
+
+    def df(self, term):
+        """不解码 postings，直接从词典读取文档频率"""
+        i = self.dictionary.find(term)
+        return self.dictionary.dfs[i] if i >= 0 else 0
+
+    def max_tf(self, term):
+        """词项的最大词频，从建索引时写入的 maxtf 段读取（旧文件解码 postings 计算）"""
+        i = self.dictionary.find(term)
+        if i < 0:
+            return 0
+        if self.dictionary.max_tfs is None:
+            return self[term].max_tf()
+        return self.dictionary.max_tfs[i]
@@ -1,50 +1,314 @@
+import heapq
 import math
-from collections import defaultdict
+import time
+from collections import Counter, defaultdict
+from itertools import accumulate
+
+try:
+    from .collection_stats import max_tf
+    from .postings import gallop
+except ImportError:
+    from collection_stats import max_tf
+    from postings import gallop
+
+# BM25F 默认参数：各字段的权重（一次标题命中相当于几次剧情命中）与长度归一化强度 b。
+# 标题、导演、演员字段很短且长度差异小，归一化较弱；剧情长短不一，归一化较强。
+DEFAULT_FIELD_WEIGHTS = {'title': 3.0, 'director': 2.0, 'cast': 1.5, 'plot': 1.0}
+DEFAULT_FIELD_B = {'title': 0.5, 'director': 0.3, 'cast': 0.4, 'plot': 0.75}
+DEFAULT_K1 = 1.2
+# 静态先验（见 static_prior.py）的混合权重：score = relevance + weight * prior[d]，prior 在 [0, 1] 之间
+DEFAULT_PRIOR_WEIGHT = 1.0
+
+# top-k 检索中得分比较的相对容差：上界与部分得分的累加顺序不同，浮点舍入可能使两者相差几个 ulp
+TOP_K_TOLERANCE = 1e-9
+# 剪枝阶段候选文档数乘以该倍数仍少于 postings 长度时，逐个候选 galloping 查找，否则顺序扫描 postings
+_GALLOP_RATIO = 8
+
+
+def matched_terms(term, contains, fuzzy=None, deadline=None):
+    """
+    查询词在索引中时只匹配它本身，否则用模糊查找得到的相近词项代替（拼写错误、音译名的不同写法）
+    :param contains: 判断词项是否在索引中的函数
+    :param fuzzy: 模糊查找函数 fuzzy(term, deadline=...) -> [相近的词项]，None 表示不做模糊查找
+    :return: 词项列表
+    """
+    if contains(term):
+        return [term]
+    return fuzzy(term, deadline=deadline) if fuzzy is not None else []
+
+
+def select_page(scores, size, after=None):
+    """
+    用大小为 size 的堆选出排在 after 之后的 size 个文档，不对全部得分排序
+    :param scores: {文档序号: 得分}
+    :param size: 返回的文档数
+    :param after: 上一页最后一个结果的 (得分, 文档序号)，None 表示从第一个结果开始
+    :return: [(文档序号, 得分)]，按得分从高到低排列，得分相同时按文档序号排列
+    """
+    items = scores.items()
+    if after is not None:
+        after_score, after_ord = after
+        items = ((doc_ord, score) for doc_ord, score in items
+                 if score < after_score or (score == after_score and doc_ord > after_ord))
+    return heapq.nsmallest(size, items, key=lambda x: (-x[1], x[0]))
+
+
+def resolve_after(after, doc_table):
+    """
+    将分页游标中的 (得分, 文档ID) 转换为 (得分, 文档序号)
+    :raises ValueError: 文档不在文档表中（游标来自另一个索引）
+    """
+    if after is None:
+        return None
+    score, doc_id = after
+    doc_ord = doc_table.get(doc_id)
+    if doc_ord < 0:
+        raise ValueError(f"Unknown document in cursor: {doc_id}")
+    return float(score), doc_ord
+
 
 class TFIDFRetrieval:
-    def __init__(self, index, preprocessor, retrieval_file='retrieval.txt'):
+    def __init__(self, index, preprocessor, retrieval_file='retrieval.txt', num_docs=None, stats=None,
+                 fuzzy=None, fuzzy_budget=0.05, prior=None, prior_weight=DEFAULT_PRIOR_WEIGHT, source=None):
         self.index = index  # 获取倒排索引
         self.preprocessor = preprocessor
-        self.N = len({doc_id for term in self.index for doc_id in self.index[term]})  # 从索引中统计唯一文档数
+        # 模糊查找函数 fuzzy(term, deadline=...) -> [相近的词项]（如 QueryProcessor.fuzzy_terms），
+        # 查询词不在索引中时用相近的词项代替；fuzzy_budget 为一次查询中模糊查找可用的时间（秒）
+        self.fuzzy = fuzzy
+        self.fuzzy_budget = fuzzy_budget
+        # 静态先验（StaticPrior），匹配查询的文档得分加上 prior_weight * 先验；None 表示只按相关度排序。
+        # 按文档序号读取前先与 postings 的文档表对齐（StaticPrior.aligned），分段索引合并后序号变化也不会错位
+        self.prior = prior
+        self.prior_weight = prior_weight
+        self._stats = stats  # 随索引保存的集合统计（CollectionStats），提供 N 与字段长度
+        # 提供 stats 属性的索引对象（如 SegmentedIndex）：给定时每次查询读取它当前的统计，代替 stats
+        self.source = source
+        if num_docs is None and stats is None and source is None:
+            num_docs = len({doc_id for term in self.index for doc_id in self.index[term]})  # 从索引中统计唯一文档数
+        self._num_docs = num_docs  # 固定的文档数，None 表示随统计变化
         self.retrieval_file = retrieval_file  # 用于存储检索结果的文件路径
         self.tfidf_scores = {}  # 用于存储 TF-IDF 得分字典
 
+    @property
+    def stats(self):
+        """当前的集合统计：分段索引写入或合并后，文档序号与 N 都随之变化"""
+        return self.source.stats if self.source is not None else self._stats
+
+    @property
+    def N(self):
+        """计算 idf 使用的文档数"""
+        return self._num_docs if self._num_docs is not None else self.stats.num_docs
+
+    def normalize_query(self, query):
+        """预处理后的查询词（排序），词序不同但得分相同的查询得到相同的结果，用作结果缓存的键"""
+        return ' '.join(sorted(self.preprocessor.process_text(query)))
+
     def compute_tfidf_scores(self, query):
         query_terms = self.preprocessor.process_text(query)  # 转小写并分词
         doc_scores = defaultdict(float)  # 存储文档得分
 
-        # 输出查询的词项，确保正确分词
-        print(f"Query terms: {query_terms}")
-
-        # 检查查询词是否出现在倒排索引中，若没有，强制生成匹配
+        # 查询词不在倒排索引中时，用编辑距离相近的词项代替
+        deadline = time.perf_counter() + self.fuzzy_budget
         for term in query_terms:
-            if term in self.index:  # 如果词项在倒排索引中
-                print(f"Term '{term}' found in index.")  # 输出找到的词项
-                postings = self.index[term]  # 获取该词项的倒排列表
-                idf = self.compute_idf(term)  # 计算逆文档频率（IDF）
+            for matched_term in matched_terms(term, self.index.__contains__, self.fuzzy, deadline):
+                postings = self.index[matched_term]  # 获取该词项的倒排列表
+                idf = self.compute_idf(matched_term, postings)  # 计算逆文档频率（IDF）
 
                 for doc_id, positions in postings.items():
                     tf = len(positions)  # 计算词项的词频（TF）
                     tfidf = tf * idf  # 计算 TF-IDF
                     doc_scores[doc_id] += tfidf  # 将得分累加到文档
-            else:
-                print(f"Term '{term}' not found in index. Generating fake matches.")  # 输出没有找到词项
 
-                # 强制给定默认文档，确保输出结果
-                fake_doc_id = "default_doc"
-                tfidf = 1.0  # 强制设定一个得分值
-                doc_scores[fake_doc_id] += tfidf  # 将默认得分累加到虚拟文档
+        if self.prior is not None:  # 相关度之后再加先验，与 top_k 的累加顺序相同
+            for doc_id in doc_scores:
+                doc_scores[doc_id] += self.prior_weight * self.prior.get(doc_id)
 
-        # 对文档得分进行排序
-        sorted_doc_scores = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
+        # 对文档得分进行排序，得分相同时按文档序号排列（与 top_k 的结果一致）
+        stats = self.stats
+        if stats is not None:
+            ordinal = stats.doc_table.get
+            sorted_doc_scores = sorted(doc_scores.items(), key=lambda x: (-x[1], ordinal(x[0])))
+        else:
+            sorted_doc_scores = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
         # self.tfidf_scores = doc_scores  # 将得分字典存储下来
         # self.save_retrieval_results()  # 保存检索结果
 
         # print(f"Sorted results: {sorted_doc_scores}")  # 输出排序后的结果
         return sorted_doc_scores
 
-    def compute_idf(self, term):
-        df = len(self.index.get(term, {}))  # 获取词项的文档频率
+    def _field_indexes(self, term):
+        """包含词项的各字段索引，不做跨字段合并；索引不是合并视图时为其本身"""
+        fields = getattr(self.index, 'fields', None)
+        if fields is None:  # 单一的 {term: PostingsList}
+            return [self.index]
+        index = self.index.index
+        return [index[field] for field in fields if term in index[field]]
+
+    def _field_postings(self, term):
+        """
+        词项在各字段中的 postings 与最大词频
+        :return: [(PostingsList, 最大词频)]
+        """
+        return [(field_index[term], max_tf(field_index, term)) for field_index in self._field_indexes(term)]
+
+    def scoring_terms(self, query):
+        """参与打分的词项（查询词或代替它的相近词项），顺序与 compute_tfidf_scores 累加的顺序相同"""
+        deadline = time.perf_counter() + self.fuzzy_budget
+        terms = []
+        for term in self.preprocessor.process_text(query):
+            terms.extend(matched_terms(term, self.index.__contains__, self.fuzzy, deadline))
+        return terms
+
+    def scores_by_ordinal(self, scoring_terms):
+        """
+        与 compute_tfidf_scores 相同的累加顺序与浮点结果，但以文档序号为键、不解码位置列表
+        :return: {文档序号: 得分}
+        """
+        scores = defaultdict(float)
+        doc_table = None
+        for term in scoring_terms:
+            postings = self.index[term]
+            doc_table = postings.doc_table
+            idf = self.compute_idf(term, postings)
+            for doc_ord, tf in zip(postings.doc_ords, postings.tfs()):
+                scores[doc_ord] += tf * idf
+        if self.prior is not None and doc_table is not None:
+            prior = self.prior.aligned(doc_table)
+            for doc_ord in scores:
+                scores[doc_ord] += self.prior_weight * prior[doc_ord]
+        return scores
+
+    def count_matches(self, scoring_terms):
+        """包含任一词项的文档数（即完整结果的长度），只读取文档序号，不打分"""
+        doc_ords = set()
+        for term in set(scoring_terms):
+            for field_index in self._field_indexes(term):
+                if hasattr(field_index, 'doc_ords'):  # 二进制索引只解码文档序号
+                    doc_ords.update(field_index.doc_ords(term))
+                else:
+                    doc_ords.update(field_index[term].doc_ords)
+        return len(doc_ords)
+
+    def page(self, query, size, after=None):
+        """
+        排序结果中的一页：第一页用 top_k 的 MaxScore 剪枝，之后的页用大小为 size 的堆选出游标之后的结果
+        :param query: 查询字符串
+        :param size: 每页的文档数
+        :param after: 上一页最后一个结果的 (得分, 文档ID)，None 表示从第一个结果开始
+        :return: ([(doc_id, score)], 完整结果的文档总数)
+        """
+        doc_table = self.stats.doc_table
+        after = resolve_after(after, doc_table)
+        scoring_terms = self.scoring_terms(query)
+        if after is None:
+            hits = self._top_k(scoring_terms, size)
+        else:
+            hits = [(doc_table.doc_ids[doc_ord], score)
+                    for doc_ord, score in select_page(self.scores_by_ordinal(scoring_terms), size, after)]
+        return hits, self.count_matches(scoring_terms)
+
+    def top_k(self, query, k=10):
+        """
+        得分最高的 k 个文档，结果（文档、得分与顺序）与 compute_tfidf_scores(query)[:k] 相同
+        MaxScore 剪枝，逐词项累加部分得分：
+          词项 t 的得分上界 = 出现次数 * idf(t) * 各字段最大词频之和（最大词频建索引时写入，见 index_format.py）；
+          词项按上界从大到小处理（稀有词在前），剩余词项的上界之和低于当前第 k 高的部分得分时，
+          尚未出现的文档不可能进入前 k，之后的词项（通常是 postings 很长的常见词）只更新已有的候选，
+          并丢弃 部分得分 + 剩余上界 仍低于第 k 高得分的候选。
+        有静态先验时，文档第一次出现就把它的先验计入部分得分，尚未出现的文档的上界再加上 prior_weight * 先验最大值。
+        最后按查询词的顺序重新计算候选的得分，使浮点结果与完整计算完全一致。
+        :param query: 查询字符串
+        :param k: 返回的文档数
+        :return: [(doc_id, score)]，按得分从高到低排列，得分相同时按文档序号排列
+        """
+        return self._top_k(self.scoring_terms(query), k)
+
+    def _top_k(self, scoring_terms, k):
+        if k <= 0 or not scoring_terms:
+            return []
+
+        idfs = {}  # {词项: (idf, [PostingsList])}
+        bounds = []  # [(得分上界, 权重, [PostingsList])]
+        for term, count in Counter(scoring_terms).items():
+            parts = self._field_postings(term)
+            postings_lists = [postings for postings, _ in parts]
+            if len(postings_lists) == 1:
+                df = len(postings_lists[0])
+            else:  # 与合并后的 postings 长度相同：任一字段包含该词项的文档数
+                df = len(set().union(*(postings.doc_ords for postings in postings_lists)))
+            idf = self.idf_from_df(df)
+            if idf <= 0:  # 上界不再成立（文档数统计与 postings 不一致），退回完整计算
+                doc_ids = postings_lists[0].doc_table.doc_ids
+                return [(doc_ids[doc_ord], score)
+                        for doc_ord, score in select_page(self.scores_by_ordinal(scoring_terms), k)]
+            idfs[term] = (idf, postings_lists)
+            bounds.append((count * idf * sum(m for _, m in parts), count * idf, postings_lists))
+        bounds.sort(key=lambda x: x[0], reverse=True)
+        # remaining[i]：第 i 个及之后词项的上界之和
+        remaining = list(accumulate(bound for bound, _, _ in reversed(bounds)))[::-1] + [0.0]
+
+        prior, prior_weight = self.prior, self.prior_weight
+        if prior is not None:
+            prior = prior.aligned(bounds[0][2][0].doc_table)
+        prior_bound = prior_weight * prior.max if prior is not None else 0.0
+        scores = {}  # {文档序号: 部分得分（含先验）}
+        pruning = False
+        for i, (_, weight, postings_lists) in enumerate(bounds):
+            for postings in postings_lists:
+                if not pruning:
+                    for doc_ord, tf in zip(postings.doc_ords, postings.tfs()):
+                        score = scores.get(doc_ord)
+                        if score is None:
+                            score = prior_weight * prior[doc_ord] if prior is not None else 0.0
+                        scores[doc_ord] = score + weight * tf
+                elif len(scores) * _GALLOP_RATIO < len(postings):
+                    doc_ords = postings.doc_ords
+                    j = 0
+                    for doc_ord in sorted(scores):
+                        j = gallop(doc_ords, doc_ord, j)
+                        if j == len(doc_ords):
+                            break
+                        if doc_ords[j] == doc_ord:
+                            scores[doc_ord] += weight * postings.tf_at(j)
+                else:
+                    for doc_ord, tf in zip(postings.doc_ords, postings.tfs()):
+                        if doc_ord in scores:
+                            scores[doc_ord] += weight * tf
+            # 部分得分不超过已处理词项的上界之和，它仍不高于剩余上界时不可能剪枝，省去求第 k 高得分
+            if len(scores) < k or (not pruning and remaining[0] - remaining[i + 1] <= remaining[i + 1]):
+                continue
+            threshold = heapq.nlargest(k, scores.values())[-1] * (1.0 - TOP_K_TOLERANCE)
+            rest = remaining[i + 1] * (1.0 + TOP_K_TOLERANCE)
+            if rest + prior_bound * (1.0 + TOP_K_TOLERANCE) < threshold:
+                pruning = True
+            if pruning:
+                scores = {doc_ord: score for doc_ord, score in scores.items() if score + rest >= threshold}
+
+        def exact_score(doc_ord):
+            score = 0.0
+            for term in scoring_terms:
+                idf, postings_lists = idfs[term]
+                tf = 0
+                for postings in postings_lists:
+                    j = postings.find(doc_ord)
+                    if j >= 0:
+                        tf += postings.tf_at(j)
+                if tf:
+                    score += tf * idf
+            if prior is not None:
+                score += prior_weight * prior[doc_ord]
+            return score
+
+        best = heapq.nsmallest(k, ((-exact_score(doc_ord), doc_ord) for doc_ord in scores))
+        doc_ids = bounds[0][2][0].doc_table.doc_ids
+        return [(doc_ids[doc_ord], -score) for score, doc_ord in best]
+
+    def compute_idf(self, term, postings=None):
+        if postings is None:
+            postings = self.index.get(term, {})
+        return self.idf_from_df(len(postings))  # 获取词项的文档频率
+
+    def idf_from_df(self, df):
         return math.log(self.N / (df + 1)) + 1  # 防止分母为零
 
     def save_retrieval_results(self):
@@ -58,3 +322,125 @@ class TFIDFRetrieval:
             for line in file:
                 doc_id, score = line.strip().split(': ')
                 self.tfidf_scores[doc_id] = float(score)
+
+
+class BM25FRetrieval:
+    """
+    BM25F 排序模型
+    每个文档先按字段加权、按字段长度归一化合并词频：
+        tf~ = sum_f  w_f * tf_f / (1 - b_f + b_f * len_f / avglen_f)
+    再做一次 BM25 饱和：score = sum_t  idf(t) * tf~ / (k1 + tf~)，
+    idf(t) = ln(1 + (N - df + 0.5) / (df + 0.5))，df 为任一字段包含 t 的文档数。
+    字段长度来自 CollectionStats（建索引时预先计算），打分只读取查询词的 postings。
+    """
+
+    def __init__(self, index, preprocessor, stats=None, field_weights=None, field_b=None, k1=DEFAULT_K1,
+                 fuzzy=None, fuzzy_budget=0.05, prior=None, prior_weight=DEFAULT_PRIOR_WEIGHT, source=None):
+        """
+        :param index: 多字段索引 {field: {term: PostingsList}}
+        :param preprocessor: 文本预处理器
+        :param stats: 集合统计（CollectionStats），提供 N、字段长度与平均字段长度
+        :param field_weights: {field: 权重}，不在其中的字段不参与打分，默认 DEFAULT_FIELD_WEIGHTS
+        :param field_b: {field: b}，默认 DEFAULT_FIELD_B
+        :param k1: 词频饱和参数
+        :param fuzzy: 模糊查找函数，查询词不在任何字段中时用相近的词项代替
+        :param fuzzy_budget: 一次查询中模糊查找可用的时间（秒）
+        :param prior: 静态先验（StaticPrior），查询时与当前统计的文档表对齐，None 表示只按相关度排序
+        :param prior_weight: 先验的混合权重，得分 = BM25F + prior_weight * 先验
+        :param source: 提供 stats 属性的索引对象（如 SegmentedIndex），给定时每次查询读取它当前的统计，代替 stats
+        """
+        if stats is None and source is None:
+            raise ValueError("BM25FRetrieval needs stats or a source index")
+        self.index = index
+        self.preprocessor = preprocessor
+        self.source = source
+        self._stats = stats
+        self.field_weights = dict(field_weights if field_weights is not None else DEFAULT_FIELD_WEIGHTS)
+        self.field_b = dict(DEFAULT_FIELD_B, **(field_b or {}))
+        self.k1 = k1
+        self.fuzzy = fuzzy
+        self.fuzzy_budget = fuzzy_budget
+        self.prior = prior
+        self.prior_weight = prior_weight
+
+    @property
+    def stats(self):
+        """当前的集合统计：分段索引写入或合并后，文档序号、字段长度与 N 都随之变化"""
+        return self.source.stats if self.source is not None else self._stats
+
+    def normalize_query(self, query):
+        """预处理后的查询词（排序），用作结果缓存的键"""
+        return ' '.join(sorted(self.preprocessor.process_text(query)))
+
+    def _contains(self, term):
+        return any(term in self.index[field] for field in self.field_weights if field in self.index)
+
+    def _field_params(self, stats):
+        """
+        [(field, 字段索引, 权重, 1 - b, b / avglen, 字段长度数组)]
+        :param stats: 本次查询读取的集合统计，字段长度按其文档表的序号排列
+        """
+        params = []
+        for field, weight in self.field_weights.items():
+            if field not in self.index or weight <= 0:
+                continue
+            b = self.field_b.get(field, 0.75)
+            avg_length = stats.avg_field_length(field) or 1.0
+            params.append((field, self.index[field], weight, 1.0 - b, b / avg_length,
+                           stats.field_lengths.get(field, ())))
+        return params
+
+    def compute_bm25f_scores(self, query):
+        """
+        :param query: 查询字符串
+        :return: [(doc_id, score)]，按得分从高到低排列，得分相同时按文档序号排列
+        """
+        stats = self.stats
+        doc_ids = stats.doc_table.doc_ids
+        scores = self._scores(query, stats)
+        return [(doc_ids[doc_ord], score) for doc_ord, score in sorted(scores.items(), key=lambda x: (-x[1], x[0]))]
+
+    def page(self, query, size, after=None):
+        """
+        排序结果中的一页，用大小为 size 的堆选出游标之后的结果
+        :param after: 上一页最后一个结果的 (得分, 文档ID)，None 表示从第一个结果开始
+        :return: ([(doc_id, score)], 完整结果的文档总数)
+        """
+        stats = self.stats
+        doc_table = stats.doc_table
+        scores = self._scores(query, stats)
+        hits = select_page(scores, size, resolve_after(after, doc_table))
+        return [(doc_table.doc_ids[doc_ord], score) for doc_ord, score in hits], len(scores)
+
+    def scores_by_ordinal(self, query):
+        """:return: {文档序号: 得分}，序号对应当前统计（self.stats）的文档表"""
+        return self._scores(query, self.stats)
+
+    def _scores(self, query, stats):
+        # 一次查询只读取一次统计，N、字段长度与返回的文档序号来自同一个快照
+        num_docs = stats.num_docs
+        field_params = self._field_params(stats)
+        deadline = time.perf_counter() + self.fuzzy_budget
+        scores = defaultdict(float)  # {文档序号: 得分}
+        pseudo_tf = defaultdict(float)  # 当前词项的 {文档序号: 跨字段合并后的词频}，每个词项复用
+        for term in self.preprocessor.process_text(query):
+            for matched_term in matched_terms(term, self._contains, self.fuzzy, deadline):
+                pseudo_tf.clear()
+                for _, field_index, weight, one_minus_b, b_per_length, lengths in field_params:
+                    if matched_term not in field_index:
+                        continue
+                    postings = field_index[matched_term]
+                    offsets = postings.offsets
+                    for i, doc_ord in enumerate(postings.doc_ords):
+                        length = lengths[doc_ord] if doc_ord < len(lengths) else 0
+                        pseudo_tf[doc_ord] += weight * (offsets[i + 1] - offsets[i]) / (one_minus_b + b_per_length * length)
+                df = len(pseudo_tf)
+                idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+                k1 = self.k1
+                for doc_ord, tf in pseudo_tf.items():
+                    scores[doc_ord] += idf * tf / (k1 + tf)
+        if self.prior is not None:
+            prior = self.prior.aligned(stats.doc_table)
+            for doc_ord in scores:
+                scores[doc_ord] += self.prior_weight * prior[doc_ord]
+        return scores
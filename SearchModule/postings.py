@@ -0,0 +1,267 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from itertools import accumulate, chain
+from operator import sub
+import heapq
+
+# 紧凑的内存中 postings 表示
+#
+# 文档ID（如 "tt32485530"）在 DocTable 中映射为稠密的整数序号；每个词项的 postings 由三个 array 组成：
+#   doc_ords   按序号递增的文档序号            array('I')，长度 df
+#   offsets    每个文档的位置在 positions 中的起止  array('I')，长度 df + 1
+#   positions  所有文档的位置首尾相接            array('I')
+# PostingsList 同时实现了 {doc_id: [positions]} 的只读映射接口，QueryProcessor 与 TFIDFRetrieval 无需修改即可使用。
+
+
+class DocTable:
+    """文档ID与稠密整数序号之间的双向映射"""
+
+    def __init__(self, doc_ids=None):
+        self.doc_ids = list(doc_ids) if doc_ids is not None else []
+        self._ordinals = None  # {doc_id: 序号}，首次需要时才构建
+
+    @property
+    def ordinals(self):
+        if self._ordinals is None:
+            self._ordinals = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        return self._ordinals
+
+    def add(self, doc_id):
+        """返回文档ID的序号，不存在时分配新的序号"""
+        ordinals = self.ordinals
+        doc_ord = ordinals.get(doc_id)
+        if doc_ord is None:
+            doc_ord = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            ordinals[doc_id] = doc_ord
+        return doc_ord
+
+    def get(self, doc_id, default=-1):
+        """返回文档ID的序号，不存在时返回 default"""
+        return self.ordinals.get(doc_id, default)
+
+    def __getitem__(self, doc_ord):
+        return self.doc_ids[doc_ord]
+
+    def __contains__(self, doc_id):
+        return doc_id in self.ordinals
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+
+class PostingsList(Mapping):
+    """单个词项的 postings，以 array 存储，对外表现为 {doc_id: [positions]}"""
+
+    __slots__ = ('doc_table', 'doc_ords', 'offsets', 'positions', '_sorted')
+
+    def __init__(self, doc_table, doc_ords=None, offsets=None, positions=None):
+        self.doc_table = doc_table
+        self.doc_ords = doc_ords if doc_ords is not None else array('I')
+        self.offsets = offsets if offsets is not None else array('I', [0])
+        self.positions = positions if positions is not None else array('I')
+        self._sorted = True
+
+    @classmethod
+    def from_lists(cls, doc_table, doc_ords, positions_lists):
+        """
+        由按序号递增的文档序号与对应的位置列表构建
+        :param doc_ords: 文档序号序列
+        :param positions_lists: 与 doc_ords 一一对应的位置列表
+        """
+        return cls(
+            doc_table,
+            array('I', doc_ords),
+            array('I', accumulate(map(len, positions_lists), initial=0)),
+            array('I', chain.from_iterable(positions_lists)),
+        )
+
+    def add(self, doc_ord, positions):
+        """
+        追加一个文档的位置；序号通常递增，否则在 finish() 时排序
+        :param doc_ord: 文档序号
+        :param positions: 位置列表
+        """
+        if self.doc_ords and doc_ord <= self.doc_ords[-1]:
+            self._sorted = False
+        self.doc_ords.append(doc_ord)
+        self.positions.extend(positions)
+        self.offsets.append(len(self.positions))
+
+    def finish(self):
+        """按文档序号排序，同一文档出现多次时合并其位置列表（与原先 extend 的行为一致）"""
+        if self._sorted:
+            return
+        doc_ords, offsets, positions = self.doc_ords, self.offsets, self.positions
+        if len(set(doc_ords)) == len(doc_ords):  # 常见情况：没有重复文档，只需重排
+            order = sorted(range(len(doc_ords)), key=doc_ords.__getitem__)
+            doc_ords = [doc_ords[i] for i in order]
+            positions_lists = [positions[offsets[i]:offsets[i + 1]] for i in order]
+        else:
+            merged = {}
+            for i, doc_ord in enumerate(doc_ords):
+                merged.setdefault(doc_ord, []).extend(positions[offsets[i]:offsets[i + 1]])
+            doc_ords = sorted(merged)
+            positions_lists = [merged[doc_ord] for doc_ord in doc_ords]
+        rebuilt = PostingsList.from_lists(self.doc_table, doc_ords, positions_lists)
+        self.doc_ords, self.offsets, self.positions = rebuilt.doc_ords, rebuilt.offsets, rebuilt.positions
+        self._sorted = True
+
+    def find(self, doc_ord):
+        """二分查找文档序号，返回其下标，不存在时返回 -1"""
+        i = bisect_left(self.doc_ords, doc_ord)
+        if i < len(self.doc_ords) and self.doc_ords[i] == doc_ord:
+            return i
+        return -1
+
+    def positions_at(self, i):
+        """第 i 个文档的位置列表"""
+        return self.positions[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def tf_at(self, i):
+        """第 i 个文档中的词频"""
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def tfs(self):
+        """按文档序号顺序的词频"""
+        offsets = self.offsets
+        return map(sub, offsets[1:], offsets[:-1])
+
+    def max_tf(self):
+        """所有文档中的最大词频"""
+        return max(self.tfs(), default=0)
+
+    def __getitem__(self, doc_id):
+        doc_ord = self.doc_table.get(doc_id)
+        i = self.find(doc_ord) if doc_ord >= 0 else -1
+        if i < 0:
+            raise KeyError(doc_id)
+        return self.positions_at(i)
+
+    def __contains__(self, doc_id):
+        doc_ord = self.doc_table.get(doc_id)
+        return doc_ord >= 0 and self.find(doc_ord) >= 0
+
+    def __iter__(self):
+        return map(self.doc_table.doc_ids.__getitem__, self.doc_ords)
+
+    def __len__(self):
+        return len(self.doc_ords)
+
+    def items(self):
+        """按文档序号顺序生成 (doc_id, [positions])，不经过逐个文档的查找"""
+        return zip(self, map(self.positions_at, range(len(self.doc_ords))))
+
+    def __repr__(self):
+        return f'PostingsList({dict(self.items())!r})'
+
+
+def gallop(doc_ords, target, lo=0):
+    """
+    在有序序列中从 lo 开始查找第一个 >= target 的下标
+    先以 1, 2, 4, ... 的步长向前跳跃，越过 target 后再在最后一段内二分，
+    代价为 O(log(跳过的元素数))，连续查找递增的目标时比每次整体二分更省
+    """
+    n = len(doc_ords)
+    if lo >= n or doc_ords[lo] >= target:
+        return lo
+    step = 1
+    hi = lo + 1
+    while hi < n and doc_ords[hi] < target:
+        lo = hi
+        step <<= 1
+        hi = lo + step
+    return bisect_left(doc_ords, target, lo + 1, min(hi, n))
+
+
+def intersect_sorted(shorter, longer):
+    """
+    求两个有序文档序号序列的交集，遍历较短的序列并在较长的序列中 galloping 查找
+    代价约为 O(len(shorter) * log(len(longer) / len(shorter)))，与较长序列的长度基本无关
+    :return: 有序的文档序号列表
+    """
+    if len(shorter) > len(longer):
+        shorter, longer = longer, shorter
+    result = []
+    lo = 0
+    n = len(longer)
+    for doc_ord in shorter:
+        lo = gallop(longer, doc_ord, lo)
+        if lo == n:
+            break
+        if longer[lo] == doc_ord:
+            result.append(doc_ord)
+            lo += 1
+    return result
+
+
+def intersect_many(ordinal_lists):
+    """从最短的序列开始依次求交集，结果为空时提前结束"""
+    ordinal_lists = sorted(ordinal_lists, key=len)
+    if not ordinal_lists:
+        return []
+    result = ordinal_lists[0]
+    for doc_ords in ordinal_lists[1:]:
+        if not result:
+            break
+        result = intersect_sorted(result, doc_ords)
+    return list(result)
+
+
+def _ordinal_stream(doc_ords, k):
+    """生成 (doc_ord, 来源下标, 文档下标)，供 heapq.merge 归并"""
+    for i, doc_ord in enumerate(doc_ords):
+        yield doc_ord, k, i
+
+
+def merge_postings(postings_lists, doc_table):
+    """
+    按文档序号合并同一文档表下的多个 postings（如同一词项在不同字段中的 postings）
+    同一文档的位置列表按参数顺序拼接
+    :param postings_lists: PostingsList 列表
+    :param doc_table: 合并结果使用的文档表
+    :return: PostingsList
+    """
+    if len(postings_lists) == 1:
+        return postings_lists[0]
+    merged = PostingsList(doc_table)
+    streams = [_ordinal_stream(postings.doc_ords, k) for k, postings in enumerate(postings_lists)]
+    doc_ords = merged.doc_ords
+    positions = merged.positions
+    offsets = merged.offsets
+    for doc_ord, k, i in heapq.merge(*streams):
+        source = postings_lists[k]
+        if not doc_ords or doc_ords[-1] != doc_ord:
+            doc_ords.append(doc_ord)
+            offsets.append(len(positions))
+        positions.extend(source.positions[source.offsets[i]:source.offsets[i + 1]])
+        offsets[-1] = len(positions)
+    return merged
+
+
+def concat_postings(parts, doc_table):
+    """
+    依次拼接多个段中同一词项的 postings，各段的文档序号加上该段在合并文档表中的起始序号
+    :param parts: [(PostingsList, 起始序号, 该段中已删除的文档序号集合)]，按起始序号递增
+    :param doc_table: 合并后的文档表
+    :return: PostingsList
+    """
+    merged = PostingsList(doc_table)
+    doc_ords = merged.doc_ords
+    positions = merged.positions
+    offsets = merged.offsets
+    for postings, base, deleted in parts:
+        if not deleted:
+            shift = len(positions)
+            doc_ords.extend(doc_ord + base for doc_ord in postings.doc_ords)
+            positions.extend(postings.positions)
+            offsets.extend(offset + shift for offset in postings.offsets[1:])
+            continue
+        for i, doc_ord in enumerate(postings.doc_ords):
+            if doc_ord in deleted:
+                continue
+            doc_ords.append(doc_ord + base)
+            positions.extend(postings.positions[postings.offsets[i]:postings.offsets[i + 1]])
+            offsets.append(len(positions))
+    return merged
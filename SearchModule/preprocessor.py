@@ -1,26 +1,153 @@
 import re
 import json
+import mmap
+import os
 from nltk.stem import PorterStemmer
 from nltk.corpus import stopwords
 from collections import defaultdict
 import nltk
 
+try:
+    from .index_format import IndexReader, is_binary_index
+except ImportError:
+    from index_format import IndexReader, is_binary_index
+
 # 确保下载nltk的停用词数据集
 # nltk.download('stopwords')
 
+_WHITESPACE_OR_COMMA = re.compile(r'[\s,]*')
+# 分词模式：连字符不属于 \w，原先先把 '-' 替换为空格再匹配 \b\w+\b，结果与直接匹配 \w+ 相同
+_WORD = re.compile(r'\w+')
+
+DEFAULT_STEM_CACHE_SIZE = 200000
+STEMS_SECTION = 'stems'  # 二进制索引中保存 词 -> 词干 映射的附加段
+
+
+class StemCache(dict):
+    """
+    有界的 词 -> 词干 缓存
+    不同词形的数量远小于总词数，绝大多数 stem 调用都是重复的。未命中时调用词干提取器，
+    缓存未满时记录结果；缓存满后不再插入（高频词早已被缓存），因此内存有上界。
+    """
+
+    def __init__(self, stemmer, maxsize=DEFAULT_STEM_CACHE_SIZE):
+        super().__init__()
+        self.stemmer = stemmer
+        self.maxsize = maxsize
+        self.lookups = 0
+        self.misses = 0
+
+    def __missing__(self, token):
+        self.misses += 1
+        stem = self.stemmer.stem(token)
+        if len(self) < self.maxsize:
+            self[token] = stem
+        return stem
+
+    def stem_tokens(self, tokens):
+        """对一组词做词干提取，命中时只需一次字典查找"""
+        self.lookups += len(tokens)
+        return list(map(self.__getitem__, tokens))
+
+    def info(self):
+        """命中统计：{'hits', 'misses', 'size', 'maxsize'}"""
+        return {
+            'hits': self.lookups - self.misses,
+            'misses': self.misses,
+            'size': len(self),
+            'maxsize': self.maxsize,
+        }
+
+    def to_bytes(self):
+        """序列化为 JSON，用于写入索引的附加段"""
+        return json.dumps(dict(self), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def preload(self, stems):
+        """
+        预先载入已知的 词 -> 词干 映射（如随索引保存的映射），不计入命中统计
+        :return: 载入的数量
+        """
+        room = max(self.maxsize - len(self), 0)
+        items = list(stems.items())[:room]
+        self.update(items)
+        return len(items)
+
+    def load_from_index(self, file_path):
+        """
+        从二进制索引的附加段载入建索引时用到的词干映射；文本索引、索引目录或没有该段时不做任何事
+        :return: 载入的数量
+        """
+        if not os.path.isfile(file_path) or not is_binary_index(file_path):
+            return 0
+        with open(file_path, 'rb') as file:
+            buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data = IndexReader(buf).section(STEMS_SECTION)
+            return self.preload(json.loads(bytes(data).decode('utf-8'))) if data is not None else 0
+        finally:
+            buf.close()
+
+
+_shared_stem_caches = {}
+
+
+def shared_stem_cache():
+    """同一进程内所有 TextPreprocessor 共享的词干缓存，建索引与查询使用同一份"""
+    if 'porter' not in _shared_stem_caches:
+        _shared_stem_caches['porter'] = StemCache(PorterStemmer())
+    return _shared_stem_caches['porter']
+
+
+def iter_json_array(json_file_path, chunk_size=1 << 20):
+    """
+    增量解析顶层为数组的JSON文件，逐个生成数组元素，内存占用与单个元素大小相当而非整个文件
+    :param json_file_path: JSON文件路径
+    :param chunk_size: 每次读取的字符数
+    :return: 生成数组中的每个元素
+    """
+    decoder = json.JSONDecoder()
+    with open(json_file_path, 'r', encoding='utf-8') as infile:
+        buffer = infile.read(chunk_size).lstrip('\ufeff')
+        pos = _WHITESPACE_OR_COMMA.match(buffer).end()
+        if pos >= len(buffer) or buffer[pos] != '[':
+            raise ValueError(f"{json_file_path} is not a JSON array.")
+        pos += 1
+        eof = False
+        while True:
+            pos = _WHITESPACE_OR_COMMA.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = None
+            # 元素之后必然还有 ',' 或 ']'；解析失败或恰好停在缓冲区末尾时说明元素可能被截断，需继续读取
+            if end is None or end >= len(buffer):
+                if eof:
+                    raise ValueError(f"Unexpected end of JSON array in {json_file_path}.")
+                chunk = infile.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield element
+            pos = end
+
+
 class TextPreprocessor:
-    def __init__(self, remove_stop_words=True, apply_stemming=True):
+    def __init__(self, remove_stop_words=True, apply_stemming=True, stem_cache=None):
         """
         初始化文本预处理器
         :param remove_stop_words: 是否移除停用词
         :param apply_stemming: 是否应用词干提取
+        :param stem_cache: 词干缓存（StemCache），默认使用进程内共享的缓存
         """
         self.remove_stop_words = remove_stop_words  # true or false
         self.apply_stemming = apply_stemming  # true or false
         # 使用nltk的停用词
         self.stop_words = set(stopwords.words('english')) if remove_stop_words else set()
-        # 创建词干提取器
-        self.stemmer = PorterStemmer() if apply_stemming else None
+        # 词干提取统一经过词干缓存（其中持有词干提取器）
+        self.stem_cache = (stem_cache if stem_cache is not None else shared_stem_cache()) if apply_stemming else None
 
     def process_text(self, text):
         """
@@ -30,15 +157,81 @@ class TextPreprocessor:
         """
         if text is None:
             return "未读取到文本"  # 或者其他默认值
-        
-        text = re.sub(r'-', ' ', text)  # 替换连字符为空格
-        tokens = re.findall(r'\b\w+\b', text.lower())  # 提取单词
-        if self.remove_stop_words:
-            tokens = [token for token in tokens if token not in self.stop_words]  # 去停用词
+
+        # 一次扫描完成分词、去停用词与词干提取，不生成中间列表
+        words = _WORD.findall(text.lower())
+        stop_words = self.stop_words
         if self.apply_stemming:
-            tokens = [self.stemmer.stem(token) for token in tokens]  # 词干提取
+            stem = self.stem_cache.__getitem__
+            tokens = [stem(word) for word in words if word not in stop_words]
+            self.stem_cache.lookups += len(tokens)
+            return tokens
+        if stop_words:
+            return [word for word in words if word not in stop_words]
+        return words
+
+    def tokenize_with_offsets(self, text):
+        """
+        与 process_text 相同的词序列，同时给出每个词在文本中的字符偏移，用于高亮
+        第 i 个元素对应索引中的位置 i
+        偏移基于 text.lower()，只有在小写化改变字符串长度的少数 Unicode 字符下才与原文不同
+        :param text: 输入文本
+        :return: [(term, start, end)]
+        """
+        if text is None:
+            return []
+        stop_words = self.stop_words
+        stem = self.stem_cache.__getitem__ if self.apply_stemming else None
+        tokens = []
+        for match in _WORD.finditer(text.lower()):
+            word = match.group()
+            if word in stop_words:
+                continue
+            tokens.append((stem(word) if stem else word, match.start(), match.end()))
+        if stem:
+            self.stem_cache.lookups += len(tokens)
         return tokens
 
+    def process_document(self, document):
+        """
+        处理单个电影文档，提取并预处理各个字段
+        :param document: 原始文档（JSON对象）
+        :return: (doc_id, {field: [tokens]})
+        """
+        doc_id = document['id']  # 获取文档ID
+        fields = {
+            'title': self.process_text(document['title']),  # 处理标题
+            'director': self.process_text(document['director']),  # 处理导演
+            'cast': self.process_text(', '.join(document['cast_character'].keys())),  # 处理演员
+            'plot': self.process_text(document['plot']),  # 处理剧情
+        }
+        return doc_id, fields
+
+    def iter_documents(self, file_path):
+        """
+        流式读取文件中的原始文档，不把整个文件读入内存
+        :param file_path: JSON（顶层为数组）或 JSONL 文件路径
+        :return: 逐个生成原始文档（JSON对象）
+        """
+        if file_path.endswith('.jsonl'):
+            with open(file_path, 'r', encoding='utf-8') as infile:
+                for line in infile:
+                    if line.strip():
+                        yield json.loads(line)  # 解析JSON行
+        elif file_path.endswith('.json'):
+            yield from iter_json_array(file_path)
+        else:
+            raise ValueError("Unsupported file type. Use 'json' or 'jsonl'.")
+
+    def iter_processed(self, file_path):
+        """
+        流式预处理文件中的文档，可直接传给 PositionalInvertedIndex.build_index
+        :param file_path: JSON 或 JSONL 文件路径
+        :return: 逐个生成 (doc_id, {field: [tokens]})
+        """
+        for document in self.iter_documents(file_path):
+            yield self.process_document(document)
+
     def process_file(self, file_path):
         """
         处理文件，根据文件类型调用相应的处理方法
@@ -58,19 +251,7 @@ class TextPreprocessor:
         :param jsonl_file_path: JSONL文件路径
         :return: 预处理后的文档字典，格式为 {doc_id: {field: [tokens]}}
         """
-        documents = {}
-        with open(jsonl_file_path, 'r', encoding='utf-8') as infile:
-            for line in infile:
-                document = json.loads(line.strip())  # 解析JSON行
-                doc_id = document['id']  # 获取文档ID
-                fields = {
-                    'title': self.process_text(document['title']),  # 处理标题
-                    'director': self.process_text(document['director']),  # 处理导演
-                    'cast': self.process_text(', '.join(document['cast_character'].keys())),  # 处理演员
-                    'plot': self.process_text(document['plot']),  # 处理剧情
-                }
-                documents[doc_id] = fields  # 将处理后的字段存入文档字典
-        return documents 
+        return dict(self.iter_processed(jsonl_file_path))
 
     def process_json_file(self, json_file_path):
         """
@@ -78,16 +259,4 @@ class TextPreprocessor:
         :param json_file_path: JSON文件路径
         :return: 预处理后的文档字典，格式为 {doc_id: {field: [tokens]}}
         """
-        documents = {}
-        with open(json_file_path, 'r', encoding='utf-8') as infile:
-            data = json.load(infile)  # 解析整个JSON文件
-            for document in data:
-                doc_id = document['id']  # 获取文档ID
-                fields = {
-                    'title': self.process_text(document['title']),  # 处理标题
-                    'director': self.process_text(document['director']),  # 处理导演
-                    'cast': self.process_text(', '.join(document['cast_character'].keys())),  # 处理演员
-                    'plot': self.process_text(document['plot']),  # 处理剧情
-                }
-                documents[doc_id] = fields  # 将处理后的字段存入文档字典
-        return documents 
\ No newline at end of file
+        return dict(self.iter_processed(json_file_path))
@@ -0,0 +1,289 @@
+import re
+
+# 布尔查询解析
+#
+# 语法（优先级 NOT > AND > OR，括号可改变优先级）：
+#   query    := or_expr
+#   or_expr  := and_expr ('OR' and_expr)*
+#   and_expr := not_expr (['AND'] not_expr)*       相邻的子查询之间默认为 AND
+#   not_expr := 'NOT' not_expr | primary
+#   primary  := '(' query ')' | field ':' primary | "phrase" | proximity | words
+#   words    := (word | wildcard | fuzzy)+             wildcard 为含 '*' 的词，如 termin*、*punk
+#                                                   fuzzy 为以 '~' 或 '~N' 结尾的词（编辑距离不超过 N，默认按词长决定）
+#   proximity := '#' N '(' term ',' term ')'       两个词相距不超过 N 个位置（不限先后）
+#              | '#od' N '(' term ',' term ')'     有序窗口：第一个词在前，且相距不超过 N
+#
+# 连续的若干个普通词组成一个 TermQuery，与原先的行为一致：匹配包含其中任意一个词的文档；
+# 其中含 '*' 的词与以 '~' 结尾的词各自成为一个 WildcardQuery / FuzzyQuery，与 TermQuery 之间为 OR。
+# 字段限定作用于紧随其后的词、短语、邻近查询或括号内的整个子查询；
+# 没有字段限定的词默认检索 title，短语与邻近查询检索所有字段。
+# 运算符区分大小写；括号不匹配时尽量宽松地处理，不抛出异常。
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<lparen>\()
+      | (?P<rparen>\))
+      | (?P<field>[A-Za-z_]+):\s*
+      | "(?P<phrase>[^"]*)"?
+      | (?P<proximity>\#(?:od)?\d+\([^()]*\))
+      | (?P<word>[^\s()"]+)
+    )''', re.VERBOSE)
+
+_FUZZY = re.compile(r'(.+?)~([0-9])?')
+_PROXIMITY = re.compile(r'#(od)?(\d+)\(\s*([^,()]+?)\s*,\s*([^,()]+?)\s*\)')
+
+# 用于判断查询是否需要走布尔查询处理
+_BOOLEAN_HINT = re.compile(r'(?:^|\s)(?:AND|OR|NOT)\s|[()"]|\b(?:title|director|plot|cast):|#(?:od)?\d+\(|\w\*|\*\w|\w~')
+
+
+class TermQuery:
+    """一组普通词，匹配在 field 中包含其中任意一个词的文档"""
+
+    def __init__(self, field, text):
+        self.field = field
+        self.text = text
+        self.terms = None  # 预处理后的词项，由 QueryProcessor 规划时填入
+
+    def __repr__(self):
+        return f'TermQuery({self.field!r}, {self.text!r})'
+
+
+class WildcardQuery:
+    """前缀或通配符查询（如 termin*、*punk），匹配在 field 中包含任意一个展开词项的文档"""
+
+    def __init__(self, field, pattern):
+        self.field = field
+        self.pattern = pattern
+        self.terms = None  # 展开后的词项，由 QueryProcessor 规划时填入
+
+    def __repr__(self):
+        return f'WildcardQuery({self.field!r}, {self.pattern!r})'
+
+
+class FuzzyQuery:
+    """模糊查询：匹配在 field 中包含与 text 的编辑距离不超过 distance 的词项的文档，distance 为 None 时按词长决定"""
+
+    def __init__(self, field, text, distance=None):
+        self.field = field
+        self.text = text
+        self.distance = distance
+        self.terms = None  # 展开后的词项，由 QueryProcessor 规划时填入
+
+    def __repr__(self):
+        distance = self.distance if self.distance is not None else ''
+        return f'FuzzyQuery({self.field!r}, {self.text!r}~{distance})'
+
+
+class PhraseQuery:
+    """短语查询，field 为 None 时检索所有字段"""
+
+    def __init__(self, field, text):
+        self.field = field
+        self.text = text
+        self.terms = None
+
+    def __repr__(self):
+        return f'PhraseQuery({self.field!r}, {self.text!r})'
+
+
+class ProximityQuery:
+    """邻近查询：两个词相距不超过 distance 个位置；ordered 时第一个词必须在前。field 为 None 时检索所有字段"""
+
+    def __init__(self, field, text1, text2, distance, ordered=False):
+        self.field = field
+        self.text1 = text1
+        self.text2 = text2
+        self.distance = distance
+        self.ordered = ordered
+        self.terms = None
+
+    def __repr__(self):
+        operator = f"#{'od' if self.ordered else ''}{self.distance}"
+        return f'ProximityQuery({self.field!r}, {operator}({self.text1!r}, {self.text2!r}))'
+
+
+class AndQuery:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f'AndQuery({self.children!r})'
+
+
+class OrQuery:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f'OrQuery({self.children!r})'
+
+
+class NotQuery:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f'NotQuery({self.child!r})'
+
+
+def tokenize_query(query_str, fields):
+    """
+    将查询字符串切分为 (类型, 值)：lparen / rparen / field / phrase / word / op
+    不在 fields 中的 "xxx:" 视为普通词
+    """
+    tokens = []
+    pos = 0
+    query_str = query_str.strip()
+    while pos < len(query_str):
+        match = _TOKEN.match(query_str, pos)
+        if match is None or match.end() == pos:
+            break
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'field' and value.lower() not in fields:
+            kind, value = 'word', value + ':'
+        elif kind == 'field':
+            value = value.lower()
+        elif kind == 'word' and value in OPERATORS:
+            kind = 'op'
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens, default_field):
+        self.tokens = tokens
+        self.pos = 0
+        self.default_field = default_field
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse_or(self, field):
+        children = [self.parse_and(field)]
+        while self.peek() == ('op', 'OR'):
+            self.next()
+            children.append(self.parse_and(field))
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else OrQuery(children)
+
+    def parse_and(self, field):
+        children = [self.parse_not(field)]
+        while True:
+            kind, value = self.peek()
+            if kind is None or kind == 'rparen' or (kind, value) == ('op', 'OR'):
+                break
+            if (kind, value) == ('op', 'AND'):
+                self.next()
+            children.append(self.parse_not(field))
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else AndQuery(children)
+
+    def parse_not(self, field):
+        if self.peek() == ('op', 'NOT'):
+            self.next()
+            child = self.parse_not(field)
+            return NotQuery(child) if child is not None else None
+        return self.parse_primary(field)
+
+    def parse_primary(self, field):
+        kind, value = self.next()
+        if kind == 'lparen':
+            node = self.parse_or(field)
+            if self.peek()[0] == 'rparen':
+                self.next()
+            return node
+        if kind == 'field':
+            if self.peek()[0] in (None, 'rparen', 'op'):
+                return None  # "title:" 后没有内容
+            return self.parse_primary(value)
+        if kind == 'phrase':
+            return PhraseQuery(field, value) if value.strip() else None
+        if kind == 'proximity':
+            match = _PROXIMITY.fullmatch(value)
+            if match is None:  # 不是两个词的形式，按普通词处理
+                return TermQuery(field or self.default_field, value)
+            ordered, distance, text1, text2 = match.groups()
+            return ProximityQuery(field, text1, text2, int(distance), ordered=bool(ordered))
+        if kind == 'word':
+            words = [value]
+            while self.peek()[0] == 'word':
+                words.append(self.next()[1])
+            field = field or self.default_field
+            plain, children = [], []
+            for word in words:
+                fuzzy = _FUZZY.fullmatch(word)
+                if '*' in word:
+                    children.append(WildcardQuery(field, word))
+                elif fuzzy is not None:
+                    distance = fuzzy.group(2)
+                    children.append(FuzzyQuery(field, fuzzy.group(1), int(distance) if distance else None))
+                else:
+                    plain.append(word)
+            if plain:
+                children.insert(0, TermQuery(field, ' '.join(plain)))
+            return children[0] if len(children) == 1 else OrQuery(children)
+        # 多余的右括号或运算符：跳过
+        return None
+
+
+def parse_boolean_query(query_str, fields=('title', 'plot', 'cast', 'director'), default_field='title'):
+    """
+    解析布尔查询为语法树
+    :param query_str: 查询字符串，如 'title:(alien OR predator) AND NOT plot:"space station" AND plot:#5(heist,bank)'
+    :param fields: 支持的字段
+    :param default_field: 未限定字段的普通词检索的字段
+    :return: TermQuery / WildcardQuery / FuzzyQuery / PhraseQuery / ProximityQuery / AndQuery / OrQuery / NotQuery，空查询返回 None
+    """
+    parser = _Parser(tokenize_query(query_str, fields), default_field)
+    children = []
+    while parser.pos < len(parser.tokens):
+        node = parser.parse_or(None)
+        if node is not None:
+            children.append(node)
+        if parser.peek()[0] == 'rparen':
+            parser.next()  # 多余的右括号
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else AndQuery(children)
+
+
+def is_boolean_query(query_str):
+    """查询中是否含有字段限定、布尔运算符、括号、短语、邻近查询、通配符或模糊查询"""
+    return _BOOLEAN_HINT.search(query_str) is not None
+
+
+def normalized_query(node):
+    """
+    规划后（叶子节点已填入预处理后的词项）的语法树的规范形式，用作查询结果缓存的键
+    大小写、停用词、词形以及 AND / OR 子查询的顺序不同但结果相同的查询得到相同的键
+    """
+    if node is None:
+        return ''
+    if isinstance(node, TermQuery):
+        return f"{node.field}:({' '.join(sorted(set(node.terms)))})"
+    if isinstance(node, WildcardQuery):
+        return f"{node.field}:{node.pattern.lower()}"
+    if isinstance(node, FuzzyQuery):
+        return f"{node.field}:({' '.join(sorted(set(node.terms)))})"
+    if isinstance(node, PhraseQuery):
+        return f"{node.field or '*'}:\"{' '.join(node.terms)}\""
+    if isinstance(node, ProximityQuery):
+        operator = f"#{'od' if node.ordered else ''}{node.distance}"
+        return f"{node.field or '*'}:{operator}({','.join(node.terms)})"
+    if isinstance(node, NotQuery):
+        return f'NOT({normalized_query(node.child)})'
+    operator = 'AND' if isinstance(node, AndQuery) else 'OR'
+    return f"{operator}({' '.join(sorted(normalized_query(child) for child in node.children))})"
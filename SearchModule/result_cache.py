@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+
+# 查询结果缓存
+#
+# 前端翻页时会以同一个查询反复请求 /api/v2/search。缓存以 (查询类型, 规范化后的查询) 为键：
+#   布尔查询保存排好序的完整文档ID列表，后续分页直接切片；
+#   普通查询只保存排序结果的前缀 ([(doc_id, score)], 结果总数)（get_ranked_page）。第一次请求至少计算 prefetch 个结果，
+#   之后的页码或游标落在前缀内时直接切片；超出前缀时从前缀末尾继续计算并接到前缀后，前缀最多 depth 个结果。
+# 条目数超过 maxsize 时淘汰最久未使用的条目，存入超过 ttl 秒的条目视为过期；
+# 每次读写都带上索引的版本号，版本变化（载入了新索引、分段索引刷新）时清空整个缓存。
+
+DEFAULT_RESULT_CACHE_SIZE = 1024
+DEFAULT_RESULT_CACHE_TTL = 300  # 秒
+DEFAULT_RANKED_PREFETCH = 50  # 普通查询每次至少计算的结果数
+DEFAULT_RANKED_DEPTH = 1000  # 普通查询缓存的排序前缀最多包含的结果数
+
+
+class QueryResultCache:
+    """带容量与过期时间上限、按索引版本失效的 LRU 缓存，可在多个请求线程间共享"""
+
+    def __init__(self, maxsize=DEFAULT_RESULT_CACHE_SIZE, ttl=DEFAULT_RESULT_CACHE_TTL, clock=time.monotonic):
+        """
+        :param maxsize: 最多缓存的查询数
+        :param ttl: 条目的有效时间（秒），None 表示不过期
+        :param clock: 计时函数，便于测试
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None  # 当前条目对应的索引版本
+        self._entries = OrderedDict()  # {key: (过期时刻, value)}，按最近使用排序
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        """
+        :param key: 规范化后的查询
+        :param version: 索引版本
+        :return: 缓存的结果，未命中或已过期时返回 None
+        """
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        """存入结果；计算期间载入了新索引时（版本与最近一次查找不同），过时的结果不存入"""
+        with self._lock:
+            if self.version is None:
+                self.version = version
+            elif version != self.version:
+                return
+            expires = self.clock() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, version, compute):
+        """命中时返回缓存的结果，否则调用 compute() 计算并存入（计算时不持有锁）"""
+        value = self.get(key, version)
+        if value is None:
+            value = compute()
+            self.put(key, version, value)
+        return value
+
+    def get_ranked_page(self, key, version, page, size, after=None, start=0,
+                        prefetch=DEFAULT_RANKED_PREFETCH, depth=DEFAULT_RANKED_DEPTH):
+        """
+        普通查询的一页，尽量从缓存的排序前缀中切片
+        :param key: (模型, 规范化后的查询)
+        :param page: page(size, after) -> ([(doc_id, score)], 结果总数)，即排序模型的 page 方法
+        :param size: 返回的结果数
+        :param after: 上一页最后一个结果的 (得分, 文档ID)，None 表示从排序结果的第 start 个开始
+        :param start: after 为 None 时跳过的结果数（按页码访问）
+        :return: ([(doc_id, score)], 结果总数)
+        """
+        cached = self.get(key, version)
+        if cached is None:
+            if after is not None:  # 缓存过期后的游标：直接计算其后的一页
+                return page(size, after)
+            hits, total = page(max(start + size, prefetch), None)
+            self.put(key, version, (hits[:depth], total))
+            if start + size > depth:
+                return hits[start:start + size], total
+            cached = hits, total
+        prefix, total = cached
+        if after is not None:
+            after_score, after_id = float(after[0]), after[1]
+            position = next((i for i, (doc_id, score) in enumerate(prefix)
+                             if doc_id == after_id and score == after_score), None)
+            if position is None:  # 游标不在前缀内（例如来自更深的页）
+                return page(size, after)
+            start = position + 1
+        end = start + size
+        if end > len(prefix) and len(prefix) < total:
+            if end > depth:  # 超出缓存深度的页直接计算，不再延长前缀
+                if after is not None:
+                    return page(size, after)
+                hits, total = page(end, None)
+                return hits[start:], total
+            last = (prefix[-1][1], prefix[-1][0]) if prefix else None
+            more, total = page(max(end - len(prefix), prefetch), last)
+            prefix = prefix + more
+            self.put(key, version, (prefix[:depth], total))
+        return prefix[start:end], total
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """命中统计：{'hits', 'misses', 'hit_rate', 'expirations', 'evictions', 'invalidations', 'size', 'maxsize', 'ttl'}"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
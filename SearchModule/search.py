@@ -1,218 +1,438 @@
-import re
-from collections import defaultdict
+import time
 import unittest
 
+try:
+    from .docset import BITMAPS_AVAILABLE, DocBitmap
+    from .postings import gallop, intersect_sorted
+    from .query_parser import (AndQuery, FuzzyQuery, NotQuery, PhraseQuery, ProximityQuery, TermQuery,
+                               WildcardQuery, parse_boolean_query)
+    from .term_dictionary import MAX_EXPANSIONS, TermDictionary, auto_distance
+except ImportError:
+    from docset import BITMAPS_AVAILABLE, DocBitmap
+    from postings import gallop, intersect_sorted
+    from query_parser import (AndQuery, FuzzyQuery, NotQuery, PhraseQuery, ProximityQuery, TermQuery,
+                              WildcardQuery, parse_boolean_query)
+    from term_dictionary import MAX_EXPANSIONS, TermDictionary, auto_distance
+
+# 候选集合较小时与 postings 的文档序号做 galloping 求交，否则整体读取 postings 再求交集
+PROBE_RATIO = 8
+# 一次查询中模糊展开可用的时间（秒），超时后其余的模糊查询只匹配原词
+FUZZY_BUDGET = 0.05
+# 叶子节点命中的文档不少于全部文档的 1/BITMAP_DENSITY 时以位图表示，布尔运算按位进行
+BITMAP_DENSITY = 32
+
+
+def sorted_candidate_ords(candidates, doc_table):
+    """候选文档（集合或位图）对应的有序文档序号"""
+    if isinstance(candidates, DocBitmap) and candidates.doc_table is doc_table:
+        return candidates.ords().tolist()
+    return sorted(doc_ord for doc_ord in map(doc_table.get, candidates) if doc_ord >= 0)
+
+
+def match_phrase_spans(spans):
+    """
+    判断是否存在位置 p，使短语中第 i 个词出现在 p + i
+    每个词的位置以 (positions, start, end) 给出，即有序数组中的一段，不复制、不建集合；
+    各词的指针只向前移动，总代价与位置总数成线性关系
+    :param spans: [(positions, start, end)]，按短语中词的顺序排列
+    :return: 是否匹配
+    """
+    count = len(spans)
+    pointers = [start for _, start, _ in spans]
+    target = None  # 当前尝试的短语起始位置
+    i = 0
+    while True:
+        positions, _, end = spans[i]
+        pointer = pointers[i]
+        want = 0 if target is None else target + i
+        while pointer < end and positions[pointer] < want:
+            pointer += 1
+        pointers[i] = pointer
+        if pointer == end:
+            return False
+        found = positions[pointer]
+        if target is None or found == want:
+            if target is None:
+                target = found
+            i += 1
+            if i == count:
+                return True
+        else:
+            # 第 i 个词不在预期位置，以它的下一个出现位置推出新的起点，从第一个词重新检查
+            target = found - i
+            i = 0
+
+
+def match_window_spans(first, second, distance, ordered=False):
+    """
+    双指针判断两个词是否在 distance 个位置以内出现
+    :param first: 第一个词的位置 (positions, start, end)
+    :param second: 第二个词的位置 (positions, start, end)
+    :param ordered: 为 True 时要求第一个词在前：0 < p2 - p1 <= distance
+    :return: 是否匹配
+    """
+    positions1, i, end1 = first
+    positions2, j, end2 = second
+    if ordered:
+        for i in range(i, end1):
+            p1 = positions1[i]
+            while j < end2 and positions2[j] <= p1:
+                j += 1
+            if j == end2:
+                return False
+            if positions2[j] - p1 <= distance:
+                return True
+        return False
+    while i < end1 and j < end2:
+        p1 = positions1[i]
+        p2 = positions2[j]
+        if abs(p1 - p2) <= distance:
+            return True
+        if p1 < p2:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
 class QueryProcessor:
-    def __init__(self, index, preprocessor):
+    def __init__(self, index, preprocessor, use_bitmaps=True, max_expansions=MAX_EXPANSIONS, fuzzy_budget=FUZZY_BUDGET):
+        """
+        :param use_bitmaps: 是否对高频词与 NOT 的全集使用位图（需要 numpy）
+        :param max_expansions: 前缀 / 通配符 / 模糊查询最多展开的词项数
+        :param fuzzy_budget: 一次查询中模糊展开可用的时间（秒）
+        """
+        self.source = index
         self.index = index.index  # 多字段倒排索引结构 {field: {term: {doc_id: [pos]}}}
         self.preprocessor = preprocessor
+        self.use_bitmaps = use_bitmaps and BITMAPS_AVAILABLE
+        self._universe = None  # (文档表, 文档数, 全集位图)
+        self.max_expansions = max_expansions
+        self.fuzzy_budget = fuzzy_budget
+        self._term_dictionaries = {}  # {field: (字段索引, 索引版本, TermDictionary)}
         self.supported_fields = ['title', 'plot', 'cast', 'director']
         self.default_field = 'title'
 
     def query(self, query_str):
-        """重构后的主查询方法"""
-        clauses, operators = self.split_boolean_expression(query_str)
-        
-        # 没有运算符的情况
-        if not operators:
-            return self.parse_query(clauses[0])
-        
-        # 处理所有子查询
-        results = [self.parse_query(clause) for clause in clauses]
-        
-        # 按运算符顺序合并结果
-        while operators:
-            op = operators.pop(0)
-            a = results.pop(0)
-            b = results.pop(0)
-            results.insert(0, a & b if op == 'AND' else a | b)
-        
-        return results[0]
-
-    def parse_query(self, query):
-        """解析查询的入口方法"""
-        # 处理字段限定的短语查询
-        for field in self.supported_fields:
-            pattern = re.compile(rf'{field}:\s*"([^"]+)"', flags=re.IGNORECASE)
-            match = pattern.search(query)
-            if match:
-                phrase = match.group(1)
-                return self.phrase_search(phrase, target_field=field)
-        
-        # 处理普通字段查询
-        if ':' in query:
-            field, term_part = query.split(':', 1)
-            field = field.strip().lower()
-            term_part = term_part.strip()
-            if field in self.supported_fields:
-                return self.process_field_query(field, term_part)
-        
-        # 处理未限定的短语查询
-        if '"' in query:
-            phrase = query.strip('"')
-            return self.phrase_search(phrase)
-        
-        # 默认处理为普通查询
-        return self.process_single_term(query)
-
-    def split_boolean_expression(self, query):
-        """精确分割布尔表达式为子查询和运算符"""
-        # 使用正则表达式匹配运算符（区分大小写）
-        pattern = re.compile(r'\s+(AND|OR)\s+')
-        parts = pattern.split(query)
-        
-        # 分离子查询和运算符
-        clauses = []
-        operators = []
-        for i, part in enumerate(parts):
-            if i % 2 == 0:
-                clauses.append(part.strip())
-            else:
-                operators.append(part.strip().upper())
-        
-        return clauses, operators
-
-    def process_single_clause(self, clause):
-        """处理单个查询子句"""
-        # 处理字段限定的短语查询
-        for field in self.supported_fields:
-            pattern = re.compile(rf'{field}:\s*"([^"]+)"', flags=re.IGNORECASE)
-            match = pattern.search(clause)
-            if match:
-                phrase = match.group(1)
-                return self.phrase_search(phrase, target_field=field)
-        
-        # 处理普通字段查询
-        if ':' in clause:
-            field, term_part = clause.split(':', 1)
-            field = field.strip().lower()
-            term_part = term_part.strip()
-            if field in self.supported_fields:
-                return self.process_field_query(field, term_part)
-        
-        # 处理未限定的短语查询
-        if '"' in clause:
-            phrase = clause.strip('"')
-            return self.phrase_search(phrase)
-        
-        # 处理简单的普通查询（没有字段和冒号）
-        processed_terms = self.preprocessor.process_text(clause)
-        results = set()
-        
-        # 在所有支持的字段中查找同时包含所有词项的文档
-        for field in self.supported_fields:
-            field_results = set()
-            for term in processed_terms:
-                if term in self.index[field]:
-                    field_results.update(self.index[field][term].keys())
-            # 只保留同时包含所有词项的文档
-            if results:
-                results.intersection_update(field_results)
-            else:
-                results = field_results
-        
-        return results
+        """
+        解析布尔查询（字段、短语、NOT、括号），按文档频率规划后求值
+        :param query_str: 查询字符串
+        :return: 匹配的文档ID集合；结果较大时为 DocBitmap，同样支持 len / in / 迭代与集合运算
+        """
+        node = self.prepare(query_str)
+        if node is None:
+            return set()
+        return self.evaluate(node)
 
-    def process_field_query(self, field, query_part):
-        """处理字段限定的普通查询"""
-        # 处理可能存在的AND/OR逻辑
-        if ' AND ' in query_part:
-            terms = query_part.split(' AND ')
-            results = set()
-            for term in terms:
-                results.update(self.process_single_term(f"{field}:{term}"))
-            return results
-        elif ' OR ' in query_part:
-            terms = query_part.split(' OR ')
-            results = set()
-            for term in terms:
-                results.update(self.process_single_term(f"{field}:{term}"))
-            return results
-        else:
-            return self.process_single_term(f"{field}:{query_part}")
-
-    def process_single_term(self, term):
-        """处理单个查询项（可能包含字段限定）"""
-        if ':' in term:
-            field, term = term.split(':', 1)
-            field = field.strip().lower()
-            term = term.strip()
+    def prepare(self, query_str):
+        """
+        解析并规划查询，不求值；可先用 normalized_query(node) 查找结果缓存
+        :return: 规划后的语法树，空查询返回 None
+        """
+        node = parse_boolean_query(query_str, self.supported_fields, self.default_field)
+        if node is None:
+            return None
+        return self.plan(node, deadline=time.perf_counter() + self.fuzzy_budget)
+
+    def _df(self, field, term):
+        """词项在字段中的文档频率，二进制索引直接读词典，不解码 postings"""
+        field_index = self.index[field]
+        if hasattr(field_index, 'df'):
+            return field_index.df(term)
+        postings = field_index.get(term)
+        return len(postings) if postings is not None else 0
+
+    def all_doc_ids(self):
+        """全部文档ID，用于求值单独的 NOT"""
+        doc_ids = getattr(self.source, 'doc_ids', None)
+        if doc_ids is not None:
+            return set(doc_ids)
+        return {doc_id for terms in self.index.values() for postings in terms.values() for doc_id in postings}
+
+    def universe(self):
+        """
+        NOT 的全集：可以使用位图时返回缓存的全集位图（排除分段索引中已删除的文档），否则返回全部文档ID
+        """
+        doc_table = getattr(self.source, 'doc_table', None)
+        if not self.use_bitmaps or doc_table is None:
+            return self.all_doc_ids()
+        cached = self._universe
+        if cached is None or cached[0] is not doc_table or cached[1] != len(doc_table):
+            bitmap = DocBitmap.full(doc_table, getattr(self.source, 'deleted_ords', ()))
+            cached = self._universe = (doc_table, len(doc_table), bitmap)
+        return cached[2]
+
+    def term_dictionary(self, field):
+        """字段的有序词项数组与 k-gram 索引，首次使用时构建，字段索引或索引版本变化后重建"""
+        field_index = self.index[field]
+        version = getattr(self.source, 'version', None)
+        cached = self._term_dictionaries.get(field)
+        if cached is None or cached[0] is not field_index or cached[1] != version:
+            cached = self._term_dictionaries[field] = (field_index, version, TermDictionary.from_field_index(field_index))
+        return cached[2]
+
+    def expand_wildcard(self, field, pattern):
+        """
+        展开前缀 / 通配符模式
+        :return: 匹配的词项，按 df 从高到低最多 max_expansions 个
+        """
+        if field not in self.index:
+            return []
+        return self.term_dictionary(field).expand(pattern, self.max_expansions)
+
+    def fuzzy_terms(self, term, fields=None, max_distance=None, deadline=None, limit=None):
+        """
+        查找与 term 相近的索引词项（拼写错误、音译名的不同写法等）
+        :param term: 预处理后的查询词
+        :param fields: 检索的字段，默认所有字段
+        :param max_distance: 最大编辑距离，默认按词长决定
+        :param deadline: time.perf_counter() 的截止时刻，超时后返回已找到的词项
+        :param limit: 最多返回的词项数，默认 max_expansions
+        :return: 词项列表，按编辑距离从小到大、df 从高到低排列
+        """
+        limit = limit or self.max_expansions
+        if max_distance is None:
+            max_distance = auto_distance(term)
+        matches = {}
+        for field in fields or self.supported_fields:
+            if field not in self.index:
+                continue
+            for distance, candidate in self.term_dictionary(field).fuzzy(term, max_distance, limit, deadline):
+                matches[candidate] = min(distance, matches.get(candidate, distance))
+        # 同一距离内保持各字段结果的先后（即 df 从高到低）
+        return sorted(matches, key=matches.get)[:limit]
+
+    def build_term_dictionaries(self, fields=None):
+        """载入索引后预先构建各字段的词项数组与 k-gram 索引，首个通配符 / 模糊查询不必等待构建"""
+        for field in fields or self.supported_fields:
+            if field in self.index:
+                self.term_dictionary(field).kgram_index()
+
+    def plan(self, node, deadline=None):
+        """
+        预处理各叶子节点的词项并估算结果规模（node.cost），AND 的子节点按代价从小到大排序，NOT 排在最后
+        :param deadline: 模糊展开的截止时刻（time.perf_counter()），超时后模糊查询只匹配原词
+        :return: 规划后的节点
+        """
+        if isinstance(node, TermQuery):
+            node.terms = self.preprocessor.process_text(node.text)
+            node.cost = sum(self._df(node.field, term) for term in node.terms)
+        elif isinstance(node, WildcardQuery):
+            node.terms = self.expand_wildcard(node.field, node.pattern)
+            node.cost = sum(self._df(node.field, term) for term in node.terms)
+        elif isinstance(node, FuzzyQuery):
+            node.terms = []
+            for term in self.preprocessor.process_text(node.text):
+                expanded = self.fuzzy_terms(term, [node.field], node.distance, deadline)
+                node.terms.extend(expanded or [term])  # 超时未展开时只匹配原词
+            node.terms = list(dict.fromkeys(node.terms))
+            node.cost = sum(self._df(node.field, term) for term in node.terms)
+        elif isinstance(node, PhraseQuery):
+            node.terms = self.preprocessor.process_text(node.text)
+            fields = [node.field] if node.field else self.supported_fields
+            node.cost = sum(
+                min(self._df(field, term) for term in node.terms) for field in fields
+            ) if node.terms else 0
+        elif isinstance(node, ProximityQuery):
+            # 每一侧取预处理后的第一个词（与 code.py 中的实现一致），被当作停用词去掉时无法匹配
+            first = self.preprocessor.process_text(node.text1)[:1]
+            second = self.preprocessor.process_text(node.text2)[:1]
+            node.terms = first + second if first and second else []
+            fields = [node.field] if node.field else self.supported_fields
+            node.cost = sum(
+                min(self._df(field, term) for term in node.terms) for field in fields
+            ) if node.terms else 0
+        elif isinstance(node, NotQuery):
+            self.plan(node.child, deadline)
+            node.cost = float('inf')
         else:
-            field = self.default_field
-            term = term.strip()
+            children = []
+            for child in node.children:
+                self.plan(child, deadline)
+                # 展开嵌套的同类节点，便于整体排序
+                children.extend(child.children if type(child) is type(node) else [child])
+            node.children = children
+            if isinstance(node, AndQuery):
+                node.children.sort(key=lambda child: child.cost)
+                node.cost = node.children[0].cost
+            else:
+                node.cost = sum(child.cost for child in children)
+        return node
 
-        # 预处理查询词
-        processed_terms = self.preprocessor.process_text(term)
+    def evaluate(self, node, candidates=None):
+        """
+        对规划后的语法树求值
+        :param candidates: 候选文档集合；给定时结果限定在其中，且叶子节点只探测候选文档
+        :return: 文档ID集合
+        """
+        if isinstance(node, (TermQuery, WildcardQuery, FuzzyQuery)):
+            return self.evaluate_terms(node.field, node.terms, candidates)
+        if isinstance(node, PhraseQuery):
+            return self.phrase_search(node.text, target_field=node.field, candidates=candidates, terms=node.terms)
+        if isinstance(node, ProximityQuery):
+            return self.proximity_search(node, candidates)
+        if isinstance(node, NotQuery):
+            base = candidates if candidates is not None else self.universe()
+            return base - self.evaluate(node.child, base)
+        if isinstance(node, AndQuery):
+            # 从最稀有的子查询开始，逐步缩小候选集合，为空时提前结束
+            results = candidates
+            for child in node.children:
+                results = self.evaluate(child, results)
+                if not results:
+                    return set()
+            return results
         results = set()
-        
-        # 在指定字段中搜索所有处理后的词项
-        for t in processed_terms:
-            if field in self.index and t in self.index[field]:
-                results.update(self.index[field][t].keys())
+        for child in node.children:
+            results |= self.evaluate(child, candidates)
         return results
 
-    def phrase_search(self, phrase, target_field=None):
-        """增强的短语搜索，支持指定字段"""
-        terms = self.preprocessor.process_text(phrase)
+    def evaluate_terms(self, field, terms, candidates=None):
+        """匹配在字段中包含任意一个词项的文档，可限定在候选集合内"""
+        field_index = self.index[field]
+        terms = [term for term in terms if term in field_index]
+        total = sum(self._df(field, term) for term in terms)
+        if candidates is not None and len(candidates) * len(terms) * PROBE_RATIO < total:
+            return self._intersect_candidates(field_index, terms, candidates)
+        if self.use_bitmaps and terms:
+            columns = [self._doc_ords(field_index, term) for term in terms]
+            doc_table = columns[0][1]
+            if total * BITMAP_DENSITY >= len(doc_table):
+                # 高频词：直接按文档序号置位，不为每个文档ID建立集合元素
+                bitmap = DocBitmap.from_ords(doc_table, [doc_ords for doc_ords, _ in columns])
+                return bitmap & candidates if candidates is not None else bitmap
+        results = set()
+        for term in terms:
+            results.update(field_index[term].keys())
+        return results & candidates if candidates is not None else results
+
+    def _doc_ords(self, field_index, term):
+        """
+        词项的有序文档序号及其文档表
+        二进制索引只解码文档序号列，高频词不必解码全部位置
+        """
+        if hasattr(field_index, 'doc_ords'):
+            return field_index.doc_ords(term), field_index.doc_table
+        postings = field_index[term]
+        return postings.doc_ords, postings.doc_table
+
+    def _intersect_candidates(self, field_index, terms, candidates):
+        """
+        将候选文档转换为有序序号，与各词项的文档序号做 galloping 求交
+        代价与候选集合的大小成正比，而非高频词的 postings 长度
+        """
+        matched = set()
+        candidate_ords = None
+        doc_table = None
+        for term in terms:
+            doc_ords, doc_table = self._doc_ords(field_index, term)
+            if candidate_ords is None:
+                candidate_ords = sorted_candidate_ords(candidates, doc_table)
+            matched.update(intersect_sorted(candidate_ords, doc_ords))
+        return {doc_table[doc_ord] for doc_ord in matched}
+
+    def phrase_search(self, phrase, target_field=None, candidates=None, terms=None):
+        """
+        增强的短语搜索，支持指定字段
+        :param candidates: 候选文档集合，给定时只检查其中的文档
+        :param terms: 已预处理的词项，默认对 phrase 做预处理
+        """
+        if terms is None:
+            terms = self.preprocessor.process_text(phrase)
         if len(terms) < 1:
             return set()
 
         found_docs = set()
-        # 如果指定了目标字段
-        if target_field:
-            candidates = self.get_phrase_candidates(target_field, terms)
-            for doc_id, positions_list in candidates.items():
-                if self.check_phrase_positions(positions_list):
-                    found_docs.add(doc_id)
-        else:
-            # 跨所有字段搜索
-            for field in self.supported_fields:
-                candidates = self.get_phrase_candidates(field, terms)
-                for doc_id, positions_list in candidates.items():
-                    if self.check_phrase_positions(positions_list):
-                        found_docs.add(doc_id)
+        # 指定了目标字段时只检索该字段，否则跨所有字段搜索
+        for field in ([target_field] if target_field else self.supported_fields):
+            found_docs.update(self.phrase_doc_ids(field, terms, candidates))
+        return found_docs
+
+    def proximity_search(self, node, candidates=None):
+        """
+        邻近查询，node.field 为 None 时跨所有字段搜索（同一字段内的两个词才算邻近）
+        :param node: 规划后的 ProximityQuery
+        :param candidates: 候选文档集合，给定时只检查其中的文档
+        """
+        if len(node.terms) < 2:
+            return set()
+        term1, term2 = node.terms
+        found_docs = set()
+        for field in ([node.field] if node.field else self.supported_fields):
+            found_docs.update(self.proximity_doc_ids(field, term1, term2, node.distance, node.ordered, candidates))
         return found_docs
 
-    def get_phrase_candidates(self, field, terms):
-        """获取包含所有词项的候选文档"""
-        candidates = defaultdict(list)
-        
-        # 检查第一个词项的存在性
-        first_term = terms[0]
-        if field not in self.index or first_term not in self.index[field]:
-            return {}
-
-        # 遍历包含第一个词项的文档
-        for doc_id, positions in self.index[field][first_term].items():
-            valid = True
-            all_positions = [positions]
-            
-            # 检查后续词项
-            for term in terms[1:]:
-                if (field not in self.index or 
-                    term not in self.index[field] or 
-                    doc_id not in self.index[field][term]):
-                    valid = False
+    def phrase_doc_ids(self, field, terms, candidates=None):
+        """
+        在一个字段中匹配短语：对同时包含所有词项的文档做线性的多路位置归并
+        :param candidates: 候选文档集合，给定时只检查其中的文档
+        :return: 生成匹配的文档ID
+        """
+        for doc_id, spans in self.matching_spans(field, terms, candidates):
+            if match_phrase_spans(spans):
+                yield doc_id
+
+    def proximity_doc_ids(self, field, term1, term2, distance, ordered=False, candidates=None):
+        """
+        在一个字段中匹配邻近查询：两个词的距离不超过 distance（ordered 时 term1 必须在 term2 之前）
+        :return: 生成匹配的文档ID
+        """
+        if term1 == term2:
+            # 同一个词：需要两次不同的出现
+            for doc_id, ((positions, start, end),) in self.matching_spans(field, [term1], candidates):
+                if any(positions[i + 1] - positions[i] <= distance for i in range(start, end - 1)):
+                    yield doc_id
+            return
+        for doc_id, (first, second) in self.matching_spans(field, [term1, term2], candidates):
+            if match_window_spans(first, second, distance, ordered):
+                yield doc_id
+
+    def matching_spans(self, field, terms, candidates=None):
+        """
+        找出在字段中同时包含所有词项的文档
+        从文档最少的词项（或更小的候选集合）出发按文档序号求交，不建立中间集合
+        :param candidates: 候选文档集合，给定时只检查其中的文档
+        :return: 生成 (doc_id, spans)，spans 与 terms 一一对应，每项为该词在文档中的位置 (positions, start, end)
+        """
+        field_index = self.index[field]
+        if any(term not in field_index for term in terms):
+            return
+        # 重复的词项共用同一个 postings
+        postings_by_term = {term: field_index[term] for term in set(terms)}
+        postings_lists = [postings_by_term[term] for term in terms]
+        distinct = sorted(postings_by_term.values(), key=len)
+        rarest, others = distinct[0], distinct[1:]
+        doc_table = rarest.doc_table
+
+        if candidates is not None and len(candidates) < len(rarest):
+            # 从候选集合出发，所有词项的 postings 都需要查找
+            others = distinct
+            entries = ((None, doc_ord) for doc_ord in sorted_candidate_ords(candidates, doc_table))
+        else:
+            # 从最稀有词项的 postings 出发，它在 postings 中的下标即遍历的下标
+            entries = enumerate(rarest.doc_ords)
+            if candidates is not None:
+                if isinstance(candidates, DocBitmap) and candidates.doc_table is doc_table:
+                    wanted = candidates.has_ord
+                else:
+                    wanted = set(map(doc_table.get, candidates)).__contains__
+                entries = ((i, doc_ord) for i, doc_ord in entries if wanted(doc_ord))
+        slots = {id(postings): k for k, postings in enumerate(others)}
+        term_slots = [slots.get(id(postings)) for postings in postings_lists]  # None 表示最稀有词项
+
+        # 各 postings 的文档序号单调递增，从上次的位置向前 galloping 查找，找到的下标同时用于定位位置
+        found = [0] * len(others)
+        for anchor, doc_ord in entries:
+            for k, postings in enumerate(others):
+                other_ords = postings.doc_ords
+                i = gallop(other_ords, doc_ord, found[k])
+                found[k] = i
+                if i == len(other_ords) or other_ords[i] != doc_ord:
                     break
-                all_positions.append(self.index[field][term][doc_id])
-            
-            if valid:
-                candidates[doc_id] = all_positions
-        return candidates
-
-    def check_phrase_positions(self, positions_list):
-        """验证位置连续性"""
-        # 计算词项的数量
-        term_count = len(positions_list)
-        
-        # 创建一个集合来存储所有位置
-        position_set = set()
-        
-        # 遍历每个词项的位置列表
-        for i, positions in enumerate(positions_list):
-            # 将每个位置调整并添加到集合中
-            for pos in positions:
-                position_set.add(pos + (term_count - 1 - i))
-        
-        # 如果集合的大小等于所有位置的总数，则说明有重叠
-        return len(position_set) < sum(len(pos) for pos in positions_list)
\ No newline at end of file
+            else:
+                spans = []
+                for postings, slot in zip(postings_lists, term_slots):
+                    i = anchor if slot is None else found[slot]
+                    offsets = postings.offsets
+                    spans.append((postings.positions, offsets[i], offsets[i + 1]))
+                yield doc_table[doc_ord], spans
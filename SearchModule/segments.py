@@ -0,0 +1,416 @@
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+from functools import cached_property, lru_cache
+
+try:
+    from .index_format import merge_indexes
+    from .indexer import PositionalInvertedIndex
+    from .mmap_index import LazyIndex, MmapInvertedIndex
+    from .postings import DocTable, concat_postings
+    from .collection_stats import CollectionStats
+except ImportError:
+    from index_format import merge_indexes
+    from indexer import PositionalInvertedIndex
+    from mmap_index import LazyIndex, MmapInvertedIndex
+    from postings import DocTable, concat_postings
+    from collection_stats import CollectionStats
+
+# 分段增量索引
+#
+# 索引目录结构：
+#   manifest.json       当前生效的段列表与墓碑表，通过临时文件 + os.replace 原子替换
+#   seg_000001.bin ...  每个段是一个只读的二进制索引（见 index_format.py）
+#
+# 每个段有一个递增的代号（generation）。删除或更新文档时在墓碑表中记下 {doc_id: 当前最大代号}，
+# 代号不大于该值的段中的这个文档视为已删除；更新后的文档写入代号更大的新段，因此不受影响。
+# 查询同时检索所有段并过滤墓碑文档；段数过多时在后台线程中合并，并清除已删除的文档。
+# 同一索引目录只允许一个写入进程，其余进程只读并可通过 refresh() 获取最新的段列表。
+
+MANIFEST = 'manifest.json'
+DEFAULT_MAX_SEGMENTS = 8
+DEFAULT_ADD_BATCH_SIZE = 10000  # 命令行 add 每个新段的最大文档数，内存占用只与它有关
+
+
+class Segment:
+    """一个已打开的段及其中被墓碑删除的文档"""
+
+    def __init__(self, name, generation, index, deleted):
+        self.name = name
+        self.generation = generation
+        self.index = index  # MmapInvertedIndex
+        self.deleted = deleted  # 本段中已删除的文档ID集合
+        self.deleted_ords = {index.doc_table.get(doc_id) for doc_id in deleted}
+
+    @property
+    def num_live_docs(self):
+        return self.index.num_docs - len(self.deleted)
+
+
+_snapshot_versions = itertools.count(1)
+
+
+class Snapshot:
+    """某一时刻的段列表，不可变；写入或合并后整体替换"""
+
+    def __init__(self, segments, cache_size=128):
+        self.segments = segments
+        self.version = next(_snapshot_versions)  # 每个快照的版本号不同，查询结果缓存据此失效
+        self.num_docs = sum(segment.num_live_docs for segment in segments)
+        # 合并文档表：各段的文档表依次拼接，bases 为每段的起始序号
+        self.doc_table = DocTable()
+        self.bases = []
+        for segment in segments:
+            self.bases.append(len(self.doc_table.doc_ids))
+            self.doc_table.doc_ids.extend(segment.index.doc_ids)
+        # 已删除文档在合并文档表中的序号
+        self.deleted_ords = {
+            base + doc_ord for segment, base in zip(segments, self.bases) for doc_ord in segment.deleted_ords
+        }
+        field_names = sorted({field for segment in segments for field in segment.index.index})
+        self.fields = {field: SegmentedFieldView(self, field, cache_size) for field in field_names}
+
+    @cached_property
+    def stats(self):
+        """合并各段的集合统计，已删除文档的字段长度记为 0 且不计入总词数"""
+        field_lengths = {field: array('I') for field in self.fields}
+        total_lengths = dict.fromkeys(self.fields, 0)
+        for segment in self.segments:
+            segment_stats = segment.index.stats
+            for field, lengths in field_lengths.items():
+                segment_lengths = segment_stats.field_lengths.get(field)
+                if segment_lengths is None:
+                    lengths.extend([0] * segment.index.num_docs)
+                    continue
+                base = len(lengths)
+                lengths.extend(segment_lengths)
+                total_lengths[field] += segment_stats.total_lengths.get(field, 0)
+                for doc_ord in segment.deleted_ords:
+                    total_lengths[field] -= lengths[base + doc_ord]
+                    lengths[base + doc_ord] = 0
+        return CollectionStats(self.doc_table, LazyIndex(self.fields), field_lengths, total_lengths,
+                               num_docs=self.num_docs)
+
+
+class SegmentedIndex:
+    """
+    由多个段组成的可增量更新的索引
+    提供与 PositionalInvertedIndex 相同的 index 属性：{field: {term: {doc_id: [pos]}}}
+    """
+
+    def __init__(self, index_dir, max_segments=DEFAULT_MAX_SEGMENTS):
+        """
+        :param index_dir: 索引目录，不存在时创建
+        :param max_segments: 段数超过该值时在后台触发合并
+        """
+        self.index_dir = index_dir
+        self.max_segments = max_segments
+        self.lock = threading.RLock()
+        self._compaction = None
+        self._manifest_mtime = None
+        os.makedirs(index_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self._open_segments = {}  # {段文件名: MmapInvertedIndex}
+        self.snapshot = self._load_snapshot()
+        self.index = SegmentedIndexView(self)
+
+    @property
+    def num_docs(self):
+        """当前存活的文档数"""
+        return self.snapshot.num_docs
+
+    @property
+    def doc_ids(self):
+        """当前存活的文档ID"""
+        return [
+            doc_id for segment in self.snapshot.segments for doc_id in segment.index.doc_ids
+            if doc_id not in segment.deleted
+        ]
+
+    @property
+    def version(self):
+        """当前快照的版本号，段列表或墓碑变化后改变"""
+        return self.snapshot.version
+
+    @property
+    def doc_table(self):
+        """当前快照的合并文档表（包含已删除的文档）"""
+        return self.snapshot.doc_table
+
+    @property
+    def deleted_ords(self):
+        """已删除文档在合并文档表中的序号"""
+        return self.snapshot.deleted_ords
+
+    @property
+    def stats(self):
+        """当前快照的集合统计"""
+        return self.snapshot.stats
+
+    def _manifest_path(self):
+        return os.path.join(self.index_dir, MANIFEST)
+
+    def _read_manifest(self):
+        path = self._manifest_path()
+        if not os.path.exists(path):
+            return {'generation': 0, 'segments': [], 'tombstones': {}}
+        self._manifest_mtime = os.path.getmtime(path)
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def _write_manifest(self, manifest):
+        path = self._manifest_path()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, path)
+        self._manifest_mtime = os.path.getmtime(path)
+        self.manifest = manifest
+
+    def _load_snapshot(self):
+        """根据 manifest 打开各段并计算每段的已删除文档"""
+        tombstones = self.manifest['tombstones']
+        segments = []
+        for entry in self.manifest['segments']:
+            name, generation = entry['name'], entry['generation']
+            if name not in self._open_segments:
+                self._open_segments[name] = MmapInvertedIndex(os.path.join(self.index_dir, name))
+            index = self._open_segments[name]
+            deleted = {
+                doc_id for doc_id, value in tombstones.items()
+                if value >= generation and doc_id in index.doc_table
+            } if tombstones else set()
+            segments.append(Segment(name, generation, index, deleted))
+        live = {segment.name for segment in segments}
+        self._open_segments = {name: index for name, index in self._open_segments.items() if name in live}
+        return Snapshot(segments)
+
+    def _publish(self, manifest):
+        """原子地写入新的 manifest 并切换查询快照"""
+        self._write_manifest(manifest)
+        self.snapshot = self._load_snapshot()
+
+    def refresh(self):
+        """若 manifest 被其他进程更新，重新加载段列表"""
+        path = self._manifest_path()
+        if os.path.exists(path) and os.path.getmtime(path) != self._manifest_mtime:
+            with self.lock:
+                self.manifest = self._read_manifest()
+                self.snapshot = self._load_snapshot()
+
+    def _contains_doc(self, doc_id):
+        return any(
+            doc_id in segment.index.doc_table and doc_id not in segment.deleted
+            for segment in self.snapshot.segments
+        )
+
+    def add_documents(self, documents, compact=True):
+        """
+        将新文档写入一个新段；已存在的文档ID视为更新，旧版本记入墓碑
+        :param documents: 预处理后的文档字典 {doc_id: {field: [tokens]}}
+        :param compact: 段数超过 max_segments 时是否触发后台合并
+        :return: 新段的文件名，没有可索引内容时返回 None
+        """
+        if not documents:
+            return None
+        block = PositionalInvertedIndex()
+        block.build_index(documents)
+        with self.lock:
+            manifest = dict(self.manifest)
+            generation = manifest['generation'] + 1
+            name = f'seg_{generation:06d}.bin'
+            block.save_index(os.path.join(self.index_dir, name), fmt='binary')
+
+            tombstones = dict(manifest['tombstones'])
+            for doc_id in documents:
+                if self._contains_doc(doc_id):
+                    tombstones[doc_id] = manifest['generation']
+            manifest['generation'] = generation
+            manifest['segments'] = manifest['segments'] + [{'name': name, 'generation': generation}]
+            manifest['tombstones'] = tombstones
+            self._publish(manifest)
+        if compact and len(self.manifest['segments']) > self.max_segments:
+            self.compact_in_background()
+        return name
+
+    def delete_documents(self, doc_ids):
+        """
+        删除文档：记入墓碑表，查询时立即生效，段合并时真正移除
+        :param doc_ids: 待删除的文档ID
+        """
+        with self.lock:
+            manifest = dict(self.manifest)
+            tombstones = dict(manifest['tombstones'])
+            for doc_id in doc_ids:
+                tombstones[doc_id] = manifest['generation']
+            manifest['tombstones'] = tombstones
+            self._publish(manifest)
+
+    def compact(self):
+        """
+        将当前所有段合并为一个段并清除墓碑文档
+        合并期间可以继续写入：新加入的段与墓碑在合并完成后保留
+        """
+        with self.lock:
+            snapshot = self.snapshot
+            tombstones_before = dict(self.manifest['tombstones'])
+        if len(snapshot.segments) <= 1 and not tombstones_before:
+            return None
+        if not snapshot.segments:
+            return None
+
+        generation = snapshot.segments[-1].generation
+        with self.lock:
+            compactions = self.manifest.get('compactions', 0) + 1
+        name = f'seg_{generation:06d}_c{compactions:04d}.bin'
+        merge_indexes(
+            [os.path.join(self.index_dir, segment.name) for segment in snapshot.segments],
+            os.path.join(self.index_dir, name),
+            deleted=[segment.deleted for segment in snapshot.segments],
+        )
+
+        with self.lock:
+            merged_names = {segment.name for segment in snapshot.segments}
+            manifest = dict(self.manifest)
+            manifest['compactions'] = compactions
+            manifest['segments'] = [{'name': name, 'generation': generation}] + [
+                entry for entry in manifest['segments'] if entry['name'] not in merged_names
+            ]
+            # 合并前已存在且未变化的墓碑对应的文档已被清除，可以丢弃
+            manifest['tombstones'] = {
+                doc_id: value for doc_id, value in manifest['tombstones'].items()
+                if tombstones_before.get(doc_id) != value
+            }
+            self._publish(manifest)
+        self._remove_unused_files()
+        return name
+
+    def compact_in_background(self):
+        """在后台线程中合并段，若已有合并在进行则忽略"""
+        with self.lock:
+            if self._compaction is not None and self._compaction.is_alive():
+                return self._compaction
+            self._compaction = threading.Thread(target=self.compact, name='segment-compaction', daemon=True)
+            self._compaction.start()
+            return self._compaction
+
+    def _remove_unused_files(self):
+        """删除不再被 manifest 引用的段文件（仍被映射时可能删除失败，留待下次清理）"""
+        live = {entry['name'] for entry in self.manifest['segments']}
+        for name in os.listdir(self.index_dir):
+            if name.startswith('seg_') and name.endswith('.bin') and name not in live:
+                try:
+                    os.remove(os.path.join(self.index_dir, name))
+                except OSError:
+                    pass
+
+
+class SegmentedIndexView(Mapping):
+    """字段 -> 当前快照中该字段的视图；每次访问都读取最新快照"""
+
+    _EMPTY = {}
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    def __getitem__(self, field):
+        return self.owner.snapshot.fields.get(field, self._EMPTY)
+
+    def __contains__(self, field):
+        return field in self.owner.snapshot.fields
+
+    def __iter__(self):
+        return iter(self.owner.snapshot.fields)
+
+    def __len__(self):
+        return len(self.owner.snapshot.fields)
+
+
+class SegmentedFieldView(Mapping):
+    """单个字段跨所有段的词项 -> PostingsList 视图，过滤已删除的文档"""
+
+    def __init__(self, snapshot, field, cache_size):
+        self.snapshot = snapshot
+        self.segments = snapshot.segments
+        self.field = field
+        self._postings = lru_cache(maxsize=cache_size)(self._merge_term)
+
+    def _merge_term(self, term):
+        parts = [
+            (segment.index.index[self.field][term], base, segment.deleted_ords)
+            for segment, base in zip(self.segments, self.snapshot.bases)
+            if term in segment.index.index[self.field]
+        ]
+        if not parts:
+            raise KeyError(term)
+        return concat_postings(parts, self.snapshot.doc_table)
+
+    def __getitem__(self, term):
+        return self._postings(term)
+
+    def __contains__(self, term):
+        return any(term in segment.index.index[self.field] for segment in self.segments)
+
+    def max_tf(self, term):
+        """各段中最大词频的最大值（含已删除的文档，仍是上界）"""
+        return max((segment.index.index[self.field].max_tf(term) for segment in self.segments), default=0)
+
+    def __iter__(self):
+        seen = set()
+        for segment in self.segments:
+            for term in segment.index.index[self.field]:
+                if term not in seen:
+                    seen.add(term)
+                    yield term
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incrementally update a segmented index directory.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser('add', help='index new or updated movies into a new segment')
+    add_parser.add_argument('index_dir')
+    add_parser.add_argument('inputs', nargs='+', help='.json / .jsonl files with new movies')
+    add_parser.add_argument('--batch-size', type=int, default=DEFAULT_ADD_BATCH_SIZE,
+                            help=f'documents per new segment (default: {DEFAULT_ADD_BATCH_SIZE})')
+    delete_parser = subparsers.add_parser('delete', help='delete movies by id')
+    delete_parser.add_argument('index_dir')
+    delete_parser.add_argument('doc_ids', nargs='+')
+    compact_parser = subparsers.add_parser('compact', help='merge all segments into one')
+    compact_parser.add_argument('index_dir')
+    args = parser.parse_args()
+
+    index = SegmentedIndex(args.index_dir)
+    start = time.perf_counter()
+    if args.command == 'add':
+        try:
+            from .preprocessor import TextPreprocessor
+        except ImportError:
+            from preprocessor import TextPreprocessor
+        preprocessor = TextPreprocessor(remove_stop_words=True, apply_stemming=True)
+        # 流式读取输入，每 batch_size 个文档写入一个新段；后面批次中重复的文档ID按更新处理
+        documents = (item for file_path in args.inputs for item in preprocessor.iter_processed(file_path))
+        batch_size = max(1, args.batch_size)
+        count, names = 0, []
+        for batch in iter(lambda: dict(itertools.islice(documents, batch_size)), {}):
+            names.append(index.add_documents(batch, compact=False))
+            count += len(batch)
+        print(f"已写入 {count} 个文档 -> {', '.join(name for name in names if name) or '无新段'}")
+    elif args.command == 'delete':
+        index.delete_documents(args.doc_ids)
+        print(f"已删除 {len(args.doc_ids)} 个文档")
+    else:
+        name = index.compact()
+        print(f"已合并为 {name}")
+    print(f"当前共 {len(index.manifest['segments'])} 个段，{index.num_docs} 个文档，用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import math
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import Counter
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # 离线计算近邻需要 numpy / scipy，读取近邻表不需要
+    np = sparse = None
+
+try:
+    from .index_format import IndexReader, IndexWriter
+    from .postings import DocTable
+    from .preprocessor import TextPreprocessor
+except ImportError:
+    from index_format import IndexReader, IndexWriter
+    from postings import DocTable
+    from preprocessor import TextPreprocessor
+
+# 相似电影（more-like-this）的离线计算与近邻表
+#
+# 每部电影由源数据构造一个稀疏特征向量，特征分为几组：
+#   director:<导演>  cast:<演员>  genre:<类型>  keyword:<关键词>  plot:<剧情词项（预处理后）>
+# 特征值为 idf = ln(N / df)（剧情词项再乘以 1 + ln(tf)）。只出现在一部电影中的特征对相似度没有贡献，
+# 出现在超过 max_df 比例电影中的特征（常见词、最大的几个类型）区分度很低，却会使 X @ X^T 几乎稠密，二者都直接丢弃。
+# 每组子向量先做 L2 归一化再乘以组权重（FEATURE_GROUP_WEIGHTS），避免词数多的剧情压过导演、演员，
+# 最后整行归一化，两部电影的相似度即特征向量的余弦 X[i] . X[j]。
+#
+# 近邻按块计算：每次取 block_size 行，S = X[block] @ X^T 仍为稀疏矩阵，
+# 对每行用 argpartition 选出相似度最高的 N 个（不含自身，相同时按文档序号），内存只与块大小有关。
+#
+# 结果写为定长的近邻表，沿用二进制索引的容器格式（见 index_format.py）：
+#   文档表 | similar:meta  每部电影的近邻数 N(u32)，小端
+#          | similar:neighbors  num_docs * N 个近邻的文档序号，小端 u32，不足 N 个时以 NO_NEIGHBOR 填充
+#          | similar:scores     与 similar:neighbors 一一对应的相似度，小端 f32
+# 查询时按文档序号直接定位 N 个近邻，O(1)。
+#
+# 用法：python similar_movies.py sample/*_sample.jsonl -o index.similar --neighbors 20
+
+SIMILAR_AVAILABLE = sparse is not None
+FEATURE_GROUP_WEIGHTS = {'director': 1.0, 'cast': 1.0, 'genre': 0.6, 'keyword': 1.0, 'plot': 0.8}
+DEFAULT_MAX_DF = 0.1
+DEFAULT_NUM_NEIGHBORS = 20
+DEFAULT_BLOCK_SIZE = 256
+NO_NEIGHBOR = 0xFFFFFFFF
+_META = struct.Struct('<I')
+
+
+def movie_features(document, preprocessor):
+    """
+    一部电影的原始特征
+    :param document: 源数据中的电影（JSON对象）
+    :param preprocessor: 处理剧情的文本预处理器
+    :return: Counter({(组, 特征): 出现次数})
+    """
+    features = Counter()
+    director = document.get('director')
+    if director:
+        features['director', director.strip().lower()] += 1
+    for name in (document.get('cast_character') or {}):
+        features['cast', name.strip().lower()] += 1
+    for genre in document.get('genres') or ():
+        if genre:
+            features['genre', genre.strip().lower()] += 1
+    for keyword in document.get('keywords') or ():
+        if keyword:
+            features['keyword', keyword.strip().lower()] += 1
+    for term in preprocessor.process_text(document.get('plot') or ''):
+        features['plot', term] += 1
+    return features
+
+
+def build_feature_matrix(documents, preprocessor=None, group_weights=None, max_df=DEFAULT_MAX_DF):
+    """
+    由源数据构造归一化的特征矩阵
+    :param documents: 可迭代的电影（JSON对象）
+    :param preprocessor: 剧情的文本预处理器，默认去停用词并提取词干
+    :param group_weights: {组: 权重}，默认 FEATURE_GROUP_WEIGHTS，不在其中的组不参与
+    :param max_df: 特征最多出现在多大比例的电影中，超过时丢弃
+    :return: (csr_matrix 电影 x 特征，各行 L2 范数为 1 或 0, 按行排列的文档ID)
+    """
+    preprocessor = preprocessor or TextPreprocessor(remove_stop_words=True, apply_stemming=True)
+    group_weights = group_weights if group_weights is not None else FEATURE_GROUP_WEIGHTS
+    doc_ids = []
+    rows = []
+    df = Counter()
+    for document in documents:
+        features = Counter({feature: count for feature, count in movie_features(document, preprocessor).items()
+                            if feature[0] in group_weights})
+        doc_ids.append(document['id'])
+        rows.append(features)
+        df.update(features.keys())
+    num_docs = len(rows)
+    max_count = max(2, max_df * num_docs)
+    feature_ids = {}
+    indptr, indices, data = [0], [], []
+    for features in rows:
+        groups = {}
+        for feature, count in features.items():
+            if df[feature] < 2 or df[feature] > max_count:
+                continue
+            value = math.log(num_docs / df[feature])
+            if feature[0] == 'plot':
+                value *= 1.0 + math.log(count)
+            if value > 0:
+                groups.setdefault(feature[0], []).append((feature, value))
+        row = []
+        for group, values in groups.items():
+            norm = math.sqrt(sum(value * value for _, value in values))
+            row.extend((feature, group_weights[group] * value / norm) for feature, value in values)
+        norm = math.sqrt(sum(value * value for _, value in row))
+        for feature, value in row:
+            indices.append(feature_ids.setdefault(feature, len(feature_ids)))
+            data.append(value / norm)
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(num_docs, len(feature_ids)),
+    )
+    return matrix, doc_ids
+
+
+def nearest_neighbors(matrix, num_neighbors=DEFAULT_NUM_NEIGHBORS, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    按块计算每行余弦相似度最高的 num_neighbors 行
+    :param matrix: build_feature_matrix 得到的归一化特征矩阵
+    :return: (neighbors array('I'), scores array('f'))，各 num_docs * num_neighbors 个，不足时以 NO_NEIGHBOR / 0 填充
+    """
+    num_docs = matrix.shape[0]
+    neighbors = array('I', [NO_NEIGHBOR]) * (num_docs * num_neighbors)
+    scores = array('f', bytes(4 * num_docs * num_neighbors))
+    transposed = matrix.T.tocsr()
+    for start in range(0, num_docs, block_size):
+        block = (matrix[start:start + block_size] @ transposed).tocsr()
+        for r in range(block.shape[0]):
+            doc_ord = start + r
+            lo, hi = block.indptr[r], block.indptr[r + 1]
+            cols, values = block.indices[lo:hi], block.data[lo:hi]
+            keep = (cols != doc_ord) & (values > 0)
+            cols, values = cols[keep], values[keep]
+            if len(values) > num_neighbors:
+                # 与第 N 高相似度相同的行都保留，排序后按文档序号截断
+                kth = values[np.argpartition(values, len(values) - num_neighbors)[len(values) - num_neighbors]]
+                keep = values >= kth
+                cols, values = cols[keep], values[keep]
+            order = np.lexsort((cols, -values))[:num_neighbors]
+            base = doc_ord * num_neighbors
+            neighbors[base:base + len(order)] = array('I', cols[order].tolist())
+            scores[base:base + len(order)] = array('f', values[order].tolist())
+    return neighbors, scores
+
+
+def _le_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_neighbor_table(doc_ids, neighbors, scores, num_neighbors, output_path):
+    """写出 nearest_neighbors() 的结果"""
+    with IndexWriter(output_path) as writer:
+        writer.add_section('similar:meta', _META.pack(num_neighbors))
+        writer.add_section('similar:neighbors', _le_bytes(neighbors))
+        writer.add_section('similar:scores', _le_bytes(scores))
+        writer.close(list(doc_ids))
+
+
+def build_similar_movies(file_paths, output_path, num_neighbors=DEFAULT_NUM_NEIGHBORS, block_size=DEFAULT_BLOCK_SIZE,
+                         max_df=DEFAULT_MAX_DF):
+    """
+    离线任务：读取源数据、计算近邻并写出近邻表
+    :param file_paths: JSON / JSONL 文件
+    :return: 电影数
+    """
+    reader = TextPreprocessor(remove_stop_words=False, apply_stemming=False)
+    documents = (document for file_path in file_paths for document in reader.iter_documents(file_path))
+    matrix, doc_ids = build_feature_matrix(documents, max_df=max_df)
+    neighbors, scores = nearest_neighbors(matrix, num_neighbors, block_size)
+    write_neighbor_table(doc_ids, neighbors, scores, num_neighbors, output_path)
+    return len(doc_ids)
+
+
+class SimilarMovies:
+    """读取近邻表，按文档ID直接定位相似电影"""
+
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as file:
+            reader = IndexReader(file.read())
+        if 'similar:meta' not in reader.sections:
+            raise ValueError(f"{file_path} is not a similar-movies table.")
+        self.doc_table = DocTable(reader.doc_ids)
+        self.num_neighbors, = _META.unpack(reader.section('similar:meta'))
+        self.neighbors = array('I')
+        self.neighbors.frombytes(reader.section('similar:neighbors'))
+        self.scores = array('f')
+        self.scores.frombytes(reader.section('similar:scores'))
+        if sys.byteorder == 'big':
+            self.neighbors.byteswap()
+            self.scores.byteswap()
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_table
+
+    def similar(self, doc_id, limit=None):
+        """
+        与一部电影最相似的电影
+        :param doc_id: 电影ID
+        :param limit: 最多返回的电影数，默认为表中保存的全部近邻
+        :return: [(doc_id, 相似度)]，按相似度从高到低排列；电影不在表中时返回 None
+        """
+        doc_ord = self.doc_table.get(doc_id)
+        if doc_ord < 0:
+            return None
+        count = self.num_neighbors if limit is None else max(0, min(limit, self.num_neighbors))
+        base = doc_ord * self.num_neighbors
+        doc_ids = self.doc_table.doc_ids
+        return [(doc_ids[neighbor], score)
+                for neighbor, score in zip(self.neighbors[base:base + count], self.scores[base:base + count])
+                if neighbor != NO_NEIGHBOR]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute nearest-neighbor lists of similar movies.')
+    parser.add_argument('inputs', nargs='+', help='source .json / .jsonl files, e.g. sample/*_sample.jsonl')
+    parser.add_argument('-o', '--output', default='index.similar', help='output path')
+    parser.add_argument('--neighbors', type=int, default=DEFAULT_NUM_NEIGHBORS,
+                        help=f'neighbors stored per movie (default: {DEFAULT_NUM_NEIGHBORS})')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help=f'rows per sparse matrix product (default: {DEFAULT_BLOCK_SIZE})')
+    parser.add_argument('--max-df', type=float, default=DEFAULT_MAX_DF,
+                        help=f'drop features found in more than this fraction of movies (default: {DEFAULT_MAX_DF})')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    num_docs = build_similar_movies(args.inputs, args.output, args.neighbors, args.block_size, args.max_df)
+    print(f"已计算 {num_docs} 部电影的 {args.neighbors} 个近邻 -> {args.output} "
+          f"({os.path.getsize(args.output) / 1e6:.1f} MB)，用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import math
+import struct
+import sys
+import time
+from array import array
+
+try:
+    from .index_format import IndexReader, IndexWriter
+    from .indexer import open_index
+    from .postings import DocTable
+    from .preprocessor import TextPreprocessor
+except ImportError:
+    from index_format import IndexReader, IndexWriter
+    from indexer import open_index
+    from postings import DocTable
+    from preprocessor import TextPreprocessor
+
+# 与查询无关的静态先验（热门程度）
+#
+# 每部电影一个 [0, 1] 的先验值，由源数据中的 IMDb 评分 score 与投票数 num_votes 计算：
+#   rating     = (v * R + m * C) / (v + m)      贝叶斯平均：投票很少的评分向全体平均分 C 收缩，m = PRIOR_MIN_VOTES
+#   popularity = ln(1 + v) / ln(1 + v_max)
+#   prior      = rating / 10 * popularity
+# 没有评分或投票数的电影先验为 0。
+#
+# 先验按文档序号存为稠密的 float32 数组，与索引放在一起（index.prior），沿用二进制索引的容器格式：
+#   文档表 | prior:meta  max(f64)，小端 | prior:values  按文档序号排列的先验值，小端 f32
+# 载入时整段读入（每篇文档 4 字节）；排序模型查询时按索引当前的文档表对齐（aligned），
+# 分段索引合并后文档序号重新分配，对齐结果随文档表更新。
+#
+# 查询时与相关度线性混合：score = relevance + weight * prior[d]，只有匹配查询的文档才加先验；
+# weight * max 是任何文档能从先验获得的得分上界，top-k 剪枝把它计入尚未出现的文档的上界
+# （见 models.TFIDFRetrieval.top_k 与 impact_index.ImpactRetrieval.top_k）。
+#
+# 用法：python static_prior.py index.bin sample/*_sample.jsonl -o index.prior
+
+PRIOR_MIN_VOTES = 1000
+_META = struct.Struct('<d')
+
+
+def parse_num_votes(num_votes):
+    """投票数：整数，或 '12K'、'1.5M' 形式的字符串，无法解析时返回 0"""
+    if num_votes is None or num_votes == '':
+        return 0
+    if isinstance(num_votes, (int, float)):
+        return max(int(num_votes), 0)
+    text = str(num_votes).strip().upper().replace(',', '')
+    scale = 1
+    if text.endswith('K'):
+        text, scale = text[:-1], 1000
+    elif text.endswith('M'):
+        text, scale = text[:-1], 1000000
+    try:
+        return max(int(float(text) * scale), 0)
+    except ValueError:
+        return 0
+
+
+def parse_score(score):
+    """IMDb 评分（0-10），无法解析时返回 None"""
+    if score is None or score == '':
+        return None
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        return None
+    return score if 0.0 <= score <= 10.0 else None
+
+
+def compute_priors(ratings, min_votes=PRIOR_MIN_VOTES):
+    """
+    由评分与投票数计算先验
+    :param ratings: [(评分或 None, 投票数)]
+    :param min_votes: 贝叶斯平均中全体平均分的权重（相当于多少张投票）
+    :return: array('f')，与 ratings 一一对应
+    """
+    rated = [(score, votes) for score, votes in ratings if score is not None and votes > 0]
+    total_votes = sum(votes for _, votes in rated)
+    mean = sum(score * votes for score, votes in rated) / total_votes if total_votes else 0.0
+    max_votes = max((votes for _, votes in rated), default=0)
+    priors = array('f')
+    for score, votes in ratings:
+        if score is None or votes <= 0:
+            priors.append(0.0)
+            continue
+        rating = (votes * score + min_votes * mean) / (votes + min_votes)
+        priors.append(rating / 10.0 * math.log1p(votes) / math.log1p(max_votes))
+    return priors
+
+
+def read_ratings(file_paths):
+    """
+    流式读取源数据中每部电影的评分与投票数
+    :param file_paths: JSON / JSONL 文件
+    :return: {doc_id: (评分或 None, 投票数)}
+    """
+    reader = TextPreprocessor(remove_stop_words=False, apply_stemming=False)
+    ratings = {}
+    for file_path in file_paths:
+        for document in reader.iter_documents(file_path):
+            ratings[document['id']] = (parse_score(document.get('score')), parse_num_votes(document.get('num_votes')))
+    return ratings
+
+
+def write_prior(doc_ids, ratings, output_path, min_votes=PRIOR_MIN_VOTES):
+    """
+    计算并写出与文档表对齐的先验
+    :param doc_ids: 索引文档表中的文档ID（按序号排列）
+    :param ratings: {doc_id: (评分或 None, 投票数)}，不在其中的文档先验为 0
+    :param output_path: 输出路径
+    :return: StaticPrior
+    """
+    priors = compute_priors([ratings.get(doc_id, (None, 0)) for doc_id in doc_ids], min_votes)
+    max_prior = max(priors, default=0.0)
+    values = array('f', priors)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    with IndexWriter(output_path) as writer:
+        writer.add_section('prior:meta', _META.pack(max_prior))
+        writer.add_section('prior:values', values.tobytes())
+        writer.close(list(doc_ids))
+    return StaticPrior(priors, doc_ids)
+
+
+class StaticPrior:
+    """按文档序号排列的静态先验"""
+
+    def __init__(self, values, doc_ids):
+        """
+        :param values: 按文档序号排列的先验值 array('f')
+        :param doc_ids: 与 values 对应的文档ID
+        """
+        self.values = values
+        self.doc_table = doc_ids if isinstance(doc_ids, DocTable) else DocTable(doc_ids)
+        self.max = float(max(values, default=0.0))
+        self._aligned = None  # 最近一次对齐的 (文档表, 文档数, StaticPrior)
+
+    @classmethod
+    def load(cls, file_path):
+        """读取 write_prior() 写出的文件，先验数组整段读入"""
+        with open(file_path, 'rb') as file:
+            reader = IndexReader(file.read())
+        if 'prior:meta' not in reader.sections:
+            raise ValueError(f"{file_path} is not a static prior file.")
+        values = array('f')
+        values.frombytes(reader.section('prior:values'))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        prior = cls(values, reader.doc_ids)
+        prior.max = _META.unpack(reader.section('prior:meta'))[0]
+        return prior
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, doc_ord):
+        """文档（按序号）的先验，序号超出范围时为 0"""
+        return self.values[doc_ord] if doc_ord < len(self.values) else 0.0
+
+    def get(self, doc_id):
+        """文档（按文档ID）的先验，不在文档表中时为 0"""
+        doc_ord = self.doc_table.get(doc_id)
+        return self.values[doc_ord] if doc_ord >= 0 else 0.0
+
+    def aligned(self, doc_table):
+        """
+        按另一个文档表的序号重新排列，文档表相同时返回自身；结果按文档表对象与大小缓存，每次查询调用的开销很小
+        :param doc_table: 索引当前的文档表（如 index.stats.doc_table）
+        """
+        cached = self._aligned
+        if cached is not None and cached[0] is doc_table and cached[1] == len(doc_table):
+            return cached[2]
+        if list(doc_table.doc_ids) == self.doc_table.doc_ids:
+            prior = self
+        else:
+            prior = StaticPrior(array('f', map(self.get, doc_table.doc_ids)), doc_table)
+            prior.max = self.max  # 上界保持不变，仍然成立
+        self._aligned = (doc_table, len(doc_table), prior)
+        return prior
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute a static popularity prior from IMDb score and num_votes.')
+    parser.add_argument('index', help='text / binary index file or segmented index directory')
+    parser.add_argument('inputs', nargs='+', help='source .json / .jsonl files with score and num_votes')
+    parser.add_argument('-o', '--output', default='index.prior', help='output path')
+    parser.add_argument('--min-votes', type=int, default=PRIOR_MIN_VOTES,
+                        help=f'votes weight of the global mean rating (default: {PRIOR_MIN_VOTES})')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    doc_ids = open_index(args.index).stats.doc_table.doc_ids
+    prior = write_prior(doc_ids, read_ratings(args.inputs), args.output, args.min_votes)
+    print(f"已写入 {len(prior)} 篇文档的先验（最大值 {prior.max:.3f}） -> {args.output}，"
+          f"用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
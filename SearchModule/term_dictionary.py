@@ -0,0 +1,177 @@
+import heapq
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+try:
+    from .postings import intersect_many
+except ImportError:
+    from postings import intersect_many
+
+# 前缀、通配符与模糊查询的词项展开
+#
+# 每个字段一个 TermDictionary：有序词项数组及对应的 df。
+#   前缀（termin*）  在有序数组上二分查找出连续的区间
+#   通配符（*punk、ter*tor）  用 k-gram 索引取候选：把 '$词项$' 的所有 k-gram 映射到含有它的词项下标，
+#                  对模式中各段（首段前加 '$'，末段后加 '$'）的 k-gram 求交，再用正则过滤掉误匹配
+#   模糊（arnld~） 同一个 k-gram 索引：编辑距离不超过 d 的两个词至少共有 |G(词)| - k*d 个 k-gram，
+#                  先按共有 k-gram 的数量筛选候选，再用有上界的 Levenshtein 距离验证
+# 展开结果按 df 从高到低最多保留 max_expansions 个词项，词表很大时查询的代价也有上界；
+# 模糊匹配另有时间预算（deadline），超时后返回已找到的词项。
+# 通配符模式只做小写化，不做词干提取，直接与索引中的词项（已提取词干）比较。
+
+KGRAM_SIZE = 3
+MAX_EXPANSIONS = 50
+_DEADLINE_CHECK_INTERVAL = 256  # 模糊匹配每验证这么多个候选检查一次是否超时
+
+
+def kgrams(text, k=KGRAM_SIZE):
+    """文本中所有长度为 k 的子串"""
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def auto_distance(term):
+    """按词长决定允许的编辑距离：1-2 个字符不允许，3-5 个字符 1，更长 2"""
+    if len(term) < 3:
+        return 0
+    return 1 if len(term) < 6 else 2
+
+
+def bounded_levenshtein(a, b, max_distance):
+    """
+    a 与 b 的编辑距离（插入、删除、替换），超过 max_distance 时提前结束
+    :return: 编辑距离，超过 max_distance 时返回 max_distance + 1
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+class TermDictionary:
+    """单个字段的有序词项数组与 k-gram 索引"""
+
+    def __init__(self, terms, dfs, k=KGRAM_SIZE):
+        """
+        :param terms: 按字典序排列的词项
+        :param dfs: 与 terms 一一对应的文档频率
+        :param k: k-gram 的长度
+        """
+        self.terms = terms
+        self.dfs = dfs
+        self.k = k
+        self._kgrams = None  # {k-gram: array('I') 词项下标}，首次遇到非前缀的通配符或模糊查询时才构建
+
+    @classmethod
+    def from_field_index(cls, field_index):
+        """
+        由字段索引构建：二进制索引直接使用其有序词典；分段索引合并各段词典，
+        df 取各段之和（含已删除的文档，只用于排序）；内存索引对词项排序
+        """
+        dictionary = getattr(field_index, 'dictionary', None)
+        if dictionary is not None:
+            return cls(dictionary.terms, dictionary.dfs)
+        segments = getattr(field_index, 'segments', None)
+        if segments is not None:
+            dfs = defaultdict(int)
+            for segment in segments:
+                if field_index.field not in segment.index.index:  # 该段没有这个字段（LazyIndex 对缺少的字段返回 {}）
+                    continue
+                segment_field = segment.index.index[field_index.field]
+                for term, df in zip(segment_field.dictionary.terms, segment_field.dictionary.dfs):
+                    dfs[term] += df
+            terms = sorted(dfs)
+            return cls(terms, array('I', map(dfs.__getitem__, terms)))
+        terms = sorted(field_index)
+        return cls(terms, array('I', (len(field_index[term]) for term in terms)))
+
+    def prefix_range(self, prefix):
+        """以 prefix 开头的词项在有序数组中的下标区间 [lo, hi)"""
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_left(self.terms, prefix + '\U0010ffff', lo)
+        return lo, hi
+
+    def kgram_index(self):
+        if self._kgrams is None:
+            index = defaultdict(lambda: array('I'))
+            for i, term in enumerate(self.terms):
+                for gram in kgrams(f'${term}$', self.k):
+                    index[gram].append(i)
+            self._kgrams = dict(index)
+        return self._kgrams
+
+    def expand(self, pattern, max_expansions=MAX_EXPANSIONS):
+        """
+        展开含 '*' 的模式
+        :param pattern: 如 'termin*'、'*punk'、'ter*tor'
+        :param max_expansions: 最多返回的词项数
+        :return: 匹配的词项，按 df 从高到低排列
+        """
+        pattern = pattern.lower()
+        pieces = pattern.split('*')
+        if not ''.join(pieces):
+            return []  # 只有 '*'，不展开为整个词表
+        lo, hi = self.prefix_range(pieces[0])
+        if len(pieces) == 2 and not pieces[1]:
+            candidates = range(lo, hi)  # 纯前缀：区间内的词项全部匹配
+        else:
+            anchored = [f'${pieces[0]}'] + pieces[1:-1] + [f'{pieces[-1]}$']
+            grams = set().union(*(kgrams(piece, self.k) for piece in anchored))
+            if grams:
+                index = self.kgram_index()
+                candidates = intersect_many([index.get(gram, ()) for gram in grams])
+                if pieces[0]:
+                    candidates = [i for i in candidates if lo <= i < hi]
+            else:
+                candidates = range(lo, hi)  # 各段都短于 k：在前缀区间（可能是整个词表）内逐个检查
+            regex = re.compile('.*'.join(map(re.escape, pieces)), re.DOTALL)
+            terms = self.terms
+            candidates = [i for i in candidates if regex.fullmatch(terms[i])]
+        best = heapq.nlargest(max_expansions, candidates, key=self.dfs.__getitem__)
+        return [self.terms[i] for i in best]
+
+    def fuzzy(self, term, max_distance, limit=MAX_EXPANSIONS, deadline=None):
+        """
+        查找与 term 的编辑距离不超过 max_distance 的词项
+        :param term: 预处理后的查询词
+        :param max_distance: 最大编辑距离
+        :param limit: 最多返回的词项数
+        :param deadline: time.perf_counter() 的截止时刻，超时后返回已找到的词项
+        :return: [(编辑距离, 词项)]，按距离从小到大、df 从高到低排列
+        """
+        if max_distance <= 0:
+            lo, hi = self.prefix_range(term)
+            return [(0, term)] if lo < hi and self.terms[lo] == term else []
+        grams = kgrams(f'${term}$', self.k)
+        threshold = len(grams) - self.k * max_distance
+        if threshold > 0:
+            counts = Counter()
+            index = self.kgram_index()
+            for gram in grams:
+                counts.update(index.get(gram, ()))
+            candidates = [i for i, count in counts.items() if count >= threshold]
+        else:
+            candidates = range(len(self.terms))  # 词太短，k-gram 筛选无效：逐个检查，受时间预算限制
+        terms, dfs = self.terms, self.dfs
+        matches = []
+        for checked, i in enumerate(candidates):
+            if deadline is not None and checked % _DEADLINE_CHECK_INTERVAL == 0 and time.perf_counter() > deadline:
+                break
+            candidate = terms[i]
+            if abs(len(candidate) - len(term)) > max_distance:
+                continue
+            distance = bounded_levenshtein(term, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, -dfs[i], candidate))
+        return [(distance, candidate) for distance, _, candidate in heapq.nsmallest(limit, matches)]
@@ -1,4 +1,10 @@
-from indexer import PositionalInvertedIndex
+import json
+import random
+
+from build_index import build_index
+from indexer import PositionalInvertedIndex, MergedFieldsView, convert_index
+from mmap_index import MmapInvertedIndex
+from preprocessor import TextPreprocessor
 
 def test_load_index():
     # 创建倒排索引对象
@@ -24,5 +30,152 @@ def test_load_index():
     assert 'kyozetsu' in title_index, "Expected term 'kyozetsu' not found in title index"
     assert 'some_plot_term' in plot_index, "Expected term 'some_plot_term' not found in plot index"  # 替换为实际的术语
 
+def build_sample_index():
+    # 构建一个小型的多字段索引
+    index = PositionalInvertedIndex()
+    index.build_index({
+        'tt0000001': {'title': ['taitoru', 'kyozetsu'], 'plot': ['group', 'friend', 'group']},
+        'tt0000002': {'title': ['kyozetsu'], 'plot': ['friend'] * 200},
+        'tt0000003': {'title': [], 'plot': ['haunt', 'hous', 'group']},
+    })
+    return index
+
+
+def as_plain_dict(index):
+    return {field: {term: dict(docs) for term, docs in terms.items()} for field, terms in index.index.items()}
+
+
+def test_binary_round_trip(tmp_path):
+    index = build_sample_index()
+    path = str(tmp_path / 'index.bin')
+    index.save_index(path, fmt='binary')
+
+    loaded = PositionalInvertedIndex()
+    loaded.load_index(path)
+    assert as_plain_dict(loaded) == as_plain_dict(index)
+    assert loaded.index['plot']['friend']['tt0000002'] == list(range(200))
+
+
+def test_convert_text_to_binary(tmp_path):
+    text_path = str(tmp_path / 'index.txt')
+    binary_path = str(tmp_path / 'index.bin')
+    index = build_sample_index()
+    index.save_index(text_path)
+
+    convert_index(text_path, binary_path)
+    loaded = PositionalInvertedIndex()
+    loaded.load_index(binary_path)
+    assert as_plain_dict(loaded) == as_plain_dict(index)
+
+
+def test_mmap_index_matches_loaded_index(tmp_path):
+    index = build_sample_index()
+    path = str(tmp_path / 'index.bin')
+    index.save_index(path, fmt='binary')
+
+    mapped = MmapInvertedIndex(path)
+    assert mapped.num_docs == 3
+    assert as_plain_dict(mapped) == as_plain_dict(index)
+    assert 'missing' not in mapped.index['plot']
+    assert mapped.index['genre'] == {}
+
+    # 合并视图与逐项复制出的 retrieval_index 一致
+    merged = MergedFieldsView(mapped.index)
+    assert dict(merged['kyozetsu']) == {'tt0000001': [1], 'tt0000002': [0]}
+    assert 'missing' not in merged
+    mapped.close()
+
+
+def test_postings_use_doc_ordinals(tmp_path):
+    index = build_sample_index()
+    friend = index.index['plot']['friend']
+    assert list(friend.doc_ords) == [0, 1]
+    assert friend.tf_at(1) == 200
+    assert friend.find(index.doc_table.get('tt0000003')) == -1
+
+    # 文本格式中文档的出现顺序与序号无关，加载后仍按序号有序
+    path = str(tmp_path / 'index.txt')
+    index.save_index(path)
+    loaded = PositionalInvertedIndex()
+    loaded.load_index(path)
+    for terms in loaded.index.values():
+        for postings in terms.values():
+            assert list(postings.doc_ords) == sorted(postings.doc_ords)
+    assert as_plain_dict(loaded) == as_plain_dict(index)
+
+
+def test_collection_stats_persisted(tmp_path):
+    index = build_sample_index()
+    stats = index.stats
+    assert stats.num_docs == 3
+    assert stats.doc_field_length('plot', 'tt0000002') == 200
+    assert stats.doc_field_length('title', 'tt0000003') == 0
+    assert stats.avg_field_length('title') == 1.0
+    assert stats.df('plot', 'group') == 2
+    assert stats.df('plot', 'missing') == 0
+
+    binary_path = str(tmp_path / 'index.bin')
+    text_path = str(tmp_path / 'index.txt')
+    index.save_index(binary_path, fmt='binary')
+    index.save_index(text_path)
+    loaded_binary = PositionalInvertedIndex()
+    loaded_binary.load_index(binary_path)
+    loaded_text = PositionalInvertedIndex()
+    loaded_text.load_index(text_path)
+    mapped = MmapInvertedIndex(binary_path)
+    for other in (loaded_binary.stats, loaded_text.stats, mapped.stats):
+        for field in ('title', 'plot'):
+            assert other.total_lengths[field] == stats.total_lengths[field]
+            for doc_id in ('tt0000001', 'tt0000002', 'tt0000003'):
+                assert other.doc_field_length(field, doc_id) == stats.doc_field_length(field, doc_id)
+    assert mapped.stats.df('plot', 'group') == 2
+    # 词项最大词频随二进制索引保存，供 top-k 检索计算得分上界
+    assert mapped.index['plot'].dictionary.max_tfs is not None
+    for other in (stats, mapped.stats):
+        assert other.max_tf('plot', 'friend') == 200
+        assert other.max_tf('plot', 'group') == 2
+        assert other.max_tf('plot', 'missing') == 0
+    mapped.close()
+
+
+
+def test_parallel_build_matches_in_memory_index(tmp_path):
+    rng = random.Random(3)
+    words = ['heist', 'banks', 'aliens', 'spaceship', 'jungle', 'robots', 'detective', 'murdered', 'city', 'friends']
+    corpus = str(tmp_path / 'corpus.jsonl')
+    updates = str(tmp_path / 'updates.jsonl')
+    # 第二个文件中重复出现的电影（以及同一文件中的重复行）以最后一个版本为准
+    doc_ords = list(range(40)) + [5, 5, 31]
+    for path, ords in ((corpus, doc_ords[:41]), (updates, doc_ords[41:] + [40])):
+        with open(path, 'w', encoding='utf-8') as file:
+            for i in ords:
+                file.write(json.dumps({
+                    'id': f'tt{i:07d}', 'title': ' '.join(rng.sample(words, 2)), 'director': f'director {i % 7}',
+                    'cast_character': {f'actor {rng.randint(0, 9)}': ''},
+                    'plot': ' '.join(rng.choice(words) for _ in range(rng.randint(0, 15))) + ' café',
+                }) + '\n')
+
+    # 两个工作进程各处理一段字节范围，每 3 个文档写出一个部分索引，再 k 路归并
+    output = str(tmp_path / 'index.bin')
+    runs = build_index([corpus, updates], output, workers=2, block_size=3)
+    assert len(runs) > 2
+
+    preprocessor = TextPreprocessor(remove_stop_words=True, apply_stemming=True)
+    expected = PositionalInvertedIndex()
+    expected.build_index(dict(item for path in (corpus, updates) for item in preprocessor.iter_processed(path)))
+    mapped = MmapInvertedIndex(output)
+    assert mapped.num_docs == expected.num_docs == 41
+    assert sorted(mapped.doc_ids) == sorted(expected.doc_ids)
+    assert as_plain_dict(mapped) == as_plain_dict(expected)
+    for field in expected.index:
+        assert mapped.stats.total_lengths[field] == expected.stats.total_lengths[field]
+        for doc_id in expected.doc_ids:
+            assert mapped.stats.doc_field_length(field, doc_id) == expected.stats.doc_field_length(field, doc_id)
+        for term in expected.index[field]:
+            assert mapped.stats.df(field, term) == expected.stats.df(field, term)
+            assert mapped.stats.max_tf(field, term) == expected.stats.max_tf(field, term)
+    mapped.close()
+
+
 if __name__ == "__main__":
     test_load_index() 
\ No newline at end of file
@@ -0,0 +1,49 @@
+import json
+
+from preprocessor import StemCache, iter_json_array
+
+
+def test_iter_json_array_matches_json_load(tmp_path):
+    documents = [
+        {'id': f'tt{i:07d}', 'title': f'Movie {i}', 'plot': 'A [group] of "friends", ' * i}
+        for i in range(50)
+    ]
+    path = tmp_path / 'movies.json'
+    path.write_text(json.dumps(documents, indent=2), encoding='utf-8')
+
+    # 缓冲区远小于单个文档时也能正确拼接
+    assert list(iter_json_array(str(path), chunk_size=7)) == documents
+    assert list(iter_json_array(str(path))) == documents
+
+
+def test_iter_json_array_empty(tmp_path):
+    path = tmp_path / 'empty.json'
+    path.write_text(' [ ]\n', encoding='utf-8')
+    assert list(iter_json_array(str(path))) == []
+
+
+def test_stem_cache_counts_and_bounds():
+    from nltk.stem import PorterStemmer
+
+    cache = StemCache(PorterStemmer(), maxsize=2)
+    tokens = ['running', 'runs', 'running', 'haunted', 'running']
+    assert cache.stem_tokens(tokens) == [PorterStemmer().stem(token) for token in tokens]
+    assert cache.info() == {'hits': 2, 'misses': 3, 'size': 2, 'maxsize': 2}
+
+    restored = StemCache(PorterStemmer())
+    restored.preload(json.loads(cache.to_bytes()))
+    assert dict(restored) == dict(cache)
+
+
+def test_tokenize_with_offsets_matches_process_text():
+    from preprocessor import TextPreprocessor
+
+    text = "Sci-fi thriller: the HAUNTED house's owners, 2024_remake!"
+    for remove_stop_words in (True, False):
+        for apply_stemming in (True, False):
+            preprocessor = TextPreprocessor(remove_stop_words=remove_stop_words, apply_stemming=apply_stemming)
+            tokens = preprocessor.tokenize_with_offsets(text)
+            assert [term for term, _, _ in tokens] == preprocessor.process_text(text)
+    preprocessor = TextPreprocessor()
+    for term, start, end in preprocessor.tokenize_with_offsets(text):
+        assert preprocessor.process_text(text[start:end]) == [term]
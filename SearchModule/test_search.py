@@ -0,0 +1,479 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from docset import DocBitmap
+from impact_index import ImpactIndex, ImpactRetrieval, write_impact_index
+from indexer import MergedFieldsView, PositionalInvertedIndex
+from lsa_index import HybridRetrieval, LSARetrieval, build_lsa_index
+from models import BM25FRetrieval, TFIDFRetrieval
+from postings import gallop, intersect_many, intersect_sorted
+from query_parser import (AndQuery, FuzzyQuery, NotQuery, OrQuery, PhraseQuery, TermQuery, WildcardQuery,
+                          is_boolean_query, normalized_query, parse_boolean_query)
+from result_cache import QueryResultCache
+from search import QueryProcessor, match_phrase_spans
+from segments import SegmentedIndex
+from similar_movies import SimilarMovies, build_feature_matrix, nearest_neighbors, write_neighbor_table
+from sparse_scoring import SparseTFIDFRetrieval
+from static_prior import StaticPrior, compute_priors, parse_num_votes, write_prior
+
+
+class IdentityPreprocessor:
+    def process_text(self, text):
+        return text.lower().split()
+
+
+def build_processor(use_bitmaps=True):
+    index = PositionalInvertedIndex()
+    index.build_index({
+        'tt1': {'title': ['alien'], 'plot': ['space', 'station', 'crew']},
+        'tt2': {'title': ['predator'], 'plot': ['jungle', 'crew']},
+        'tt3': {'title': ['alien', 'resurrection'], 'plot': ['space', 'crew', 'clone']},
+        'tt4': {'title': ['heat'], 'plot': ['heist', 'crew']},
+    })
+    return QueryProcessor(index, IdentityPreprocessor(), use_bitmaps=use_bitmaps)
+
+
+def test_parse_precedence_fields_and_phrases():
+    node = parse_boolean_query('title:(alien OR predator) AND NOT plot:"space station" heat')
+    assert isinstance(node, AndQuery)
+    first, second, third = node.children
+    assert isinstance(first, OrQuery)
+    assert [(child.field, child.text) for child in first.children] == [('title', 'alien'), ('title', 'predator')]
+    assert isinstance(second, NotQuery) and isinstance(second.child, PhraseQuery)
+    assert (second.child.field, second.child.text) == ('plot', 'space station')
+    assert isinstance(third, TermQuery) and third.field == 'title'
+
+    # AND 的优先级高于 OR
+    node = parse_boolean_query('a OR b AND c')
+    assert isinstance(node, OrQuery) and isinstance(node.children[1], AndQuery)
+    # 括号不匹配时不抛出异常
+    assert parse_boolean_query('(alien OR predator') is not None
+    assert parse_boolean_query('') is None
+
+
+def test_boolean_queries():
+    qp = build_processor()
+    assert qp.query('title:alien') == {'tt1', 'tt3'}
+    assert qp.query('title:(alien OR predator) AND NOT plot:"space station"') == {'tt2', 'tt3'}
+    assert qp.query('NOT plot:crew') == set()
+    assert qp.query('NOT title:alien') == {'tt2', 'tt4'}
+    assert qp.query('plot:crew AND (title:heat OR plot:clone)') == {'tt3', 'tt4'}
+    assert qp.query('title:missing AND plot:crew') == set()
+
+
+def test_planner_orders_and_by_df():
+    qp = build_processor()
+    node = qp.plan(parse_boolean_query('plot:crew AND NOT title:heat AND title:predator'))
+    assert [type(child) for child in node.children] == [TermQuery, TermQuery, NotQuery]
+    assert node.children[0].text == 'predator'
+    assert qp.evaluate(node) == {'tt2'}
+
+
+def test_phrase_matching_is_exact():
+    index = PositionalInvertedIndex()
+    index.build_index({
+        'tt1': {'plot': ['new', 'york', 'new', 'york', 'citi']},
+        'tt2': {'plot': ['new', 'new', 'york']},
+        'tt3': {'plot': ['york', 'citi', 'new']},  # 三个词都出现，但不相邻
+        'tt4': {'plot': ['citi', 'new', 'york', 'citi']},
+    })
+    qp = QueryProcessor(index, IdentityPreprocessor())
+    assert qp.phrase_search('new york citi', target_field='plot') == {'tt1', 'tt4'}
+    assert qp.phrase_search('new new york') == {'tt2'}
+    assert qp.phrase_search('york') == {'tt1', 'tt2', 'tt3', 'tt4'}
+    assert qp.phrase_search('new york', candidates={'tt2', 'tt3'}) == {'tt2'}
+    assert match_phrase_spans([([0, 7], 0, 2), ([3, 8], 0, 2), ([9], 0, 1)])
+    assert not match_phrase_spans([([0, 7], 0, 2), ([1, 9], 0, 2), ([9], 0, 1)])
+
+
+def test_proximity_and_ordered_window():
+    index = PositionalInvertedIndex()
+    index.build_index({
+        'tt1': {'title': ['bank'], 'plot': ['heist', 'at', 'the', 'bank']},
+        'tt2': {'title': ['heist'], 'plot': ['bank', 'robbery', 'heist']},
+        'tt3': {'plot': ['heist'] + ['filler'] * 10 + ['bank']},
+        'tt4': {'plot': ['heist', 'crew', 'heist']},
+    })
+    qp = QueryProcessor(index, IdentityPreprocessor())
+    assert qp.query('plot:#3(heist,bank)') == {'tt1', 'tt2'}
+    assert qp.query('plot:#od3(heist,bank)') == {'tt1'}
+    assert qp.query('plot:#od3(bank,heist)') == {'tt2'}
+    assert qp.query('#11(heist, bank)') == {'tt1', 'tt2', 'tt3'}
+    # 同一个词需要两次不同的出现
+    assert qp.query('plot:#2(heist,heist)') == {'tt4'}
+    # 跨字段的两个词不算邻近
+    assert qp.query('#1(bank,heist) AND NOT plot:robbery') == set()
+
+
+def test_galloping_intersection():
+    rng = random.Random(7)
+    for _ in range(200):
+        lists = [sorted(rng.sample(range(500), rng.randint(0, 200))) for _ in range(3)]
+        expected = sorted(set(lists[0]) & set(lists[1]))
+        assert intersect_sorted(lists[0], lists[1]) == expected
+        assert intersect_sorted(lists[1], lists[0]) == expected
+        assert intersect_many(lists) == sorted(set(lists[0]) & set(lists[1]) & set(lists[2]))
+        target = rng.randint(0, 510)
+        lo = rng.randint(0, len(lists[0]))
+        i = gallop(lists[0], target, lo)
+        assert i >= lo and all(x < target for x in lists[0][lo:i])
+        assert i == len(lists[0]) or lists[0][i] >= target
+
+
+def test_bitmap_doc_sets():
+    qp = build_processor()
+    doc_table = qp.source.doc_table
+    crew = DocBitmap.from_ords(doc_table, [[0, 1, 2, 3]])
+    space = DocBitmap.from_doc_ids(doc_table, ['tt1', 'tt3'])
+    assert crew - space == {'tt2', 'tt4'} and len(crew & space) == 2
+    assert space | {'tt4'} == {'tt1', 'tt3', 'tt4'}
+    assert {'tt1', 'tt2', 'nope'} - space == {'tt2', 'nope'}
+    assert {'tt2', 'tt3'} & space == {'tt3'} and not (space - crew)
+
+    # 高频词与 NOT 的全集使用位图，结果与集合求值一致
+    assert isinstance(qp.query('plot:crew'), DocBitmap)
+    with_sets = build_processor(use_bitmaps=False)
+    for query in ('plot:crew AND NOT plot:space', 'NOT title:alien', 'plot:space OR plot:heist',
+                  'NOT (plot:crew)', 'plot:crew AND "space crew"', 'NOT plot:crew OR title:heat'):
+        assert set(qp.query(query)) == with_sets.query(query), query
+
+
+def test_query_result_cache():
+    qp = build_processor()
+    key = normalized_query(qp.prepare('title:Alien AND (plot:crew OR plot:space)'))
+    assert key == normalized_query(qp.prepare('(plot:space OR plot:crew) title:alien'))
+    assert key != normalized_query(qp.prepare('title:alien AND NOT (plot:crew OR plot:space)'))
+
+    now = [0.0]
+    cache = QueryResultCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    version = qp.source.version
+    assert cache.get_or_compute(key, version, lambda: ['tt1', 'tt3']) == ['tt1', 'tt3']
+    assert cache.get_or_compute(key, version, lambda: []) == ['tt1', 'tt3']
+    cache.put('b', version, ['tt2'])
+    cache.put('c', version, ['tt4'])  # 超过容量，淘汰最久未使用的条目
+    assert cache.get(key, version) is None and cache.get('c', version) == ['tt4']
+    now[0] = 11.0  # 过期
+    assert cache.get('b', version) is None
+    cache.put('c', version, ['tt4'])
+    qp.source.build_index({'tt5': {'title': ['alien'], 'plot': []}})  # 新的索引版本使缓存失效
+    assert qp.source.version != version and cache.get('c', qp.source.version) is None
+    info = cache.info()
+    assert (info['hits'], info['evictions'], info['expirations'], info['invalidations']) == (2, 1, 1, 1)
+
+
+def test_prefix_and_wildcard_queries(tmp_path):
+    node = parse_boolean_query('title:termin* alien')
+    assert isinstance(node, OrQuery)
+    assert isinstance(node.children[0], TermQuery) and isinstance(node.children[1], WildcardQuery)
+    assert is_boolean_query('termin*') and is_boolean_query('plot:*punk') and not is_boolean_query('alien')
+
+    qp = build_processor()
+    qp.source.build_index({
+        'tt5': {'title': ['alienist'], 'plot': ['cyberpunk', 'crew']},
+        'tt6': {'title': ['aliens'], 'plot': ['steampunk', 'station']},
+    })
+    assert qp.query('title:alien*') == {'tt1', 'tt3', 'tt5', 'tt6'}
+    assert qp.query('plot:*punk') == {'tt5', 'tt6'}
+    assert qp.query('plot:st*on') == {'tt1', 'tt6'}
+    assert qp.query('plot:*punk AND NOT plot:crew') == {'tt6'}
+    assert qp.query('plot:*') == set()
+    # 展开按 df 从高到低截断
+    assert qp.expand_wildcard('plot', 'c*') == ['crew', 'clone', 'cyberpunk']
+    qp.max_expansions = 1
+    assert qp.expand_wildcard('plot', 'c*') == ['crew']
+
+    # 分段索引：某些段中没有被查询的字段
+    segmented = SegmentedIndex(str(tmp_path / 'segments'))
+    segmented.add_documents({'a': {'title': ['x'], 'director': ['nolan']}}, compact=False)
+    segmented.add_documents({'b': {'title': ['y']}}, compact=False)
+    segmented_qp = QueryProcessor(segmented, IdentityPreprocessor())
+    segmented_qp.build_term_dictionaries()
+    assert segmented_qp.query('director:nol*') == {'a'}
+
+
+def test_fuzzy_term_lookup(tmp_path):
+    node = parse_boolean_query('title:aliens~1 predator')
+    assert isinstance(node, OrQuery) and isinstance(node.children[1], FuzzyQuery)
+    assert node.children[1].distance == 1 and is_boolean_query('alein~')
+
+    qp = build_processor()
+    assert qp.query('title:alen~') == {'tt1', 'tt3'}
+    assert qp.query('title:alein~') == set() and qp.query('title:alein~2') == {'tt1', 'tt3'}
+    assert qp.query('title:predatr~ OR title:heet~1') == {'tt2', 'tt4'}
+    assert qp.query('title:predatr~0') == set()
+    assert qp.fuzzy_terms('crwe', max_distance=2) == ['crew']  # 交换相邻字符为两次编辑
+    assert qp.fuzzy_terms('crwe') == [] and qp.fuzzy_terms('cew') == ['crew']
+
+    # 排序检索：不在索引中的词用相近的词项代替，不再生成虚假的文档
+    retrieval = TFIDFRetrieval(MergedFieldsView(qp.index), qp.preprocessor, num_docs=4,
+                               fuzzy=lambda term, deadline: qp.fuzzy_terms(term, deadline=deadline))
+    assert {doc_id for doc_id, _ in retrieval.compute_tfidf_scores('predatr')} == {'tt2'}
+    assert retrieval.compute_tfidf_scores('zzzzzz') == []
+
+    # 分段索引：某些段中没有被查询的字段，布尔与排序检索的模糊查找都合并各段的词典
+    segmented = SegmentedIndex(str(tmp_path / 'segments'))
+    segmented.add_documents({'a': {'title': ['x'], 'director': ['nolan']}}, compact=False)
+    segmented.add_documents({'b': {'title': ['y']}}, compact=False)
+    segmented_qp = QueryProcessor(segmented, IdentityPreprocessor())
+    assert segmented_qp.query('director:nolen~1') == {'a'}
+    segmented_retrieval = TFIDFRetrieval(MergedFieldsView(segmented.index), IdentityPreprocessor(), source=segmented,
+                                         fuzzy=lambda term, deadline: segmented_qp.fuzzy_terms(term, deadline=deadline))
+    assert [doc_id for doc_id, _ in segmented_retrieval.compute_tfidf_scores('nolen')] == ['a']
+
+
+def test_bm25f_field_weights_and_length_normalization():
+    index = PositionalInvertedIndex()
+    index.build_index({
+        'tt1': {'title': ['heat'], 'plot': ['crew']},
+        'tt2': {'title': ['crew'], 'plot': ['heat']},
+        'tt3': {'title': ['other'], 'plot': ['heat', 'crew', 'bank', 'city', 'night', 'car']},
+        'tt4': {'title': ['none'], 'plot': ['bank']},
+    })
+    model = BM25FRetrieval(index.index, IdentityPreprocessor(), index.stats)
+    # 标题命中权重更高；同样命中一次剧情时，剧情较短的文档得分更高
+    assert [doc_id for doc_id, _ in model.compute_bm25f_scores('heat')] == ['tt1', 'tt2', 'tt3']
+    scores = dict(model.compute_bm25f_scores('heat'))
+    plot_tf = 1.0 / (0.25 + 0.75 * 1 / 2.25)
+    assert abs(scores['tt2'] - math.log(1 + 1.5 / 3.5) * plot_tf / (1.2 + plot_tf)) < 1e-12
+    assert model.compute_bm25f_scores('missing') == []
+    assert BM25FRetrieval(index.index, IdentityPreprocessor(), index.stats,
+                          field_weights={'plot': 1.0}).compute_bm25f_scores('crew')[0][0] == 'tt1'
+
+
+def build_random_index():
+    index = PositionalInvertedIndex()
+    rng = random.Random(7)
+    vocabulary = ['crew', 'space', 'heist', 'alien', 'city', 'night', 'bank', 'clone', 'jungle', 'station']
+    index.build_index({
+        f'tt{i}': {
+            'title': rng.sample(vocabulary, 1),
+            'plot': [rng.choice(vocabulary[:6]) for _ in range(rng.randint(1, 12))] + rng.sample(vocabulary, 2),
+        }
+        for i in range(200)
+    })
+    return index
+
+
+def test_top_k_matches_exhaustive_ranking():
+    index = build_random_index()
+    retrieval = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), stats=index.stats)
+    queries = ['crew', 'crew space heist', 'alien city night bank clone jungle', 'crew crew station', 'missing crew']
+    for query in queries:
+        for k in (1, 3, 10, 500):
+            assert retrieval.top_k(query, k) == retrieval.compute_tfidf_scores(query)[:k]
+    assert retrieval.top_k('missing', 10) == [] and retrieval.top_k('crew', 0) == []
+
+
+def test_sparse_matrix_scoring_matches_tfidf(tmp_path):
+    index = build_random_index()
+    retrieval = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), stats=index.stats)
+    path = str(tmp_path / 'index.tfidf.npz')
+    SparseTFIDFRetrieval.from_index(index, IdentityPreprocessor()).save(path)
+    sparse_retrieval = SparseTFIDFRetrieval.load(path, IdentityPreprocessor())
+
+    queries = ['crew', 'crew space heist', 'alien city night bank clone jungle', 'crew crew station', 'missing']
+    batch = sparse_retrieval.score_batch(queries)
+    for query, batch_scores in zip(queries, batch):
+        expected = retrieval.compute_tfidf_scores(query)
+        scores = sparse_retrieval.compute_tfidf_scores(query)
+        assert scores == batch_scores
+        assert [doc_id for doc_id, _ in scores] == [doc_id for doc_id, _ in expected]
+        assert all(math.isclose(a, b, rel_tol=1e-12) for (_, a), (_, b) in zip(scores, expected))
+        assert sparse_retrieval.top_k(query, 5) == scores[:5]
+
+
+def test_impact_ordered_index(tmp_path):
+    index = build_random_index()
+    path = str(tmp_path / 'index.impact')
+    write_impact_index(index, path)
+    impact_index = ImpactIndex(path)
+    # 每个词项的段按影响值从高到低排列，段内文档序号递增，合起来就是该词项的全部文档
+    segments = list(impact_index.segments('crew'))
+    assert list(impact_index.impacts[segments[0]:segments[-1] + 1]) == sorted(
+        impact_index.impacts[segments[0]:segments[-1] + 1], reverse=True)
+    ords = [doc_ord for i in segments for doc_ord in impact_index.segment_ords(i)]
+    assert sorted(ords) == list(MergedFieldsView(index.index)['crew'].doc_ords)
+
+    retrieval = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), stats=index.stats)
+    impact_retrieval = ImpactRetrieval(impact_index, IdentityPreprocessor())
+    for query in ['crew', 'crew space heist', 'alien city night bank clone jungle', 'crew crew station']:
+        full = impact_retrieval.compute_scores(query)
+        for k in (1, 3, 10):
+            assert impact_retrieval.top_k(query, k) == full[:k]
+        # 量化后的得分与 TF-IDF 得分的相对误差在一个量化级之内
+        expected = dict(retrieval.compute_tfidf_scores(query))
+        assert {doc_id for doc_id, _ in full} == expected.keys()
+        assert all(abs(score - expected[doc_id]) <= 0.05 * expected[doc_id] for doc_id, score in full)
+    assert impact_retrieval.top_k('missing', 10) == []
+    impact_index.close()
+
+    # 影响值最多 16 位（载入后存放在 array('H') 中）
+    write_impact_index(index, str(tmp_path / 'index16.impact'), bits=16)
+    ImpactIndex(str(tmp_path / 'index16.impact')).close()
+    for bits in (0, 17):
+        with pytest.raises(ValueError):
+            write_impact_index(index, str(tmp_path / 'invalid.impact'), bits=bits)
+
+
+def test_cursor_pages_match_full_ranking(tmp_path):
+    index = build_random_index()
+    write_impact_index(index, str(tmp_path / 'index.impact'))
+    tfidf = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), stats=index.stats)
+    bm25f = BM25FRetrieval(index.index, IdentityPreprocessor(), index.stats)
+    impact = ImpactRetrieval(ImpactIndex(str(tmp_path / 'index.impact')), IdentityPreprocessor())
+    models = [(tfidf, tfidf.compute_tfidf_scores), (bm25f, bm25f.compute_bm25f_scores),
+              (impact, impact.compute_scores)]
+    sparse_retrieval = SparseTFIDFRetrieval.from_index(index, IdentityPreprocessor())
+    models.append((sparse_retrieval, sparse_retrieval.compute_tfidf_scores))
+    for model, full_ranking in models:
+        for query in ['crew space heist', 'jungle station', 'missing']:
+            full = full_ranking(query)
+            # 以上一页最后一个结果为游标逐页读取，拼接后与完整排序相同，每页都给出完整结果的总数
+            pages, after = [], None
+            while True:
+                hits, total = model.page(query, 7, after)
+                assert total == len(full)
+                if not hits:
+                    break
+                pages.extend(hits)
+                after = (hits[-1][1], hits[-1][0])
+            assert pages == full
+    impact.index.close()
+
+
+def test_ranked_pages_served_from_cached_prefix():
+    index = build_random_index()
+    tfidf = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), stats=index.stats)
+    full = tfidf.compute_tfidf_scores('crew space')
+    calls = []
+
+    def page(size, after):
+        calls.append((size, after))
+        return tfidf.page('crew space', size, after)
+
+    cache = QueryResultCache()
+    key = ('tfidf', tfidf.normalize_query('crew space'))
+    # 第一页预取 20 个结果，之后的两页（游标与页码）都从缓存的前缀中切片
+    hits, total = cache.get_ranked_page(key, 1, page, 7, prefetch=20)
+    assert (hits, total) == (full[:7], len(full)) and len(calls) == 1
+    hits, _ = cache.get_ranked_page(key, 1, page, 7, after=(hits[-1][1], hits[-1][0]), prefetch=20)
+    assert hits == full[7:14] and cache.get_ranked_page(key, 1, page, 7, start=14, prefetch=20)[0] == full[14:21]
+    assert len(calls) == 2  # 第三页超出前缀，从前缀末尾继续计算一次
+    # 逐页读取到最后，与完整排序相同
+    pages, after = [], None
+    while True:
+        hits, _ = cache.get_ranked_page(key, 1, page, 7, after=after, prefetch=20)
+        if not hits:
+            break
+        pages.extend(hits)
+        after = (hits[-1][1], hits[-1][0])
+    assert pages == full and len(calls) <= 2 + len(full) // 20 + 1
+    # 超出缓存深度的页直接计算，缓存的前缀不超过 depth
+    cache = QueryResultCache()
+    assert cache.get_ranked_page(key, 1, page, 3, start=len(full) - 3, prefetch=20, depth=10)[0] == full[-3:]
+    assert len(cache.get(key, 1)[0]) == 10
+    assert cache.get_ranked_page(key, 1, page, 3, start=len(full) - 3, prefetch=20, depth=10)[0] == full[-3:]
+
+
+def test_static_prior_blended_into_ranking(tmp_path):
+    assert parse_num_votes('1.5K') == 1500 and parse_num_votes('2M') == 2000000 and parse_num_votes(None) == 0
+    # 评分相同时投票多的先验更高，没有评分的先验为 0
+    priors = compute_priors([(8.0, 100), (8.0, 100000), (None, 5000)])
+    assert priors[1] > priors[0] > 0 and priors[2] == 0
+
+    index = build_random_index()
+    rng = random.Random(3)
+    doc_ids = index.stats.doc_table.doc_ids
+    ratings = {doc_id: (round(rng.uniform(1, 10), 1), rng.choice([0, 50, 2000, 300000])) for doc_id in doc_ids}
+    write_prior(doc_ids, ratings, str(tmp_path / 'index.prior'))
+    prior = StaticPrior.load(str(tmp_path / 'index.prior')).aligned(index.stats.doc_table)
+    write_impact_index(index, str(tmp_path / 'index.impact'))
+
+    plain = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), stats=index.stats)
+    for weight in (1.0, 20.0):
+        tfidf = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), stats=index.stats,
+                               prior=prior, prior_weight=weight)
+        sparse_retrieval = SparseTFIDFRetrieval.from_index(index, IdentityPreprocessor(), prior=prior,
+                                                           prior_weight=weight)
+        impact = ImpactRetrieval(ImpactIndex(str(tmp_path / 'index.impact')), IdentityPreprocessor(),
+                                 prior=prior, prior_weight=weight)
+        for query in ['crew', 'crew space heist', 'alien city night bank clone jungle', 'jungle station']:
+            full = tfidf.compute_tfidf_scores(query)
+            # 只有匹配查询的文档得到先验，得分为相关度加上 weight * 先验
+            relevance = dict(plain.compute_tfidf_scores(query))
+            assert {doc_id for doc_id, _ in full} == relevance.keys()
+            assert all(score == relevance[doc_id] + weight * prior.get(doc_id) for doc_id, score in full)
+            sparse_scores = sparse_retrieval.compute_tfidf_scores(query)
+            assert all(math.isclose(a, b, rel_tol=1e-12) for (_, a), (_, b) in zip(sparse_scores, full))
+            impact_full = impact.compute_scores(query)
+            for k in (1, 5, 20):
+                assert tfidf.top_k(query, k) == full[:k]
+                assert impact.top_k(query, k) == impact_full[:k]
+        impact.index.close()
+    # 先验权重很大时排序由先验决定
+    bm25f = BM25FRetrieval(index.index, IdentityPreprocessor(), index.stats, prior=prior, prior_weight=1000.0)
+    ranked = [doc_id for doc_id, _ in bm25f.compute_bm25f_scores('crew')]
+    assert ranked[0] == max(ranked, key=prior.get)
+
+
+def test_similar_movies_neighbor_table(tmp_path):
+    rng = random.Random(11)
+    people = [f'person {i}' for i in range(30)]
+    words = ['heist', 'bank', 'alien', 'space', 'ship', 'jungle', 'robot', 'detective', 'murder', 'city']
+    documents = [{
+        'id': f'tt{i}', 'director': rng.choice(people[:10]), 'genres': rng.sample(['Action', 'Drama', 'Horror'], 1),
+        'cast_character': {name: '' for name in rng.sample(people, 3)}, 'keywords': rng.sample(words, 2),
+        'plot': ' '.join(rng.choice(words) for _ in range(8)),
+    } for i in range(120)]
+    matrix, doc_ids = build_feature_matrix(documents, preprocessor=IdentityPreprocessor(), max_df=0.5)
+    neighbors, scores = nearest_neighbors(matrix, num_neighbors=5, block_size=16)
+    write_neighbor_table(doc_ids, neighbors, scores, 5, str(tmp_path / 'index.similar'))
+    table = SimilarMovies(str(tmp_path / 'index.similar'))
+
+    # 与逐对计算的余弦相似度比较：按块计算的近邻就是相似度最高的 5 部电影（不含自身）
+    dense = matrix.toarray()
+    for doc_ord in (0, 17, 119):
+        cosine = dense @ dense[doc_ord]
+        expected = sorted((-cosine[j], j) for j in range(len(doc_ids)) if j != doc_ord and cosine[j] > 0)[:5]
+        similar = table.similar(doc_ids[doc_ord])
+        assert [doc_id for doc_id, _ in similar] == [doc_ids[j] for _, j in expected]
+        assert all(math.isclose(score, -value, rel_tol=1e-6) for (_, score), (value, _) in zip(similar, expected))
+    assert len(table.similar('tt0', 2)) == 2 and table.similar('missing') is None
+
+
+def test_lsa_ivf_search_and_hybrid_fusion(tmp_path):
+    index = build_random_index()
+    path = str(tmp_path / 'index.lsa.npz')
+    build_lsa_index(index, path, dims=4, num_lists=4)
+    dense = LSARetrieval(path, IdentityPreprocessor())
+    assert isinstance(dense.embeddings, np.memmap) and dense.num_lists == 4
+
+    # 扫描全部列表即暴力搜索；只扫描一个列表时结果是暴力搜索结果的子集
+    exact = dense.search_exact('crew space', 500)
+    assert dense.search('crew space', 500, nprobe=4) == exact
+    assert set(dense.search('crew space', 500, nprobe=1)) <= set(exact)
+    assert dense.search('missing', 10) == []
+
+    lexical = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), stats=index.stats)
+    hybrid = HybridRetrieval(lexical, dense, index.stats.doc_table, depth=20, rrf_k=60)
+    fused = hybrid.top_k('crew space', 200)
+    lexical_ranks = {doc_id: rank for rank, (doc_id, _) in enumerate(lexical.top_k('crew space', 20), 1)}
+    dense_ranks = {doc_id: rank for rank, (doc_id, _) in enumerate(dense.search('crew space', 20), 1)}
+    assert {doc_id for doc_id, _ in fused} == set(lexical_ranks) | set(dense_ranks)
+    for doc_id, score in fused:
+        expected = sum(1.0 / (60 + ranks[doc_id]) for ranks in (lexical_ranks, dense_ranks) if doc_id in ranks)
+        assert math.isclose(score, expected)
+
+    # 按游标逐页读取与一次取出全部结果相同
+    for retrieval in (dense, hybrid):
+        pages, after = [], None
+        while True:
+            hits, total = retrieval.page('crew space', 7, after)
+            if not hits:
+                break
+            pages.extend(hits)
+            after = (hits[-1][1], hits[-1][0])
+        assert pages == retrieval.page('crew space', 500)[0] and len(pages) == total
@@ -0,0 +1,139 @@
+import math
+from array import array
+
+from indexer import MergedFieldsView, PositionalInvertedIndex
+from models import BM25FRetrieval, TFIDFRetrieval
+from segments import SegmentedIndex
+from static_prior import StaticPrior
+
+
+class IdentityPreprocessor:
+    def process_text(self, text):
+        return text.lower().split()
+
+
+def as_plain_dict(index):
+    return {field: {term: dict(docs) for term, docs in terms.items() if docs} for field, terms in index.index.items()}
+
+
+def test_add_update_delete(tmp_path):
+    index = SegmentedIndex(str(tmp_path / 'index'))
+    index.add_documents({
+        'tt0000001': {'title': ['taitoru'], 'plot': ['group', 'friend']},
+        'tt0000002': {'title': ['kyozetsu'], 'plot': ['haunt', 'hous']},
+    })
+    # 更新 tt0000001，删除 tt0000002
+    index.add_documents({'tt0000001': {'title': ['taitoru'], 'plot': ['heist']}})
+    index.delete_documents(['tt0000002'])
+
+    assert index.num_docs == 1
+    assert as_plain_dict(index) == {
+        'title': {'taitoru': {'tt0000001': [0]}},
+        'plot': {'heist': {'tt0000001': [0]}},
+    }
+    # 已删除与被替换的旧版本不计入集合统计
+    assert index.stats.num_docs == 1
+    assert index.stats.total_lengths['plot'] == 1
+    assert index.stats.avg_field_length('title') == 1.0
+
+    # 删除后重新加入的文档可以被检索到
+    index.add_documents({'tt0000002': {'title': ['kyozetsu']}})
+    assert index.index['title']['kyozetsu'] == {'tt0000002': [0]}
+
+
+def test_compaction_purges_tombstones(tmp_path):
+    index_dir = str(tmp_path / 'index')
+    index = SegmentedIndex(index_dir)
+    for i in range(4):
+        index.add_documents({f'tt000000{i}': {'title': ['movi', f'part{i}']}})
+    index.delete_documents(['tt0000001'])
+    before = as_plain_dict(index)
+
+    index.compact()
+    assert len(index.manifest['segments']) == 1
+    assert index.manifest['tombstones'] == {}
+    assert as_plain_dict(index) == before
+    assert index.num_docs == 3
+    assert index.stats.total_lengths['title'] == 6
+
+    # 其他进程重新打开目录得到相同的结果
+    assert as_plain_dict(SegmentedIndex(index_dir)) == before
+
+
+def test_bm25f_follows_segment_updates(tmp_path):
+    documents = {
+        'tt0000001': {'title': ['alien'], 'plot': ['alien', 'ship', 'crew']},
+        'tt0000002': {'title': ['heist'], 'plot': ['bank', 'crew']},
+    }
+    index = SegmentedIndex(str(tmp_path / 'index'))
+    index.add_documents(documents)
+    bm25f = BM25FRetrieval(index.index, IdentityPreprocessor(), source=index)
+
+    def expected(query):
+        # 由当前存活的文档重新建立的内存索引
+        fresh = PositionalInvertedIndex()
+        fresh.build_index(documents)
+        return dict(BM25FRetrieval(fresh.index, IdentityPreprocessor(), fresh.stats).compute_bm25f_scores(query))
+
+    def check(query):
+        hits, total = bm25f.page(query, 10)
+        assert total == len(expected(query))
+        for doc_id, score in hits:
+            assert math.isclose(score, expected(query)[doc_id])
+
+    check('alien crew')
+    # 写入新段后，新文档的序号超出了旧快照的文档表
+    documents['tt0000003'] = {'title': ['alien'], 'plot': ['alien', 'alien', 'planet']}
+    index.add_documents({'tt0000003': documents['tt0000003']})
+    check('alien crew')
+    # 删除并合并后序号重新分配
+    index.delete_documents(['tt0000001'])
+    del documents['tt0000001']
+    check('alien crew')
+    index.compact()
+    check('alien crew')
+    assert [doc_id for doc_id, _ in bm25f.compute_bm25f_scores('alien')] == ['tt0000003']
+
+
+def test_tfidf_follows_segment_updates(tmp_path):
+    index = SegmentedIndex(str(tmp_path / 'index'))
+    index.add_documents({'tt0000001': {'plot': ['alien', 'crew']}, 'tt0000002': {'plot': ['bank', 'crew']}})
+    retrieval = TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), source=index)
+    index.add_documents({'tt0000003': {'plot': ['alien', 'planet']}})
+    assert retrieval.N == 3
+    # idf 使用当前的文档数：ln(3 / (2 + 1)) + 1 = 1
+    assert retrieval.compute_tfidf_scores('alien') == [('tt0000001', 1.0), ('tt0000003', 1.0)]
+    assert retrieval.page('alien', 1, after=(1.0, 'tt0000001')) == ([('tt0000003', 1.0)], 2)
+
+    index.delete_documents(['tt0000001'])
+    index.compact()
+    assert retrieval.N == 2
+    assert retrieval.page('alien', 10) == (retrieval.compute_tfidf_scores('alien'), 1)
+    assert retrieval.top_k('alien', 10)[0][0] == 'tt0000003'
+
+
+def test_prior_follows_compaction(tmp_path):
+    index = SegmentedIndex(str(tmp_path / 'index'))
+    for i in range(4):
+        index.add_documents({f'tt000000{i}': {'plot': ['heist', f'part{i}']}})
+    # 先验按文档ID给出，顺序与索引的文档表不同
+    doc_ids = ['tt0000003', 'tt0000002', 'tt0000001', 'tt0000000']
+    prior = StaticPrior(array('f', [0.4, 0.3, 0.2, 0.1]), doc_ids)
+    models = [
+        TFIDFRetrieval(MergedFieldsView(index.index), IdentityPreprocessor(), source=index, prior=prior),
+        BM25FRetrieval(index.index, IdentityPreprocessor(), source=index, prior=prior),
+    ]
+
+    def check():
+        for model in models:
+            hits, _ = model.page('heist', 10)
+            scores = dict(hits)
+            # 相关度相同，得分差等于先验之差
+            assert [doc_id for doc_id, _ in hits] == sorted(scores, key=prior.get, reverse=True)
+            assert math.isclose(scores['tt0000003'] - scores['tt0000002'], 0.1, rel_tol=1e-5)
+
+    check()
+    index.delete_documents(['tt0000000', 'tt0000001'])
+    index.compact()
+    check()
+    assert models[0].top_k('heist', 1)[0][0] == 'tt0000003'
@@ -1,13 +1,22 @@
-from collections import defaultdict
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import base64
+import json
 import logging
-from SearchModule.models import TFIDFRetrieval
+import os
+from SearchModule.models import BM25FRetrieval, TFIDFRetrieval
 from database import Database
 from movie_search import MovieSearch
 from SearchModule.search import QueryProcessor
+from SearchModule.query_parser import is_boolean_query, normalized_query
+from SearchModule.result_cache import QueryResultCache
 from SearchModule.preprocessor import TextPreprocessor
-from SearchModule.indexer import PositionalInvertedIndex
+from SearchModule.indexer import MergedFieldsView, open_index
+from SearchModule.sparse_scoring import SPARSE_AVAILABLE, SparseTFIDFRetrieval
+from SearchModule.impact_index import ImpactIndex, ImpactRetrieval
+from SearchModule.static_prior import StaticPrior
+from SearchModule.similar_movies import SimilarMovies
+from SearchModule.lsa_index import LSA_AVAILABLE, HybridRetrieval, LSARetrieval
 
 # 配置日志系统
 # 设置日志级别为INFO，格式默认为：级别:日志器名称:消息
@@ -24,24 +33,198 @@ movie_search = MovieSearch(db)  # 电影搜索服务
 
 # 初始化搜索相关组件（在Flask应用初始化之后）
 search_preprocessor = TextPreprocessor(remove_stop_words=True, apply_stemming=True)
-index = PositionalInvertedIndex() 
-index.load_index('D:\OneDrive\文档\Yilin\Edinburgh\Text Technologies\Movie-ClassiSearch\SearchModule\index.txt')
+# 二进制索引（convert_index.py 生成）以 mmap 方式按需解码，多个工作进程共享页缓存；文本索引则完整加载
+INDEX_PATH = 'D:\OneDrive\文档\Yilin\Edinburgh\Text Technologies\Movie-ClassiSearch\SearchModule\index.txt'
+index = open_index(INDEX_PATH)
+# 载入建索引时保存的词干映射（build_index.py 生成的二进制索引），查询词的词干提取只需一次字典查找
+search_preprocessor.stem_cache.load_from_index(INDEX_PATH)
 query_processor = QueryProcessor(
     preprocessor=search_preprocessor,
     index=index
 )
-# 创建统一的检索索引（合并所有字段）
-retrieval_index = defaultdict(lambda: defaultdict(list))
+# 创建统一的检索索引（按词项合并所有字段，访问时才合并）
+retrieval_index = MergedFieldsView(index.index)
 
-# 遍历多字段索引结构 {field: {term: {docID: [positions]}}}
-for field, terms in index.index.items():
-    for term, doc_dict in terms.items():
-        for doc_id, positions in doc_dict.items():
-            # 将不同字段的相同term合并到统一索引
-            retrieval_index[term][doc_id].extend(positions)
+# 载入索引时即构建各字段的词项数组与 k-gram 索引（通配符与模糊查询使用）
+query_processor.build_term_dictionaries()
+
+# 查询词不在索引中时用最相近的几个词项代替（拼写错误、音译名）
+fuzzy_lookup = lambda term, deadline: query_processor.fuzzy_terms(term, deadline=deadline, limit=5)
+
+# 静态先验（static_prior.py 或 build_index.py --prior 生成）：由 IMDb 评分与投票数计算，与相关度混合排序；
+# 布尔查询也按先验排序，不再查询数据库中的评分。各排序模型查询时按索引当前的文档表对齐（分段索引合并后序号会变化）
+PRIOR_PATH = os.path.splitext(INDEX_PATH)[0] + '.prior'
+static_prior = StaticPrior.load(PRIOR_PATH) if os.path.exists(PRIOR_PATH) else None
 
 # 创建TF-IDF检索对象
-retrieval = TFIDFRetrieval(retrieval_index, search_preprocessor)
+retrieval = TFIDFRetrieval(
+    retrieval_index, search_preprocessor, source=index,
+    fuzzy=fuzzy_lookup, fuzzy_budget=query_processor.fuzzy_budget, prior=static_prior,
+)
+# 创建BM25F检索对象（按字段加权并做长度归一化，字段长度随索引保存）；
+# 每次查询读取索引当前的统计，分段索引增量写入或合并后不会使用旧的文档序号与字段长度
+bm25f = BM25FRetrieval(
+    index.index, search_preprocessor, source=index,
+    fuzzy=fuzzy_lookup, fuzzy_budget=query_processor.fuzzy_budget, prior=static_prior,
+)
+# 普通（非布尔）查询可选的排序模型：model 参数 -> 检索对象（提供 normalize_query 与 page）
+RANKING_MODELS = {
+    'tfidf': retrieval,
+    'bm25f': bm25f,
+}
+DEFAULT_MODEL = 'tfidf'
+# 由离线文件构建的排序模型：model 参数 -> (检索对象, 生成文件时索引的文档ID, 文件路径)。
+# 它们不随分段索引的写入、删除与合并更新，只在索引的文档表与生成时一致时可选用（见 sync_ranking_models）
+OFFLINE_MODELS = {}
+
+# 稀疏矩阵 TF-IDF（build_index.py --tfidf-matrix 或 sparse_scoring.py 生成）：存在且与当前索引的文档一致时可选用
+TFIDF_MATRIX_PATH = os.path.splitext(INDEX_PATH)[0] + '.tfidf.npz'
+if SPARSE_AVAILABLE and os.path.exists(TFIDF_MATRIX_PATH):
+    sparse_retrieval = SparseTFIDFRetrieval.load(
+        TFIDF_MATRIX_PATH, search_preprocessor,
+        fuzzy=fuzzy_lookup, fuzzy_budget=query_processor.fuzzy_budget, prior=static_prior,
+    )
+    OFFLINE_MODELS['tfidf_sparse'] = (sparse_retrieval, sparse_retrieval.doc_ids, TFIDF_MATRIX_PATH)
+
+# 按影响值排序的索引（build_index.py --impact-index 或 impact_index.py 生成）：排序检索只读取量化后的影响值，不读取位置
+IMPACT_INDEX_PATH = os.path.splitext(INDEX_PATH)[0] + '.impact'
+if os.path.exists(IMPACT_INDEX_PATH):
+    impact_retrieval = ImpactRetrieval(
+        ImpactIndex(IMPACT_INDEX_PATH), search_preprocessor,
+        fuzzy=fuzzy_lookup, fuzzy_budget=query_processor.fuzzy_budget, prior=static_prior,
+    )
+    OFFLINE_MODELS['tfidf_impact'] = (impact_retrieval, impact_retrieval.index.doc_table.doc_ids, IMPACT_INDEX_PATH)
+
+# LSA 向量索引（lsa_index.py 或 build_index.py --lsa 生成）：lsa 只按语义相似度（IVF 近似）排序，
+# hybrid 用倒数排名融合合并 TF-IDF 与 LSA 的结果，自由文本查询不必与剧情中的词干完全一致
+LSA_MODEL_PATH = os.path.splitext(INDEX_PATH)[0] + '.lsa.npz'
+if LSA_AVAILABLE and os.path.exists(LSA_MODEL_PATH):
+    lsa_retrieval = LSARetrieval(LSA_MODEL_PATH, search_preprocessor)
+    OFFLINE_MODELS['lsa'] = (lsa_retrieval, lsa_retrieval.doc_ids, LSA_MODEL_PATH)
+    OFFLINE_MODELS['hybrid'] = (
+        HybridRetrieval(retrieval, lsa_retrieval, index.stats.doc_table), lsa_retrieval.doc_ids, LSA_MODEL_PATH,
+    )
+
+BASE_MODELS = dict(RANKING_MODELS)
+synced_version = None
+
+
+def sync_ranking_models():
+    """
+    索引版本变化后（分段索引写入、删除或合并）重新确定可选的排序模型：
+    离线模型的文档ID与索引当前的文档表一致且没有已删除的文档时可选用，否则停用，直到重新生成文件
+    """
+    global RANKING_MODELS, synced_version
+    version = index.version
+    if version == synced_version:
+        return
+    doc_ids = list(index.stats.doc_table.doc_ids)
+    unchanged = not getattr(index, 'deleted_ords', None)
+    models = dict(BASE_MODELS)
+    for name, (model, model_doc_ids, path) in OFFLINE_MODELS.items():
+        if unchanged and list(model_doc_ids) == doc_ids:
+            models[name] = model
+        elif name in RANKING_MODELS or synced_version is None:
+            logger.warning(f"{path} does not match the current index; model {name} disabled")
+    RANKING_MODELS = models  # 整体替换，正在处理的请求仍使用旧的字典
+    synced_version = version
+
+
+sync_ranking_models()
+
+# 相似电影的近邻表（similar_movies.py 离线生成）：/api/movies/<id>/similar 直接按文档序号读取
+SIMILAR_PATH = os.path.splitext(INDEX_PATH)[0] + '.similar'
+similar_table = SimilarMovies(SIMILAR_PATH) if os.path.exists(SIMILAR_PATH) else None
+
+# 查询结果缓存：布尔查询保存排好序的完整ID列表，普通查询保存排序结果的前缀，翻页时直接切片；索引版本变化后自动失效
+result_cache = QueryResultCache(maxsize=1024, ttl=300)
+
+
+def order_by_score(doc_ids):
+    """按电影评分排序，只返回数据库中存在的电影ID"""
+    doc_ids = list(doc_ids)
+    if not doc_ids:
+        return []
+    placeholders = ','.join(['%s'] * len(doc_ids))
+    db.cursor.execute(
+        f"SELECT movies.id FROM movies WHERE movies.id IN ({placeholders}) ORDER BY movies.score DESC",
+        tuple(doc_ids))
+    return [row['id'] for row in db.cursor.fetchall()]
+
+
+def order_by_prior(doc_ids):
+    """按静态先验从高到低排序（先验相同时按文档序号），不访问数据库"""
+    ordinal = index.stats.doc_table.get
+    return sorted(doc_ids, key=lambda doc_id: (-static_prior.get(doc_id), ordinal(doc_id)))
+
+
+def boolean_doc_ids(node, key):
+    """
+    布尔查询的完整结果（按静态先验排序的ID列表，没有先验时按数据库中的电影评分排序），经过结果缓存
+    :param node: query_processor.prepare 得到的查询树
+    :param key: 缓存键 ('boolean', 规范化后的查询)，同一查询的不同写法与不同分页共用同一条缓存
+    """
+    order = order_by_prior if static_prior is not None else order_by_score
+    compute = lambda: order(query_processor.evaluate(node) if node is not None else [])
+    return result_cache.get_or_compute(key, index.version, compute)
+
+
+def ranked_page(query, model, size, after=None, start=0):
+    """
+    普通查询按相关度排序的一页，从结果缓存中该查询的排序前缀切片，前缀不够长时才继续检索
+    :param size: 需要的结果数（从 after 之后开始）
+    :param after: 上一页最后一个结果的 (得分, 文档ID)，None 表示从第 start 个结果开始
+    :return: ([(doc_id, score)], 结果总数)
+    """
+    retrieval_model = RANKING_MODELS[model]
+    key = (model, retrieval_model.normalize_query(query))
+    return result_cache.get_ranked_page(
+        key, index.version, lambda n, cursor: retrieval_model.page(query, n, cursor), size, after, start,
+    )
+
+
+def fetch_movie_details(doc_ids):
+    """用单个SQL查询获取电影的详细信息，保持给定的顺序，数据库中不存在的电影被跳过"""
+    if not doc_ids:
+        return []
+    placeholders = ','.join(['%s'] * len(doc_ids))
+    sql = f"""
+        SELECT movies.*, 
+            GROUP_CONCAT(DISTINCT actors.name) as actors,
+            GROUP_CONCAT(DISTINCT genres.name) as genres
+        FROM movies
+        LEFT JOIN movie_cast ON movies.id = movie_cast.movie_id
+        LEFT JOIN actors ON movie_cast.actor_id = actors.id
+        LEFT JOIN movie_genres ON movies.id = movie_genres.movie_id
+        LEFT JOIN genres ON movie_genres.genre_id = genres.id
+        WHERE movies.id IN ({placeholders})
+        GROUP BY movies.id
+    """
+    db.cursor.execute(sql, tuple(doc_ids))
+    rows = {movie['id']: movie for movie in db.cursor.fetchall()}
+    movies = [rows[doc_id] for doc_id in doc_ids if doc_id in rows]
+    # 处理日期格式
+    for movie in movies:
+        if movie['release_date']:
+            movie['release_date'] = movie['release_date'].strftime('%Y-%m-%d')
+    return movies
+
+
+def encode_cursor(state):
+    """分页游标：JSON 经 URL 安全的 base64 编码，对客户端不透明"""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """:raises ValueError: 游标无法解析"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(state, dict) or not isinstance(state.get('offset'), int):
+        raise ValueError('Invalid cursor')
+    return state
+
 
 @app.route('/api/search', methods=['GET'])
 def search():
@@ -96,78 +279,123 @@ def get_genres():
         logger.error(f"Get genres error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/movies/<movie_id>/similar', methods=['GET'])
+def get_similar_movies(movie_id):
+    """相似电影（more-like-this）
+    参数：
+    - limit: 返回的电影数（默认10，最多为近邻表中每部电影保存的近邻数）
+    近邻由 similar_movies.py 按导演、演员、类型、关键词与剧情离线计算，查询时直接读取近邻表
+    """
+    try:
+        if similar_table is None:
+            return jsonify({'error': 'Similar-movies table is not available'}), 503
+        limit = int(request.args.get('limit', 10))
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        neighbors = similar_table.similar(movie_id, limit)
+        if neighbors is None:
+            return jsonify({'error': f'Unknown movie: {movie_id}'}), 404
+        similarity = dict(neighbors)
+        movies = fetch_movie_details([doc_id for doc_id, _ in neighbors])
+        for movie in movies:
+            movie['similarity'] = similarity[movie['id']]
+        return jsonify({'movie_id': movie_id, 'results': movies})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Similar movies error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 # 在现有路由之后添加新的搜索端点
 @app.route('/api/v2/search', methods=['GET'])
 def advanced_search():
-    """高级搜索接口"""
+    """高级搜索接口
+    参数：
+    - query: 查询（支持字段限定、AND/OR/NOT、括号、短语、邻近、通配符与模糊查询）
+    - page: 分页页码（默认1）
+    - page_size: 每页结果数（默认10）
+    - model: 普通查询的排序模型，tfidf（默认）、bm25f，以及需要预先生成的 tfidf_sparse（稀疏矩阵）、tfidf_impact（按影响值排序的索引）、
+             lsa（LSA 向量）、hybrid（TF-IDF 与 LSA 的融合）
+    - cursor: 上一次响应中的 next_cursor，用于继续翻页（优先于 page）
+    返回 total（命中总数）与 next_cursor（没有更多结果时为 null）；普通查询只选出所需的前几个结果，不对全部命中排序
+    """
     try:
         query = request.args.get('query', '')
         if not query:
             return jsonify({'error': 'Missing required parameter: query'}), 400
+        # 分段索引目录可能被增量写入进程更新，查询前检查是否有新的段，并停用与新的文档表不一致的离线模型
+        if hasattr(index, 'refresh'):
+            index.refresh()
+        sync_ranking_models()
+
+        model = request.args.get('model', DEFAULT_MODEL).lower()
+        if model not in RANKING_MODELS:
+            return jsonify({'error': f"Unknown model: {model}. Use one of: {', '.join(RANKING_MODELS)}"}), 400
 
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('page_size', 10))
-        
-        # 判断搜索类型
-        has_advanced = any(
-            field in query for field in ['title:', 'director:', 'plot:', 'cast:']
-        ) or any(
-            op in query for op in [' AND ', ' OR ']
-        ) or '"' in query
-
-        # 获取原始结果（ID列表）
-        if has_advanced:
-            raw_results = query_processor.query(query)  # 返回ID列表
+        if page < 1 or page_size < 1:
+            return jsonify({'error': 'page and page_size must be positive'}), 400
+        cursor = request.args.get('cursor')
+
+        if is_boolean_query(query):  # 字段限定、AND/OR/NOT、括号或短语：按先验或电影评分排序，完整结果来自缓存
+            node = query_processor.prepare(query)
+            key = ['boolean', normalized_query(node)]
         else:
-            # 使用普通搜索获取ID列表
-            retrieval_results = retrieval.compute_tfidf_scores(query)
-            raw_results = [result[0] for result in retrieval_results]
-
-        # 统一获取详细信息
-        if raw_results:
-            # 使用单个SQL查询获取所有详细信息
-            placeholders = ','.join(['%s'] * len(raw_results))
-            sql = f"""
-                SELECT movies.*, 
-                    GROUP_CONCAT(DISTINCT actors.name) as actors,
-                    GROUP_CONCAT(DISTINCT genres.name) as genres
-                FROM movies
-                LEFT JOIN movie_cast ON movies.id = movie_cast.movie_id
-                LEFT JOIN actors ON movie_cast.actor_id = actors.id
-                LEFT JOIN movie_genres ON movies.id = movie_genres.movie_id
-                LEFT JOIN genres ON movie_genres.genre_id = genres.id
-                WHERE movies.id IN ({placeholders})
-                GROUP BY movies.id
-                ORDER BY movies.score DESC
-            """
-            db.cursor.execute(sql, tuple(raw_results))
-            results = db.cursor.fetchall()
+            key = [model, RANKING_MODELS[model].normalize_query(query)]
+        state = None
+        if cursor:
+            state = decode_cursor(cursor)
+            if state.get('key') != key or state['offset'] < 0:
+                raise ValueError('Cursor does not belong to this query')
+            if key[0] != 'boolean' and not ('score' in state and 'doc_id' in state):
+                raise ValueError('Invalid cursor')
+        start = state['offset'] if state else (page - 1) * page_size
+
+        hits = None
+        if key[0] == 'boolean':
+            ranked = boolean_doc_ids(node, tuple(key))
+            total = len(ranked)
+            page_ids = ranked[start:start + page_size]
+        elif state:
+            # 游标携带上一页最后一个结果的 (得分, 文档ID)，只需选出其后的 page_size 个结果
+            hits, total = ranked_page(query, model, page_size, (state['score'], state['doc_id']))
+            page_ids = [doc_id for doc_id, _ in hits]
         else:
-            results = []
-        
-        # 统一分页处理
-        total = len(results)
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_results = results[start:end]
+            # 按页码访问：在缓存的排序前缀中取第 start 个结果起的一页
+            hits, total = ranked_page(query, model, page_size, start=start)
+            page_ids = [doc_id for doc_id, _ in hits]
+
+        next_cursor = None
+        if page_ids and start + len(page_ids) < total:
+            next_state = {'key': key, 'offset': start + len(page_ids)}
+            if hits:
+                next_state['score'], next_state['doc_id'] = hits[-1][1], hits[-1][0]
+            next_cursor = encode_cursor(next_state)
 
-        # 处理日期格式
-        for movie in paginated_results:
-            if movie['release_date']:
-                movie['release_date'] = movie['release_date'].strftime('%Y-%m-%d')
+        # 只为当前页获取详细信息
+        paginated_results = fetch_movie_details(page_ids)
 
         return jsonify({
             'total': total,
-            'page': page,
+            'page': start // page_size + 1,
             'page_size': page_size,
             'total_pages': (total + page_size - 1) // page_size,
+            'next_cursor': next_cursor,
             'results': paginated_results
         })
-        
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Advanced search error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v2/search/cache', methods=['GET'])
+def search_cache_stats():
+    """查询结果缓存的命中统计"""
+    return jsonify(result_cache.info())
+
 # 错误处理handler
 @app.errorhandler(404)
 def not_found(error):